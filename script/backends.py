@@ -0,0 +1,267 @@
+"""Decompression backends of gz and bz2 files.
+
+A backend is a python module (zlib, isal, bz2) or a command (zcat, pigz,
+igzip, lbzip2). Commands are found once per process, and the fastest
+available backend of a format is measured once per process on the first
+file of the format, unless a backend is given by name.
+"""
+from collections import OrderedDict
+import bz2
+import gzip
+import io
+import os
+import shutil
+import subprocess
+import time
+import zlib
+
+BACKENDS = OrderedDict()
+# paths of commands, importable modules and fastest backend of formats in
+# this process
+_which = {}
+_modules = {}
+_fastest = {}
+
+
+class Read1Raw(io.RawIOBase):
+    """Raw stream of a decompressing file by its read1.
+
+    Lines of io.BufferedReader over it are split in C, and read1 only
+    gives what one decompressing step gives, so data before trailing
+    garbage is not lost.
+    """
+
+    def __init__(self, handle):
+        """Init class."""
+        super(Read1Raw, self).__init__()
+        self.handle = handle
+
+    def readable(self):
+        """Return True."""
+        return True
+
+    def readinto(self, buf):
+        """Read into buf, return the size."""
+        data = self.handle.read1(len(buf))
+        buf[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        """Close file."""
+        if not self.closed:
+            self.handle.close()
+        super(Read1Raw, self).close()
+
+
+class Backend(object):
+    """Backend decompressed by a python module."""
+
+    def __init__(self, name, suffixes, opener, module=None):
+        """Init class.
+
+        opener(filename, mode) opens file, module is the module which must
+        be importable to use the backend.
+        """
+        self.name = name
+        self.suffixes = suffixes
+        self.opener = opener
+        self.module = module
+        self.command = None
+
+    def available(self):
+        """Check whether backend can be used."""
+        if self.module is None:
+            return True
+        if self.module not in _modules:
+            try:
+                __import__(self.module)
+                _modules[self.module] = True
+            except ImportError:
+                _modules[self.module] = False
+        return _modules[self.module]
+
+    def open(self, filename, text=True):
+        """Open file, return (handle, None).
+
+        Binary handle is a io.BufferedReader, so reading lines is fast.
+        """
+        if text:
+            return self.opener(filename, 'rt'), None
+        handle = self.opener(filename, 'rb')
+        if not isinstance(handle, io.BufferedReader):
+            handle = io.BufferedReader(Read1Raw(handle), 1 << 20)
+        return handle, None
+
+    def only_garbage(self, lines, filename=None):
+        """Check whether stderr lines of command only warn trailing garbage."""
+        return False
+
+
+class CommandBackend(Backend):
+    """Backend decompressed by a subprocess."""
+
+    def __init__(self, name, suffixes, command, garbage_warning=None):
+        """Init class.
+
+        command is args without file name, garbage_warning is the end of
+        stderr if the command fails only because of trailing garbage. If
+        stderr does not end with it (e.g. it is unknown), gz file is
+        checked by zlib for trailing garbage.
+        """
+        super(CommandBackend, self).__init__(name, suffixes, None)
+        self.command = command
+        self.garbage_warning = garbage_warning
+
+    def available(self):
+        """Check whether command is found in PATH."""
+        return which(self.command[0]) is not None
+
+    def open(self, filename, text=True):
+        """Start command, return (binary stdout, process)."""
+        process = subprocess.Popen(
+            [which(self.command[0])] + self.command[1:] + [filename],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        return process.stdout, process
+
+    def only_garbage(self, lines, filename=None):
+        """Check whether stderr lines of command only warn trailing garbage."""
+        if self.garbage_warning and lines and \
+                lines[-1].endswith(self.garbage_warning):
+            return True
+        return bool(filename and filename.endswith('.gz') and
+                    gzip_garbage(filename))
+
+
+def gzip_garbage(filename, size=1 << 20):
+    """Check whether gz file is complete members and trailing garbage."""
+    decompressor = None
+    rest = b''
+    with open(filename, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(size), b''):
+            chunk = rest + chunk
+            rest = b''
+            while chunk:
+                if decompressor is None:
+                    # like gzip, zeros after a member are padding
+                    chunk = chunk.lstrip(b'\x00')
+                    if len(chunk) < 2:
+                        rest = chunk
+                        break
+                    if chunk[:2] != b'\x1f\x8b':
+                        return True
+                    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                try:
+                    decompressor.decompress(chunk)
+                except zlib.error:
+                    return False
+                if not decompressor.eof:
+                    break
+                chunk = decompressor.unused_data
+                decompressor = None
+    # a byte after the last member is garbage too
+    return decompressor is None and bool(rest)
+
+
+def _isal_open(filename, mode):
+    """Open gz file by isal."""
+    from isal import igzip
+    return igzip.open(filename, mode)
+
+
+def register(backend):
+    """Add backend, the former one is preferred if they are as fast."""
+    BACKENDS[backend.name] = backend
+    for key in list(_fastest):
+        if key[0] in backend.suffixes:
+            del _fastest[key]
+
+
+def which(command):
+    """Get path of command or None, it is found once per process."""
+    if command not in _which:
+        _which[command] = shutil.which(command)
+    return _which[command]
+
+
+def file_format(filename):
+    """Get compressed format of file, '' for plain file."""
+    for suffix in ('.gz', '.bz2'):
+        if filename.endswith(suffix):
+            return suffix
+    return ''
+
+
+def available(fmt, commands=True):
+    """Get available backends of format."""
+    return [x for x in BACKENDS.values() if fmt in x.suffixes and
+            x.available() and (commands or x.command is None)]
+
+
+def measure(backend, filename, size=1 << 23):
+    """Get seconds to decompress size bytes (or whole file) by backend."""
+    start = time.perf_counter()
+    handle, process = backend.open(filename, text=False)
+    try:
+        left = size
+        while left > 0:
+            data = handle.read(min(left, 1 << 20))
+            if not data:
+                break
+            left -= len(data)
+    finally:
+        handle.close()
+        if process is not None:
+            process.kill()
+            process.wait()
+            process.stderr.close()
+    return time.perf_counter() - start
+
+
+def fastest(fmt, sample=None, commands=True):
+    """Get the fastest backend of format, measured on sample once."""
+    key = (fmt, commands)
+    if key not in _fastest:
+        candidates = available(fmt, commands)
+        if not candidates:
+            raise ValueError('Can not find backend for %s file!' % (
+                fmt or 'plain'))
+        best = candidates[0]
+        if len(candidates) > 1 and sample is not None and \
+                os.path.getsize(sample):
+            timings = []
+            # the former backend is preferred if they are as fast
+            for index, backend in enumerate(candidates):
+                try:
+                    timings.append((measure(backend, sample), index))
+                except (OSError, EOFError, ValueError):
+                    pass
+            if timings:
+                best = candidates[min(timings)[1]]
+        _fastest[key] = best.name
+    return BACKENDS[_fastest[key]]
+
+
+def select(filename, backend=None, commands=True):
+    """Get backend of file by name, or the fastest one.
+
+    If commands is False, only python backends are used.
+    """
+    if backend is not None:
+        if backend not in BACKENDS:
+            raise ValueError('Unknown backend %s!' % backend)
+        if not BACKENDS[backend].available():
+            raise ValueError('Backend %s is not available!' % backend)
+        return BACKENDS[backend]
+    return fastest(file_format(filename), filename, commands)
+
+
+register(Backend('plain', ('', ), open))
+register(Backend('zlib', ('.gz', ), gzip.open))
+register(Backend('isal', ('.gz', ), _isal_open, 'isal'))
+register(CommandBackend('zcat', ('.gz', ), ['zcat'],
+                        b'decompression OK, trailing garbage ignored\n'))
+register(CommandBackend('pigz', ('.gz', ), ['pigz', '-dc'],
+                        b'trailing junk was ignored\n'))
+register(CommandBackend('igzip', ('.gz', ), ['igzip', '-dc']))
+register(Backend('bz2', ('.bz2', ), bz2.open))
+register(CommandBackend('lbzip2', ('.bz2', ), ['lbzip2', '-dc']))
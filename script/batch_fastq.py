@@ -0,0 +1,107 @@
+"""Check batch of fastq reads by numpy arrays."""
+import numpy
+
+# ascii code lookup tables
+BASES = numpy.zeros(256, dtype=bool)
+BASES[numpy.frombuffer(b'ATGCNatgcn0123', dtype=numpy.uint8)] = True
+
+
+def join_lines(lines):
+    """Join str or bytes lines to an uint8 array."""
+    if isinstance(lines[0], bytes):
+        data = b''.join(lines)
+    else:
+        # UnicodeEncodeError for non ascii lines
+        data = ''.join(lines).encode('ascii')
+    return numpy.frombuffer(data, dtype=numpy.uint8)
+
+
+def line_lengths(lines):
+    """Get lengths of lines."""
+    return numpy.fromiter(map(len, lines), dtype=numpy.int64,
+                          count=len(lines))
+
+
+def segment_sum(values, lengths):
+    """Sum values of each segment, segment can be empty."""
+    cumsum = numpy.zeros(len(values) + 1, dtype=numpy.int64)
+    numpy.cumsum(values, out=cumsum[1:])
+    ends = numpy.cumsum(lengths)
+    return cumsum[ends] - cumsum[ends - lengths]
+
+
+class ReadBatch(object):
+    """Hold lines of a batch of reads as numpy arrays.
+
+    It only supports batch whose reads all have 4 lines and none empty
+    header, 3rd or 4th line, valid is False for others so that they can be
+    checked by SingleRead one by one.
+    """
+
+    phredrange = (33, 126)
+    phredQ = (58, 75)
+
+    def __init__(self, records):
+        """Init class."""
+        self.records = records
+        try:
+            self.valid = self._load()
+        except UnicodeEncodeError:
+            self.valid = False
+
+    def _load(self):
+        """Load lines to arrays."""
+        if not self.records or any(
+                x is None or len(x) != 4 for x in self.records):
+            return False
+        heads, seqs, pluses, quals = zip(*self.records)
+        head_len = line_lengths(heads)
+        plus_len = line_lengths(pluses)
+        self.qual_len = line_lengths(quals)
+        if not (head_len.all() and plus_len.all() and self.qual_len.all()):
+            return False
+        self.heads = heads
+        self.seq_len = line_lengths(seqs)
+        # the first char of lines
+        head_first = join_lines(heads)[numpy.cumsum(head_len) - head_len]
+        plus_first = join_lines(pluses)[numpy.cumsum(plus_len) - plus_len]
+        self.seq = join_lines(seqs)
+        self.qual = join_lines(quals)
+        wrong_base = segment_sum(~BASES[self.seq], self.seq_len) > 0
+        starts = numpy.cumsum(self.qual_len) - self.qual_len
+        self.qmin = numpy.minimum.reduceat(self.qual, starts)
+        self.qmax = numpy.maximum.reduceat(self.qual, starts)
+        self.wrong = wrong_base | (head_first != ord('@')) | \
+            (plus_first != ord('+')) | (self.seq_len != self.qual_len) | \
+            (self.qmin < self.phredrange[0]) | \
+            (self.qmax > self.phredrange[1])
+        return True
+
+    @property
+    def names(self):
+        """Get read names like SingleRead.readname."""
+        if isinstance(self.heads[0], bytes):
+            tab, space = b'\t', b' '
+        else:
+            tab, space = '\t', ' '
+        return [x.strip().partition(tab)[0].partition(space)[0]
+                for x in self.heads]
+
+    def base_count(self, end):
+        """Get base count of the first end reads."""
+        return int(self.seq_len[:end].sum())
+
+    def phreq_set(self, end):
+        """Get phreq of the first read which can tell it."""
+        qmin, qmax = self.qmin[:end], self.qmax[:end]
+        index = numpy.flatnonzero(
+            (qmin <= self.phredQ[0]) | (qmax >= self.phredQ[1]))
+        if not len(index):
+            return ''
+        return '33' if qmin[index[0]] <= self.phredQ[0] else '64'
+
+    def update_stats(self, stats, end):
+        """Add the first end reads to fastq_stats.FastqStats."""
+        seq_len, qual_len = self.seq_len[:end], self.qual_len[:end]
+        stats.update_arrays(self.seq[:seq_len.sum()], seq_len,
+                            self.qual[:qual_len.sum()], qual_len)
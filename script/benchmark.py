@@ -0,0 +1,333 @@
+"""Benchmark readers of fastq and CheckFastq on synthetic fastq.
+
+Every case runs in a new process, so peak RSS is measured per case. Results
+are written as json and can be compared with results of another version.
+"""
+import argparse
+import bz2
+import gzip
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import sys
+import time
+
+# format: suffix of generated file
+FORMATS = {'plain': '.fq', 'gz': '.fq.gz', 'mgz': '.fq.gz', 'bz2': '.fq.bz2'}
+
+
+def make_fastq(path, reads, read_len=150, seed=0, mate=1):
+    """Write synthetic fastq, mates of the same seed are a pair."""
+    rand = random.Random(seed)
+    bases = 'ACGT' * 15 + 'N'
+    quals = ''.join(chr(x) for x in range(35, 75))
+    with open(path, 'wt') as wt:
+        for i in range(reads):
+            seq = ''.join(rand.choice(bases) for _ in range(read_len))
+            qual = ''.join(rand.choice(quals) for _ in range(read_len))
+            wt.write('@read%s/%s\n%s\n+\n%s\n' % (i, mate, seq, qual))
+
+
+def compress_fastq(plain, fmt, path, member=1 << 22):
+    """Compress plain fastq to path by fmt."""
+    if fmt == 'plain':
+        return plain
+    with open(plain, 'rb') as rd:
+        if fmt == 'gz':
+            with gzip.open(path, 'wb') as wt:
+                for data in iter(lambda: rd.read(member), b''):
+                    wt.write(data)
+        elif fmt == 'mgz':
+            # a member per chunk like BGZF or concatenated gz
+            with open(path, 'wb') as wt:
+                for data in iter(lambda: rd.read(member), b''):
+                    wt.write(gzip.compress(data))
+        elif fmt == 'bz2':
+            with bz2.open(path, 'wb') as wt:
+                for data in iter(lambda: rd.read(member), b''):
+                    wt.write(data)
+        else:
+            raise ValueError('Unknown format %s!' % fmt)
+    return path
+
+
+def prepare(workdir, reads, formats, read_len=150):
+    """Generate paired fastq of formats.
+
+    Return {fmt: (fastq1, fastq2)} and sizes of uncompressed fastq.
+    """
+    if not os.path.isdir(workdir):
+        os.makedirs(workdir)
+    files = {}
+    plains = []
+    for mate in (1, 2):
+        plain = os.path.join(workdir, 'bench_%s_%s_%s.fq' % (
+            reads, read_len, mate))
+        if not os.path.isfile(plain):
+            make_fastq(plain, reads, read_len, mate=mate)
+        plains.append(plain)
+    for fmt in formats:
+        paths = []
+        for plain in plains:
+            path = '%s_%s%s' % (plain[:-3], fmt, FORMATS[fmt])
+            if fmt == 'plain':
+                path = plain
+            elif not os.path.isfile(path):
+                compress_fastq(plain, fmt, path)
+            paths.append(path)
+        files[fmt] = tuple(paths)
+    return files, [os.path.getsize(x) for x in plains]
+
+
+def read_lines(fastq, **kwargs):
+    """Read lines by ReadGgBz2Normal."""
+    from read_gzbzfile import ReadGgBz2Normal
+    reads = 0
+    with ReadGgBz2Normal(fastq, **kwargs) as rd:
+        for _ in rd:
+            reads += 1
+    return reads // 4
+
+
+def read_records(fastq, **kwargs):
+    """Read records by ReadGgBz2Normal.read_fastq."""
+    from read_gzbzfile import ReadGgBz2Normal
+    reads = 0
+    with ReadGgBz2Normal(fastq, **kwargs) as rd:
+        for _ in rd.read_fastq():
+            reads += 1
+    return reads
+
+
+def read_blocks(fastq, **kwargs):
+    """Read binary blocks by ReadGgBz2Normal.read_fastq_block."""
+    from read_gzbzfile import ReadGgBz2Normal
+    reads = 0
+    with ReadGgBz2Normal(fastq, **kwargs) as rd:
+        for block in rd.read_fastq_block():
+            reads += len(block)
+    return reads
+
+
+def check_fastq(fastq1, fastq2=None, numpy=True, **kwargs):
+    """Check fastq by CheckFastq."""
+    import deal_fastq
+    if not numpy:
+        deal_fastq.batch_fastq = None
+    checkfastq = deal_fastq.CheckFastq(fastq1, fastq2, **kwargs)
+    return checkfastq.check_dict['read_count']
+
+
+def make_reads(fastq1, fastq2=None, **kwargs):
+    """Keep SingleRead/PairRead of all records like CheckFastq checks them.
+
+    Peak RSS of the case shows memory of the read objects.
+    """
+    from deal_fastq import PairRead, SingleRead
+    from read_gzbzfile import ReadGgBz2Normal
+    reads = []
+    with ReadGgBz2Normal(fastq1, **kwargs) as r1:
+        if fastq2 is None:
+            for i, lines in enumerate(r1.read_fastq()):
+                read = SingleRead(i, lines)
+                # get the lazy properties, so their values are kept by the
+                # read like CheckFastq keeps them
+                for name in ('base_count', 'phreq_set', 'error'):
+                    getattr(read, name)
+                reads.append(read)
+        else:
+            with ReadGgBz2Normal(fastq2, **kwargs) as r2:
+                for i, (lines1, lines2) in enumerate(zip(r1.read_fastq(),
+                                                         r2.read_fastq())):
+                    read = PairRead(i, lines1, lines2)
+                    # get the lazy properties like the single read
+                    for obj, name in ((read, 'pair_error'),
+                                      (read.read1, 'error'),
+                                      (read.read2, 'error')):
+                        getattr(obj, name)
+                    reads.append(read)
+    return len(reads)
+
+
+# name: (function, kwargs, formats, whether it reads a pair)
+CASES = {
+    'check_python': (check_fastq, {'dofast': 1, 'numpy': False}, None,
+                     False),
+    'check_numpy': (check_fastq, {'dofast': 1}, None, False),
+    'check_text': (check_fastq, {'dofast': 1, 'binary': False}, None, False),
+    'check_dofast10': (check_fastq, {'dofast': 10}, None, False),
+    'check_stats': (check_fastq, {'dofast': 1, 'stats': True}, None, False),
+    'check_pair': (check_fastq, {'dofast': 1}, None, True),
+    'check_processes4': (check_fastq, {'dofast': 1, 'processes': 4}, None,
+                         False),
+    'objects_single': (make_reads, {'binary': True}, ('plain', ), False),
+    'objects_pair': (make_reads, {'binary': True}, ('plain', ), True),
+}
+# formats of suffix of backend
+SUFFIX_FORMATS = {'': ('plain', ), '.gz': ('gz', 'mgz'), '.bz2': ('bz2', )}
+
+
+def add_reader_cases():
+    """Add cases of reader modes for every available backend."""
+    import backends
+    for mode, func in (('lines', read_lines), ('records', read_records),
+                       ('blocks', read_blocks)):
+        for backend in backends.BACKENDS.values():
+            if backend.available():
+                formats = sum((SUFFIX_FORMATS[x] for x in backend.suffixes),
+                              ())
+                CASES['%s_%s' % (mode, backend.name)] = (
+                    func, {'backend': backend.name}, formats, False)
+                if mode != 'blocks':
+                    # blocks are always bytes
+                    CASES['%s_%s_binary' % (mode, backend.name)] = (
+                        func, {'backend': backend.name, 'binary': True},
+                        formats, False)
+        CASES['%s_threads' % mode] = (func, {'threads': 4}, ('mgz', ), False)
+
+
+def peak_rss_mb():
+    """Get peak RSS of this process and its children in MB."""
+    rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+              resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # ru_maxrss is KB on linux and bytes on mac
+    return rss / (1024.0 * 1024 if sys.platform == 'darwin' else 1024.0)
+
+
+def _run_case(name, paths, conn):
+    """Run case in a new process, send result or error by conn."""
+    func, kwargs, _, _ = CASES[name]
+    try:
+        start = time.perf_counter()
+        reads = func(*paths, **kwargs)
+        conn.send((reads, time.perf_counter() - start, peak_rss_mb()))
+    except Exception:
+        import traceback
+        conn.send(traceback.format_exc())
+    finally:
+        conn.close()
+
+
+def run_case(name, fmt, paths, sizes, repeat=1):
+    """Run case repeat times, return result dict of the fastest run.
+
+    sizes are uncompressed sizes of paths.
+    """
+    pair = CASES[name][3]
+    paths, sizes = (paths, sizes) if pair else (paths[:1], sizes[:1])
+    context = multiprocessing.get_context('spawn')
+    runs = []
+    for _ in range(repeat):
+        # not a pool worker, the case can start its own processes
+        reader, writer = context.Pipe(False)
+        process = context.Process(target=_run_case,
+                                  args=(name, paths, writer))
+        process.start()
+        writer.close()
+        try:
+            run = reader.recv()
+        finally:
+            process.join()
+        if not isinstance(run, tuple):
+            raise RuntimeError('Case %s failed on %s:\n%s' % (
+                name, fmt, run))
+        runs.append(run)
+    reads, seconds, rss = min(runs, key=lambda x: x[1])
+    size = sum(os.path.getsize(x) for x in paths)
+    plain = sum(sizes)
+    return {
+        'case': name, 'format': fmt, 'reads': reads,
+        'seconds': round(seconds, 4),
+        'mb_per_s': round(plain / 1e6 / seconds, 2),
+        'compressed_mb_per_s': round(size / 1e6 / seconds, 2),
+        'reads_per_s': round(reads / seconds, 1),
+        'peak_rss_mb': round(rss, 1),
+        'seconds_all': [round(x[1], 4) for x in runs]}
+
+
+def run_benchmark(workdir, reads=100000, formats=('plain', 'gz', 'mgz',
+                  'bz2'), cases=None, repeat=1, read_len=150, log=None):
+    """Run cases on formats, return result dict."""
+    files, sizes = prepare(workdir, reads, formats, read_len)
+    results = []
+    for name in cases or sorted(CASES):
+        for fmt in formats:
+            if CASES[name][2] is not None and fmt not in CASES[name][2]:
+                continue
+            result = run_case(name, fmt, files[fmt], sizes, repeat)
+            results.append(result)
+            if log is not None:
+                log.write(
+                    '%(case)-18s %(format)-6s %(seconds)8.3fs'
+                    ' %(mb_per_s)8.2f MB/s %(reads_per_s)11.1f reads/s'
+                    ' %(peak_rss_mb)7.1f MB\n' % result)
+    return {
+        'meta': {
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'reads': reads, 'read_len': read_len, 'repeat': repeat},
+        'results': results}
+
+
+def compare(old, new, threshold=0.1):
+    """Get cases whose throughput drops more than threshold."""
+    old_results = dict(((x['case'], x['format']), x) for x in old['results'])
+    regressions = []
+    for result in new['results']:
+        key = (result['case'], result['format'])
+        if key not in old_results:
+            continue
+        ratio = result['mb_per_s'] / old_results[key]['mb_per_s']
+        if ratio < 1 - threshold:
+            regressions.append({
+                'case': key[0], 'format': key[1], 'ratio': round(ratio, 3),
+                'old_mb_per_s': old_results[key]['mb_per_s'],
+                'new_mb_per_s': result['mb_per_s']})
+    return regressions
+
+
+add_reader_cases()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(__doc__)
+    parser.add_argument('-w', '--workdir', default='bench_data',
+                        help='directory of synthetic fastq, default is'
+                             ' %(default)s')
+    parser.add_argument('-n', '--reads', type=int, default=100000,
+                        help='reads of every fastq, default is %(default)s')
+    parser.add_argument('-l', '--read-len', type=int, default=150,
+                        help='read length, default is %(default)s')
+    parser.add_argument('-f', '--formats', default='plain,gz,mgz,bz2',
+                        help='formats, default is %(default)s')
+    parser.add_argument('-c', '--cases',
+                        help='cases separated by comma, default is all of'
+                             ' %s' % ','.join(sorted(CASES)))
+    parser.add_argument('-r', '--repeat', type=int, default=1,
+                        help='run times of every case, the fastest is kept,'
+                             ' default is %(default)s')
+    parser.add_argument('-o', '--output', default='benchmark.json',
+                        help='json result, default is %(default)s')
+    parser.add_argument('--compare', help='json result of old version')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='allowed drop of MB/s, default is %(default)s')
+    args = parser.parse_args()
+    result = run_benchmark(
+        args.workdir, args.reads, args.formats.split(','),
+        args.cases.split(',') if args.cases else None, args.repeat,
+        args.read_len, sys.stdout)
+    with open(args.output, 'wt') as wt:
+        json.dump(result, wt, indent=2)
+    if args.compare:
+        with open(args.compare, 'rt') as rd:
+            regressions = compare(json.load(rd), result, args.threshold)
+        for item in regressions:
+            sys.stdout.write(
+                'Regression %(case)s %(format)s: %(old_mb_per_s)s ->'
+                ' %(new_mb_per_s)s MB/s (%(ratio)s)\n' % item)
+        sys.exit(1 if regressions else 0)
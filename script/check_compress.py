@@ -1,66 +1,396 @@
 """Check compressed file whether is complete."""
 
+import bz2
+import contextlib
+import io
+import lzma
+import multiprocessing
 import os
 import subprocess
+import tarfile
+import time
+import warnings
+import zlib
+
+import instrument
+from timeout import register_process
+try:
+    import zstandard
+    ZSTD_ERRORS = (zstandard.ZstdError, )
+except ImportError:
+    zstandard = None
+    ZSTD_ERRORS = ()
 
 
 class CheckCompress(object):
     """Check compressed file wheher is complete."""
 
     def __init__(self, infile, gzippath='gzip', bz2path='bzip2'):
-        """Init class."""
+        """Init class.
+
+        gzippath and bz2path are deprecated, files are verified in process
+        instead of by the commands.
+        """
         self.infile = infile
         if not os.path.isfile(infile):
             raise ValueError("Can not find file %s!" % infile)
+        if gzippath != 'gzip' or bz2path != 'bzip2':
+            warnings.warn('gzippath and bz2path of CheckCompress are '
+                          'deprecated and not used', DeprecationWarning, 2)
         self.gzippath = gzippath
         self.bz2path = bz2path
         self.error = ""
 
     def check(self):
         """Check compressed file."""
-        func = ('.gz', '.zip', '.bz2')
-        file_ext = os.path.splitext(self.infile)[1]
-        if file_ext in func:
-            ret = getattr(self, 'check_%s' % (file_ext.lstrip('.')))()
-        else:
+        if file_format(self.infile) is None:
             raise ValueError("Can not find check compressed method for %s!",
                              self.infile)
-        return ret
+        return self.verify().ok
+
+    def verify(self):
+        """Check compressed file in process, return VerifyResult."""
+        result = verify_file(self.infile)
+        if not result.ok:
+            self.error = result.message
+        return result
 
     def check_zip(self):
-        """Unzip -t file."""
-        import zipfile
-        zip_file = zipfile.ZipFile(self.infile)
-        ret = zip_file.testzip()
-        if ret is not None:
-            return False
-            self.error = 'Failed to test for zip file %s!' % self.infile
-        else:
-            return True
+        """Test CRC of zip file like 'unzip -t'."""
+        return self.verify().ok
 
     @staticmethod
     def run_cmd(args):
         """Run system."""
-        p = subprocess.Popen(args, stdout=subprocess.PIPE,
-                             stderr=subprocess.PIPE)
+        p = register_process(subprocess.Popen(
+            args, stdout=subprocess.PIPE, stderr=subprocess.PIPE))
         stdout, stderr = p.communicate()
         return stderr.decode('utf-8').strip(os.linesep).strip()
 
     def check_gz(self):
-        """Gzip -t file."""
-        ret = True
-        stderr = self.run_cmd([self.gzippath, '-t', self.infile])
-        if stderr and 'decompression OK, trailing garbage ignored' \
-                not in stderr:
-            ret = False
-            self.error = stderr
-        return ret
+        """Test gz file in process like 'gzip -t'."""
+        return self.verify().ok
 
     def check_bz2(self):
-        """Bzip -tv file."""
-        ret = True
-        stderr = self.run_cmd([self.bz2path, '-tv', self.infile])
-        if stderr and not stderr.endswith('ok\n'):
-            ret = False
-            self.error = stderr
-        return ret
+        """Test bz2 file in process like 'bzip2 -tv'."""
+        return self.verify().ok
+
+
+class StreamVerifier(object):
+    """Verify compressed stream by feeding data.
+
+    Every member (stream) is decompressed and checked by the decompressor,
+    e.g. CRC32/ISIZE of gzip member, block and stream CRC of bz2 and check
+    of xz. Bytes after the last member which are not a new member are
+    ignored like 'gzip -t'. Subclasses give the decompressor of a member
+    by static method new_decompressor.
+    """
+
+    name = ''
+    magic = b''
+
+    def __init__(self):
+        """Init class."""
+        self.decompressor = self.new_decompressor()
+        # compressed offset of the current member and of fed data
+        self.member_offset = 0
+        self.offset = 0
+        self.members = 1
+        self.bytes_out = 0
+        self.garbage = False
+        self._rest = b''
+
+    def feed(self, data):
+        """Feed compressed data, return decompressed data."""
+        out = []
+        end = self.offset + len(data)
+        if self._rest:
+            data = self._rest + data
+            self._rest = b''
+        while data and not self.garbage:
+            out.append(self.decompressor.decompress(data))
+            if not self.decompressor.eof:
+                break
+            data = self.decompressor.unused_data
+            if len(data) < len(self.magic) and self.magic.startswith(data):
+                # wait for more data to know whether it is a new member
+                self._rest = data
+                break
+            self.member_offset = end - len(data)
+            if data.startswith(self.magic):
+                self.members += 1
+                self.decompressor = self.new_decompressor()
+            else:
+                self.garbage = bool(data)
+        self.offset = end
+        output = b''.join(out)
+        self.bytes_out += len(output)
+        return output
+
+    def close(self):
+        """Check whether the last member is finished."""
+        if not self.decompressor.eof:
+            raise EOFError('Compressed file ended before the end-of-stream'
+                           ' marker was reached')
+
+
+class GzipVerifier(StreamVerifier):
+    """Verify gzip file."""
+
+    name = 'gzip'
+    magic = b'\x1f\x8b'
+
+    @staticmethod
+    def new_decompressor():
+        """Get decompressor of gzip member which checks CRC32 and ISIZE."""
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+
+class Bz2Verifier(StreamVerifier):
+    """Verify bz2 file."""
+
+    name = 'bz2'
+    magic = b'BZh'
+
+    @staticmethod
+    def new_decompressor():
+        """Get decompressor of bz2 stream which checks CRCs."""
+        return bz2.BZ2Decompressor()
+
+
+class XzVerifier(StreamVerifier):
+    """Verify xz file."""
+
+    name = 'xz'
+    magic = b'\xfd7zXZ\x00'
+
+    @staticmethod
+    def new_decompressor():
+        """Get decompressor of xz stream which checks integrity."""
+        return lzma.LZMADecompressor(lzma.FORMAT_XZ)
+
+
+class ZstdVerifier(StreamVerifier):
+    """Verify zstd file, it needs zstandard package."""
+
+    name = 'zstd'
+    magic = b'\x28\xb5\x2f\xfd'
+
+    @staticmethod
+    def new_decompressor():
+        """Get decompressor of zstd frame."""
+        if zstandard is None:
+            raise ValueError('Can not check zstd file without zstandard!')
+        return zstandard.ZstdDecompressor().decompressobj()
+
+
+class PlainVerifier(StreamVerifier):
+    """Pass data of uncompressed tar file."""
+
+    name = 'plain'
+
+    def __init__(self):
+        """Init class."""
+        self.offset = 0
+        self.member_offset = 0
+        self.members = 1
+        self.bytes_out = 0
+        self.garbage = False
+
+    def feed(self, data):
+        """Return data."""
+        self.offset += len(data)
+        self.bytes_out += len(data)
+        return data
+
+    def close(self):
+        """Do nothing."""
+
+
+VERIFIERS = {
+    '.gz': GzipVerifier, '.tgz': GzipVerifier, '.bz2': Bz2Verifier,
+    '.tbz2': Bz2Verifier, '.xz': XzVerifier, '.txz': XzVerifier,
+    '.zst': ZstdVerifier, '.tar': PlainVerifier}
+# errors of bad compressed data
+VERIFY_ERRORS = (OSError, EOFError, ValueError, zlib.error, lzma.LZMAError,
+                 tarfile.TarError) + ZSTD_ERRORS
+TAR_EXTS = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz',
+            '.txz', '.tar.zst')
+
+
+def file_format(infile):
+    """Get extension of compressed file or None."""
+    ext = os.path.splitext(infile)[1]
+    if ext in VERIFIERS or ext == '.zip':
+        return ext
+    return None
+
+
+class VerifiedReader(io.RawIOBase):
+    """Raw reader of decompressed data which is verified by StreamVerifier."""
+
+    def __init__(self, fileobj, verifier, size=1 << 20):
+        """Init class."""
+        self.fileobj = fileobj
+        self.verifier = verifier
+        self.size = size
+        self._buffer = b''
+
+    def readable(self):
+        """Return True."""
+        return True
+
+    def readinto(self, b):
+        """Read decompressed data into b."""
+        while not self._buffer:
+            data = self.fileobj.read(self.size)
+            if not data:
+                self.verifier.close()
+                return 0
+            self._buffer = self.verifier.feed(data)
+        size = min(len(b), len(self._buffer))
+        b[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+class VerifyResult(object):
+    """Result of verifying a file."""
+
+    def __init__(self, path, fmt):
+        """Init class."""
+        self.path = path
+        self.format = fmt
+        self.status = 'ok'
+        self.message = ''
+        # compressed offset of the failed member
+        self.offset = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.members = 0
+        self.tar_members = 0
+        self.seconds = 0.0
+
+    @property
+    def ok(self):
+        """Return whether file is complete."""
+        return self.status == 'ok'
+
+    @property
+    def throughput(self):
+        """Get verified compressed MB per second."""
+        if not self.seconds:
+            return 0.0
+        return self.bytes_in / 1e6 / self.seconds
+
+    def to_dict(self):
+        """Get dict of result."""
+        adict = dict(self.__dict__)
+        adict['throughput'] = round(self.throughput, 2)
+        return adict
+
+
+def verify_zip(infile, result):
+    """Test CRC of all members of zip file."""
+    import zipfile
+    with zipfile.ZipFile(infile) as zip_file:
+        result.members = len(zip_file.infolist())
+        bad = zip_file.testzip()
+    if bad is not None:
+        result.status = 'failed'
+        result.message = 'Bad CRC or header of member %s' % bad
+    result.bytes_in = result.bytes_out = os.path.getsize(infile)
+
+
+def verify_stream(infile, result, size=1 << 20, fileobj=None):
+    """Verify compressed file, walk tar members if it is tar file.
+
+    fileobj is the opened infile to read, it is not closed.
+    """
+    try:
+        verifier = VERIFIERS[result.format]()
+    except ValueError as e:
+        result.status = 'failed'
+        result.message = str(e)
+        return
+    try:
+        with open(infile, 'rb') if fileobj is None else \
+                contextlib.nullcontext(fileobj) as fileobj:
+            if infile.endswith(TAR_EXTS):
+                reader = io.BufferedReader(
+                    VerifiedReader(fileobj, verifier, size), size)
+                with tarfile.open(fileobj=reader, mode='r|') as tar:
+                    for member in tar:
+                        result.tar_members += 1
+                        if member.isfile():
+                            handle = tar.extractfile(member)
+                            while handle.read(size):
+                                pass
+                # tarfile stops at the end-of-archive blocks, read the
+                # rest so the trailer of the last member is checked
+                while reader.read(size):
+                    pass
+                verifier.close()
+            else:
+                for data in iter(lambda: fileobj.read(size), b''):
+                    verifier.feed(data)
+                verifier.close()
+    except TimeoutError:
+        raise
+    except VERIFY_ERRORS as e:
+        result.status = 'failed'
+        result.message = str(e)
+        result.offset = verifier.member_offset
+    if verifier.garbage:
+        result.message = result.message or \
+            'decompression OK, trailing garbage ignored'
+    result.bytes_in = verifier.offset
+    result.bytes_out = verifier.bytes_out
+    result.members = verifier.members
+
+
+def verify_file(infile, fileobj=None):
+    """Verify compressed file in process, return VerifyResult.
+
+    fileobj is the opened infile to read, zip file is always opened again
+    because it is read by seeking.
+    """
+    result = VerifyResult(infile, file_format(infile))
+    start = time.time()
+    if result.format is None:
+        result.status = 'failed'
+        result.message = 'Can not find check compressed method'
+    elif result.format == '.zip':
+        verify_zip(infile, result)
+    else:
+        verify_stream(infile, result, fileobj=fileobj)
+    result.seconds = time.time() - start
+    record(result)
+    return result
+
+
+def record(result):
+    """Add VerifyResult to metrics of instrument."""
+    instrument.add_time('verify', result.seconds, format=result.format)
+    instrument.count('verify_bytes_in', result.bytes_in,
+                     format=result.format)
+    instrument.count('verify_bytes_out', result.bytes_out,
+                     format=result.format)
+
+
+def verify_tree(root, processes=4):
+    """Verify compressed files in directory tree by processes."""
+    infiles = []
+    for dirpath, _, filenames in os.walk(root):
+        infiles.extend(os.path.join(dirpath, x) for x in sorted(filenames)
+                       if file_format(x) is not None)
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.map(verify_file, sorted(infiles), chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    # metrics of workers are lost with them
+    for result in results:
+        record(result)
+    return results
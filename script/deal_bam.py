@@ -1,5 +1,127 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+import gzip
+import multiprocessing
+
 import pysam
 
+# support of a variant: read count of ref, alt and other alleles
+Support = namedtuple('Support', 'ref alt other')
+REF, ALT, OTHER = 0, 1, 2
+# samtools mpileup default: UNMAP, SECONDARY, QCFAIL, DUP
+FLAG_FILTER = 0x704
+# M, =, X
+MATCH_OPS = (0, 7, 8)
+
+
+class CigarMapper(object):
+    """Map relative loc of read to query offset by compiled CIGAR.
+
+    Aligned blocks (M/=/X ops) are compiled once to arrays of relative
+    ref start, query start and length, and the op after every block (the
+    indel anchored at its last base), so every lookup is a bisect.
+    """
+
+    def __init__(self, read):
+        """Init class."""
+        self.read = read
+        self.cigar = read.cigartuples
+        self.seq = read.query_sequence.upper()
+        self.ref_starts = array('l')
+        self.query_starts = array('l')
+        self.lengths = array('l')
+        # op after block or None
+        self.follows = []
+        rpos = qpos = 0
+        for index, (op, oplen) in enumerate(self.cigar):
+            # M:0  I:1  D:2  N:3  S:4  H:5  P:6  =:7  X:8
+            if op in MATCH_OPS:
+                self.ref_starts.append(rpos)
+                self.query_starts.append(qpos)
+                self.lengths.append(oplen)
+                self.follows.append(self.cigar[index + 1] if index + 1 < len(
+                    self.cigar) else None)
+                rpos += oplen
+                qpos += oplen
+            elif op == 1 or op == 4:
+                qpos += oplen
+            elif op == 2 or op == 3:
+                rpos += oplen
+            elif op == 5 or op == 6:
+                pass
+            else:
+                raise ValueError('UnRecognizable Cigar Value ' + str(op))
+
+    def locate(self, loc):
+        """Get (block, offset in block, query offset) of loc or None.
+
+        None is returned if loc is in D/N op or out of read.
+        """
+        block = bisect_right(self.ref_starts, loc) - 1
+        if block < 0:
+            return None
+        offset = loc - self.ref_starts[block]
+        if offset >= self.lengths[block]:
+            return None
+        return block, offset, self.query_starts[block] + offset
+
+    def query_offset(self, loc):
+        """Get query offset of loc or None."""
+        hit = self.locate(loc)
+        return None if hit is None else hit[2]
+
+    def query_offsets(self, locs):
+        """Get query offsets of many locs."""
+        return [self.query_offset(x) for x in locs]
+
+    def judge(self, loc, ref, alt):
+        """Judge whether read supports REF, ALT or OTHER allele of variant.
+
+        ref and alt must be uppercase, loc is relative loc of read like
+        read_pattern_judge.
+        """
+        hit = self.locate(loc)
+        if hit is None:
+            return OTHER
+        block, offset, qpos = hit
+        if len(ref) == len(alt):
+            # snp or mnp in one M op
+            if offset + len(ref) > self.lengths[block]:
+                return OTHER
+            bases = self.seq[qpos:qpos + len(ref)]
+            return ALT if bases == alt else REF if bases == ref else OTHER
+        elif len(ref) == 1 and len(alt) > 1:
+            indel, size = (1, len(alt) - 1)
+        elif len(ref) > 1 and len(alt) == 1:
+            indel, size = (2, len(ref) - 1)
+        else:
+            raise ValueError('UnRecognizable Ref/Alt %s %s' % (ref, alt))
+        if self.seq[qpos] != alt[0]:
+            return OTHER
+        if offset < self.lengths[block] - 1:
+            return REF
+        follow = self.follows[block]
+        if follow == (indel, size):
+            return ALT
+        if follow is None or follow[0] in (indel, 4, 5):
+            # read ends or has other indel at the anchor
+            return OTHER
+        return REF
+
+
+# mapper of the last read, it holds the read so the read is not reused
+_last_mapper = [None]
+
+
+def get_mapper(read):
+    """Get CigarMapper of read, it is cached for the read being processed."""
+    mapper = _last_mapper[0]
+    if mapper is None or mapper.read is not read:
+        mapper = _last_mapper[0] = CigarMapper(read)
+    return mapper
+
+
 def read_pattern_judge(read,loc,ref,alt):
     #! 0-based loc stands relative loc of read
     #! loc represent vcf format variant
@@ -10,44 +132,79 @@ def read_pattern_judge(read,loc,ref,alt):
 
     # snp is in M op in bam
     # all uppercase to compare
-    seq, ref, alt = read.seq.upper(), ref.upper(), alt.upper()
-    ind = 0
-    for op, oplen in read.cigar:
-        # M:0  I:1  D:2  N:3  S:4  H:5  P:6  =:7  X:8
-        ind += 1
-        if op == 0 or op == 7 or op == 8:
-            if 0<=loc<oplen:
-                # find the base loc and judge the pattern from ref/alt
-
-                if len(ref) == len(alt) and loc+len(ref)-1<oplen :
-                    # snp   #? suppose X symbol is not use
-                    if seq[loc:loc+len(ref)] == alt:
-                        return True
-                elif len(ref) == 1 and len(alt) >1:
-                    # ins
-                    if loc==oplen-1 and len(read.cigar)>ind \
-                                    and (1, len(alt)-1)==read.cigar[ind]\
-                                    and seq[loc] == alt[0]:
-                        return True
-                elif len(ref) > 1 and len(alt) == 1:
-                    # del
-                    if loc==oplen-1 and len(read.cigar)>ind \
-                                    and (2, len(ref)-1)==read.cigar[ind]\
-                                    and seq[loc] == alt[0]:
-                        return True
-                else:
-                    raise ValueError('UnRecognizable Ref/Alt %s %s'%(ref, alt))
-                return False
+    return get_mapper(read).judge(loc, ref.upper(), alt.upper()) == ALT
 
-            else:
-                seq = seq[oplen:]
-                loc -= oplen
-        elif op == 1 or op == 4:
-            seq = seq[oplen:]
-        elif op == 2 or op == 3:
-            loc -= oplen
-        elif op == 5 or op == 6:
-            pass
-        else:
-            raise ValueError('UnRecognizable Cigar Value ' + str(op))
-    return False
+
+def read_vcf_variants(vcffile):
+    """Get (chrom, pos, ref, alt) of vcf or vcf.gz, split multiple alts."""
+    opener = gzip.open if vcffile.endswith('.gz') else open
+    variants = []
+    with opener(vcffile, 'rt') as rd:
+        for line in rd:
+            if line.startswith('#'):
+                continue
+            items = line.split('\t', 5)
+            for alt in items[4].split(','):
+                variants.append((items[0], int(items[1]), items[3], alt))
+    return variants
+
+
+def _count_group(args):
+    """Count support of variants of one chrom by a sorted pass of reads."""
+    bamfile, chrom, group, flag_filter, min_mapq = args
+    # group is [(index, 0-based pos, ref, alt)] sorted by pos
+    positions = [x[1] for x in group]
+    alleles = [(x[2].upper(), x[3].upper()) for x in group]
+    counts = [[0, 0, 0] for _ in group]
+    end = max(x[1] + len(x[2]) for x in group)
+    with pysam.AlignmentFile(bamfile) as bam:
+        for read in bam.fetch(chrom, positions[0], end):
+            if read.flag & flag_filter or read.mapping_quality < min_mapq:
+                continue
+            # flag_filter may keep unmapped reads, they have no ref end
+            if read.is_unmapped or read.reference_end is None:
+                continue
+            start = read.reference_start
+            first = bisect_left(positions, start)
+            last = bisect_left(positions, read.reference_end)
+            if first == last:
+                continue
+            mapper = CigarMapper(read)
+            for i in range(first, last):
+                counts[i][mapper.judge(positions[i] - start, *alleles[i])] += 1
+    return [(x[0], Support(*y)) for x, y in zip(group, counts)]
+
+
+def count_support(bamfile, variants, processes=1, group_size=10000,
+                  flag_filter=FLAG_FILTER, min_mapq=0):
+    """Count ref/alt/other read support of (chrom, pos, ref, alt) variants.
+
+    pos is 1-based like vcf, reads of every region are read by one sorted
+    pass and regions are counted by processes. Return Support of variants
+    in the same order.
+    """
+    bychrom = {}
+    for index, (chrom, pos, ref, alt) in enumerate(variants):
+        bychrom.setdefault(chrom, []).append((index, pos - 1, ref, alt))
+    jobs = []
+    for chrom, group in bychrom.items():
+        group.sort(key=lambda x: x[1])
+        for i in range(0, len(group), group_size):
+            jobs.append((bamfile, chrom, group[i:i + group_size],
+                         flag_filter, min_mapq))
+    result = [None] * len(variants)
+    if processes > 1:
+        pool = multiprocessing.Pool(processes)
+        try:
+            outputs = pool.imap_unordered(_count_group, jobs)
+            for output in outputs:
+                for index, support in output:
+                    result[index] = support
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for job in jobs:
+            for index, support in _count_group(job):
+                result[index] = support
+    return result
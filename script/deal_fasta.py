@@ -1,3 +1,287 @@
+"""Deal with fasta file.
+
+Fasta gives random access to fasta or bgzipped fasta file by the samtools
+compatible .fai index (and .gzi index of bgzip), the sequence of a region is
+read from mmap of the file, so whole sequences are never loaded.
+"""
+from bisect import bisect_right
+from collections import namedtuple, OrderedDict
+import functools
+import gzip
+import mmap
+import os
+import struct
+import sys
+import zlib
+
+FaiRecord = namedtuple('FaiRecord', 'length offset linebases linewidth')
+
+
+# complement of IUPAC codes, other chars are not changed
+IUPAC = 'ACGTUMRWSYKVHDBN'
+COMPLEMENT = 'TGCAAKYWSRMBDHVN'
+STR_TABLE = str.maketrans(IUPAC + IUPAC.lower(),
+                          COMPLEMENT + COMPLEMENT.lower())
+BYTES_TABLE = bytes.maketrans((IUPAC + IUPAC.lower()).encode(),
+                              (COMPLEMENT + COMPLEMENT.lower()).encode())
+
+
 def reverse_complement(dna):
-    complement = {'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A', 'N': 'N'}
-    return ''.join([complement[base] for base in dna[::-1]])
+    """Get reverse complement of str or bytes sequence, keep case."""
+    if isinstance(dna, str):
+        return dna.translate(STR_TABLE)[::-1]
+    return bytes(dna).translate(BYTES_TABLE)[::-1]
+
+
+def reverse_complement_many(seqs):
+    """Get reverse complements of many str or bytes sequences.
+
+    Sequences are joined and translated once, so they must not have
+    newline.
+    """
+    if not seqs:
+        return []
+    sep = '\n' if isinstance(seqs[0], str) else b'\n'
+    result = reverse_complement(sep.join(seqs)).split(sep)
+    result.reverse()
+    return result
+
+
+def iter_reverse_complement(fasta, chrom, start=0, end=None, size=1 << 20):
+    """Yield reverse complement of a region of Fasta by chunks of size."""
+    end = fasta.get_reference_length(chrom) if end is None else min(
+        end, fasta.get_reference_length(chrom))
+    while end > start:
+        chunk_start = max(start, end - size)
+        yield reverse_complement(fasta.fetch(chrom, chunk_start, end))
+        end = chunk_start
+
+
+def write_reverse_complement(fasta, chrom, handle, width=60, size=1 << 20):
+    """Write reverse complement of chrom of Fasta to handle as fasta."""
+    handle.write('>%s\n' % chrom)
+    # chunks are whole lines
+    size = max(size // width, 1) * width
+    for seq in iter_reverse_complement(fasta, chrom, size=size):
+        handle.write(''.join(seq[i:i + width] + '\n'
+                             for i in range(0, len(seq), width)))
+
+
+def is_bgzf(filename):
+    """Check whether file is compressed by bgzip."""
+    with open(filename, 'rb') as fp:
+        head = fp.read(16)
+    return len(head) == 16 and head[:4] == b'\x1f\x8b\x08\x04' and \
+        head[12:14] == b'BC'
+
+
+def iter_bgzf_blocks(filename):
+    """Yield (compressed offset, block size, uncompressed size) of bgzip."""
+    with open(filename, 'rb') as fp:
+        offset = 0
+        while True:
+            head = fp.read(18)
+            if not head:
+                break
+            if len(head) < 18 or head[12:14] != b'BC':
+                raise ValueError('%s is not a bgzip file!' % filename)
+            size = struct.unpack('<H', head[16:18])[0] + 1
+            fp.seek(offset + size - 4)
+            yield offset, size, struct.unpack('<I', fp.read(4))[0]
+            offset += size
+
+
+def build_gzi(filename, gzifile=None):
+    """Write .gzi index of bgzip file."""
+    entries, uoffset = [], 0
+    for offset, _, isize in iter_bgzf_blocks(filename):
+        if offset:
+            entries.append((offset, uoffset))
+        uoffset += isize
+    with open(gzifile or filename + '.gzi', 'wb') as wt:
+        wt.write(struct.pack('<Q', len(entries)))
+        for entry in entries:
+            wt.write(struct.pack('<QQ', *entry))
+
+
+def load_gzi(gzifile):
+    """Load (compressed offsets, uncompressed offsets) of .gzi index."""
+    with open(gzifile, 'rb') as rd:
+        count = struct.unpack('<Q', rd.read(8))[0]
+        values = struct.unpack('<%sQ' % (count * 2), rd.read(count * 16))
+    return [0] + list(values[::2]), [0] + list(values[1::2])
+
+
+def build_fai(filename, faifile=None):
+    """Write .fai index of fasta or bgzipped fasta file."""
+    opener = gzip.open if is_bgzf(filename) else open
+    records = []
+    # name, length, offset, linebases, linewidth and whether line ends
+    name, record = None, None
+    offset = 0
+    with opener(filename, 'rb') as rd:
+        for line in rd:
+            if line.startswith(b'>'):
+                name = line[1:].split(None, 1)[0].decode()
+                record = [name, 0, offset + len(line), 0, 0, False]
+                records.append(record)
+            elif record is None:
+                raise ValueError('%s is not a fasta file!' % filename)
+            else:
+                bases = len(line.rstrip(b'\r\n'))
+                if bases and (record[5] or bases > record[3] > 0):
+                    raise ValueError('Different line length in %s of %s!' % (
+                        name, filename))
+                if bases and not record[3]:
+                    record[3], record[4] = bases, len(line)
+                # a shorter line must be the last line of the record
+                record[5] = record[5] or bases < record[3] or \
+                    len(line) != record[4]
+                record[1] += bases
+            offset += len(line)
+    with open(faifile or filename + '.fai', 'wt') as wt:
+        for record in records:
+            wt.write('%s\t%s\t%s\t%s\t%s\n' % tuple(record[:5]))
+
+
+def load_fai(faifile):
+    """Load .fai index to OrderedDict of FaiRecord."""
+    index = OrderedDict()
+    with open(faifile, 'rt') as rd:
+        for line in rd:
+            items = line.rstrip('\n').split('\t')
+            index[items[0]] = FaiRecord(*[int(x) for x in items[1:5]])
+    return index
+
+
+class Fasta(object):
+    """Random access to fasta or bgzipped fasta file.
+
+    Index files are built if they are not found. Coordinates are 0-based
+    and half-open like pysam.FastaFile.fetch.
+    """
+
+    def __init__(self, filename, faifile=None, gzifile=None, cache=64):
+        """Init class."""
+        self.filename = filename
+        faifile = faifile or filename + '.fai'
+        if not os.path.isfile(faifile):
+            build_fai(filename, faifile)
+        self.index = load_fai(faifile)
+        self.bgzf = is_bgzf(filename)
+        if self.bgzf:
+            gzifile = gzifile or filename + '.gzi'
+            if not os.path.isfile(gzifile):
+                build_gzi(filename, gzifile)
+            self.coffsets, self.uoffsets = load_gzi(gzifile)
+            # decompressed blocks of recent fetches
+            self._block = functools.lru_cache(cache)(self._inflate_block)
+        self._fp = open(filename, 'rb')
+        self._mmap = mmap.mmap(self._fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __enter__(self):
+        """Return self."""
+        return self
+
+    def __exit__(self, atype, value, trace):
+        """Close file."""
+        self.close()
+
+    def close(self):
+        """Close file."""
+        self._mmap.close()
+        self._fp.close()
+
+    @property
+    def references(self):
+        """Get names of sequences."""
+        return list(self.index)
+
+    @property
+    def lengths(self):
+        """Get lengths of sequences."""
+        return [x.length for x in self.index.values()]
+
+    def get_reference_length(self, chrom):
+        """Get length of sequence."""
+        return self.index[chrom].length
+
+    def _inflate_block(self, number):
+        """Get uncompressed data of the number-th bgzip block."""
+        offset = self.coffsets[number]
+        size = struct.unpack('<H', self._mmap[offset + 16:offset + 18])[0]
+        return zlib.decompress(self._mmap[offset:offset + size + 1],
+                               16 + zlib.MAX_WBITS)
+
+    def _read(self, start, end):
+        """Read uncompressed bytes of file in [start, end)."""
+        if not self.bgzf:
+            return self._mmap[start:end]
+        number = bisect_right(self.uoffsets, start) - 1
+        data = []
+        while start < end and number < len(self.coffsets):
+            block = self._block(number)
+            skip = start - self.uoffsets[number]
+            data.append(block[skip:skip + end - start])
+            start += len(data[-1])
+            number += 1
+        return b''.join(data)
+
+    def _bounds(self, record, start, end):
+        """Get file offsets of sequence range."""
+        def file_offset(pos):
+            lines, rest = divmod(pos, record.linebases)
+            return record.offset + lines * record.linewidth + rest
+        return file_offset(start), file_offset(end)
+
+    def fetch(self, chrom, start=0, end=None):
+        """Get sequence of chrom in [start, end)."""
+        record = self.index[chrom]
+        end = record.length if end is None else min(end, record.length)
+        if start < 0:
+            raise ValueError('Start %s of %s is negative!' % (start, chrom))
+        if start >= end:
+            return ''
+        data = self._read(*self._bounds(record, start, end))
+        return data.replace(b'\n', b'').replace(b'\r', b'').decode('ascii')
+
+    def fetch_many(self, regions):
+        """Get sequences of many (chrom, start, end) regions.
+
+        Regions are read in the order of file, the result is in the order
+        of regions.
+        """
+        order = sorted(range(len(regions)), key=lambda i: (
+            self.index[regions[i][0]].offset, regions[i][1]))
+        result = [None] * len(regions)
+        for i in order:
+            result[i] = self.fetch(*regions[i])
+        return result
+
+
+def parse_region(region):
+    """Parse samtools region chrom:start-end to 0-based (chrom, start, end)."""
+    chrom, _, span = region.rpartition(':')
+    if not chrom:
+        return region, 0, None
+    start, _, end = span.replace(',', '').partition('-')
+    return chrom, int(start) - 1, int(end) if end else None
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        sys.stdout.write('Usage:python {0} fasta [chrom:start-end ...]\n'
+                         .format(sys.argv[0]))
+        sys.exit(1)
+    if len(sys.argv) == 2:
+        build_fai(sys.argv[1])
+        if is_bgzf(sys.argv[1]):
+            build_gzi(sys.argv[1])
+    else:
+        with Fasta(sys.argv[1]) as fasta:
+            regions = sys.argv[2:]
+            seqs = fasta.fetch_many([parse_region(x) for x in regions])
+            for region, seq in zip(regions, seqs):
+                sys.stdout.write('>%s\n' % region)
+                for i in range(0, len(seq), 60):
+                    sys.stdout.write(seq[i:i + 60] + '\n')
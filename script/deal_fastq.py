@@ -5,20 +5,27 @@ Description: Get base count and error for fastq file both single end and pair
              end sequencing.
 """
 
+from collections import deque
+from contextlib import closing
 from copy import deepcopy
 import itertools
+import json
 import logging
+import multiprocessing
 import os
 import re
-import sys
 import time
+import types
 
-from read_gzbzfile import ReadGgBz2Normal
+from fastq_stats import FastqStats
+import instrument
+from read_gzbzfile import PairedReader
+try:
+    import batch_fastq
+    import numpy
+except ImportError:
+    batch_fastq = None
 
-if sys.version.startswith('3'):
-    zip_longest = itertools.zip_longest
-else:
-    zip_longest = itertools.izip_longest
 _logger = logging.getLogger(__name__)
 errors = {
     'WB': 'The [{0}] line:({1}) have wrong base',
@@ -31,19 +38,50 @@ errors = {
     'FF': "Failed to read file: {0}",
     'N4': r'The file don\'t have an integral multiple of 4 number of lines',
     'NE': 'Read1 number is not equal to read2 number at line [{0}].'}
+BASES = 'ATGCN0123'
+BASES_SET = frozenset(BASES)
+BASES_BYTES = BASES.encode('ascii')
+# first char of the 1st and 3rd line
+FIRSTS = ((0, '@'), (2, '+'))
+FIRSTS_BYTES = ((0, b'@'), (2, b'+'))
+
+
+def to_text(line):
+    """Get str of bytes line for messages."""
+    if isinstance(line, bytes):
+        return line.decode('utf-8', 'replace')
+    return line
 
 
 class lazypropery(object):
-    """Return value if exists."""
+    """Return value if exists.
+
+    The value is set to the instance as an attribute of the same name, or
+    to slot '_<name>' if the class has it in __slots__, the slot must be
+    set to None in __init__ and the value must not be None.
+    """
 
     def __init__(self, func):
         """Init class."""
         self.func = func
+        self.slot = None
+
+    def __set_name__(self, owner, name):
+        """Find slot of the value."""
+        slot = owner.__dict__.get('_' + name)
+        if isinstance(slot, types.MemberDescriptorType):
+            self.slot = slot
 
     def __get__(self, instance, cls):
         """Get function."""
         if instance is None:
             return self
+        elif self.slot is not None:
+            value = self.slot.__get__(instance, cls)
+            if value is None:
+                value = self.func(instance)
+                self.slot.__set__(instance, value)
+            return value
         else:
             value = self.func(instance)
             setattr(instance, self.func.__name__, value)
@@ -51,8 +89,15 @@ class lazypropery(object):
 
 
 class SingleRead(object):
-    """Get information for single read."""
+    """Get information for single read, lines can be str or bytes.
+
+    It is made for every read, so it has __slots__ instead of __dict__
+    and the lazy values are kept in slots.
+    """
 
+    __slots__ = ('readnumber', 'lines4', 'check_len', 'line2_len',
+                 'base_count', '_phreds', '_error', '_readname',
+                 '_phreq_set')
     phredrange = (33, 126)
     phredQ = (58, 75)
 
@@ -61,61 +106,55 @@ class SingleRead(object):
         # number: start from 0
         self.readnumber = number
         self.lines4 = lines4
-
-    @lazypropery
-    def check_len(self):
-        """Get lines length."""
-        if self.lines4 is None or len(self.lines4) != 4:
-            return True
-        else:
-            return False
-
-    @lazypropery
-    def line2_len(self):
-        """Get line2 length."""
-        if self.check_len:
-            return 0
-        return len(self.lines4[1])
+        # whether lines is not 4 lines
+        self.check_len = lines4 is None or len(lines4) != 4
+        # base count is line2 length
+        self.base_count = self.line2_len = 0 if self.check_len else len(
+            lines4[1])
+        self._phreds = self._error = self._readname = None
+        self._phreq_set = None
 
     @lazypropery
     def phreds(self):
         """Get phred for read."""
         if self.check_len:
             return (59, 59)
-        aset = set(map(ord, self.lines4[3]))
-        phred_min = min(aset)
-        phred_max = max(aset)
-        return (phred_min, phred_max)
+        qual = self.lines4[3]
+        if isinstance(qual, bytes):
+            return (min(qual), max(qual))
+        # ord keeps the order of chars
+        return (ord(min(qual)), ord(max(qual)))
 
     @lazypropery
     def error(self):
         """Check error."""
-        def check_first(linenum, line, first):
-            if line[0] == first:
-                return ""
-            else:
-                return errors['NF'].format(linenum, line, first)
         # 检查是否为4的倍数
         if self.check_len:
             return errors['N4']
+        lines4 = self.lines4
         # 检查第二行是否为ATCG0123
-        if not set(self.lines4[1].upper()).issubset(set('ATGCN0123')):
-            return errors['WB'].format(self.readnumber*4+1, self.lines4[1])
+        seq = lines4[1]
+        if isinstance(seq, bytes):
+            wrong = seq.upper().translate(None, BASES_BYTES)
+            firsts = FIRSTS_BYTES
+        else:
+            wrong = not BASES_SET.issuperset(seq.upper())
+            firsts = FIRSTS
+        if wrong:
+            return errors['WB'].format(self.readnumber*4+1, to_text(seq))
         # 检查第一行和第三行是否为@或+开头
-        firsts = {0: '@', 2: '+'}
-        for i, first in firsts.items():
-            error = check_first(self.readnumber*4+i, self.lines4[i], first)
-            if error:
-                return error
+        for i, first in firsts:
+            if lines4[i][:1] != first:
+                return errors['NF'].format(self.readnumber*4+i,
+                                           to_text(lines4[i]), to_text(first))
         # 检查第二行和第四行是否相等
         line4_number = self.readnumber*4+3
-        line4_len = len(self.lines4[3])
+        line4_len = len(lines4[3])
         if self.line2_len != line4_len:
             return errors['DL'].format(self.line2_len, line4_len, line4_number)
-        if self.phreds[0] < self.phredrange[0] or \
-                self.phreds[1] > self.phredrange[1]:
-            return errors['OQ'].format(self.phreds, self.phredrange,
-                                       line4_number)
+        phreds = self.phreds
+        if phreds[0] < self.phredrange[0] or phreds[1] > self.phredrange[1]:
+            return errors['OQ'].format(phreds, self.phredrange, line4_number)
         return ""
 
     @lazypropery
@@ -123,48 +162,63 @@ class SingleRead(object):
         """Get read name."""
         if self.check_len:
             return ""
-        readname = self.lines4[0].strip().partition('\t')[0]\
-            .partition(" ")[0]
+        head = self.lines4[0]
+        if isinstance(head, bytes):
+            # bytes name is matched without decoding
+            return head.strip().partition(b'\t')[0].partition(b' ')[0]
+        readname = head.strip().partition('\t')[0].partition(" ")[0]
         return readname
 
     @lazypropery
     def phreq_set(self):
         """Get phreq for read."""
         phreq_set = ''
-        if self.phreds[0] <= self.phredQ[0]:
+        phreds = self.phreds
+        if phreds[0] <= self.phredQ[0]:
             phreq_set = '33'
-        elif self.phreds[1] >= self.phredQ[1]:
+        elif phreds[1] >= self.phredQ[1]:
             phreq_set = '64'
         return phreq_set
 
-    @lazypropery
-    def base_count(self):
-        """Get base count for read."""
-        return self.line2_len
-
 
 class PairRead(object):
     """Get information for pair read."""
 
+    __slots__ = ('number', 'linenum', 'lines1', 'lines2', 'read1', 'read2',
+                 'matcher', '_pair_error')
     readname_normal = re.compile(r'(\/[12])|(\.[fr])$')
     casava_1_8 = re.compile(
         r'^@([a-zA-Z0-9_-]+:\d+:[a-zA-Z0-9_-]+:\d+:\d+:[0-9-]+:'
         r'[0-9-]+)(\s+|\:)([12]):[YN]:\d*[02468]:?([ACGTN\_\+\d+]*)$')
+    # the patterns for bytes names
+    readname_normal_bytes = re.compile(readname_normal.pattern.encode())
+    casava_1_8_bytes = re.compile(casava_1_8.pattern.encode())
 
-    def __init__(self, number, lines1, lines2):
-        """Init class."""
+    def __init__(self, number, lines1, lines2, matcher=None):
+        """Init class.
+
+        matcher is NameMatcher of the files, a new one is used if it is
+        None.
+        """
         self.number = number
         self.linenum = self.number*4
         self.lines1 = lines1
         self.lines2 = lines2
         self.read1 = SingleRead(number, lines1)
         self.read2 = SingleRead(number, lines2)
-
-    def get_com_name(self, string):
-        """Get common name for pair read."""
-        if self.readname_normal.search(string):
-            return self.readname_normal.sub('', string)
-        pattern = self.casava_1_8.search(string)
+        self.matcher = NameMatcher() if matcher is None else matcher
+        self._pair_error = None
+
+    @classmethod
+    def get_com_name(cls, string):
+        """Get common name for pair read, string is str or bytes."""
+        if isinstance(string, bytes):
+            normal, casava = cls.readname_normal_bytes, cls.casava_1_8_bytes
+        else:
+            normal, casava = cls.readname_normal, cls.casava_1_8
+        if normal.search(string):
+            return normal.sub(string[:0], string)
+        pattern = casava.search(string)
         if pattern:
             return pattern.group(1)
         return string
@@ -176,22 +230,92 @@ class PairRead(object):
         if self.lines1 is None or self.lines2 is None:
             return errors['NE'].format(self.linenum)
         # 检查read1和read2的名称是否一致
-        if self.get_com_name(self.read1.readname) != self.get_com_name(
-                self.read2.readname):
+        if not self.matcher.match(self.read1.readname, self.read2.readname):
             return errors['RN'].format(
-                self.read1.readname, self.read2.readname, self.linenum)
+                to_text(self.read1.readname), to_text(self.read2.readname),
+                self.linenum)
         return ""
 
 
+class NameMatcher(object):
+    """Check whether read names of mates match like get_com_name.
+
+    The naming scheme is detected once by the first pair: 'same' for
+    names without mate number (e.g. Illumina 1.8+ which has it in the
+    comment), 'slash' for /1 /2 and 'sra' for .f .r suffix. Names are
+    compared directly for the scheme, str and bytes names are both
+    supported. Names which do not match are checked again by
+    PairRead.get_com_name, so the result never depends on the scheme.
+    A matcher is for one pair of files, e.g. CheckFastq makes its own and
+    passes it to the workers.
+    """
+
+    schemes = {'same': (), 'slash': ('/1', '/2'), 'sra': ('.f', '.r')}
+
+    def __init__(self, scheme=None):
+        """Init class."""
+        self.scheme = None
+        self.tails = frozenset()
+        if scheme is not None:
+            self.set_scheme(scheme)
+
+    def set_scheme(self, scheme):
+        """Set naming scheme."""
+        suffixes = self.schemes[scheme]
+        self.scheme = scheme
+        # the same prefix with these tails match
+        self.tails = frozenset(suffixes + tuple(
+            x.encode('ascii') for x in suffixes))
+
+    @classmethod
+    def detect(cls, name1, name2):
+        """Get naming scheme of names of a pair."""
+        tail1, tail2 = to_text(name1[-2:]), to_text(name2[-2:])
+        for scheme, suffixes in cls.schemes.items():
+            if tail1 in suffixes and tail2 in suffixes:
+                return scheme
+        return 'same'
+
+    def match(self, name1, name2):
+        """Check whether names are of the same read."""
+        if self.scheme is None:
+            self.set_scheme(self.detect(name1, name2))
+        if name1 == name2:
+            return True
+        tails = self.tails
+        if name1[-2:] in tails and name2[-2:] in tails and \
+                name1[:-1] == name2[:-1]:
+            return True
+        return PairRead.get_com_name(name1) == PairRead.get_com_name(name2)
+
+    def mismatches(self, names1, names2):
+        """Get indexes of names which do not match in a batch of pairs."""
+        if not names1:
+            return []
+        if self.scheme is None:
+            self.set_scheme(self.detect(names1[0], names2[0]))
+        # compare whole lists in C first
+        if names1 == names2:
+            return []
+        tails = self.tails
+        if tails and [x[:-1] for x in names1] == [x[:-1] for x in names2] \
+                and all(x[-2:] in tails for x in names1) and \
+                all(x[-2:] in tails for x in names2):
+            return []
+        return [i for i, (x, y) in enumerate(zip(names1, names2))
+                if x != y and not self.match(x, y)]
+
+
 class HoldSingle(object):
     """Hold single fastq."""
 
-    def __init__(self):
+    def __init__(self, stats=False):
         """Init class."""
         self.error = ''
         self.phreq_set = ''
         self.base_count = 0
         self.read_count = 0
+        self.stats = FastqStats() if stats else None
 
     def add(self, singleread):
         """Add single read."""
@@ -199,6 +323,8 @@ class HoldSingle(object):
         self.base_count += singleread.base_count
         if not self.phreq_set:
             self.phreq_set = singleread.phreq_set
+        if self.stats is not None and not singleread.check_len:
+            self.stats.add(singleread.lines4[1], singleread.lines4[3])
 
     def check_error(self, singleread):
         """Check error."""
@@ -208,15 +334,45 @@ class HoldSingle(object):
         else:
             return False
 
+    def merge(self, other):
+        """Merge hold of following reads."""
+        self.read_count += other.read_count
+        self.base_count += other.base_count
+        if not self.phreq_set:
+            self.phreq_set = other.phreq_set
+        self.error = other.error
+        if self.stats is not None:
+            self.stats.merge(other.stats)
+
+    def stats_dict(self):
+        """Get statistics dict of reads."""
+        return self.stats.to_dict(64 if self.phreq_set == '64' else 33)
+
+    def state(self):
+        """Get counts as a dict which can be dumped to json."""
+        return {
+            'error': self.error, 'phreq_set': self.phreq_set,
+            'base_count': self.base_count, 'read_count': self.read_count,
+            'stats': None if self.stats is None else self.stats.state()}
+
+    def load_state(self, state):
+        """Restore counts of state."""
+        self.error = state['error']
+        self.phreq_set = state['phreq_set']
+        self.base_count = state['base_count']
+        self.read_count = state['read_count']
+        if self.stats is not None:
+            self.stats.load_state(state['stats'])
+
 
 class HoldPair(object):
     """Hold pair read."""
 
-    def __init__(self):
+    def __init__(self, stats=False):
         """Init class."""
         self.pair_error = ''
-        self.read1 = HoldSingle()
-        self.read2 = HoldSingle()
+        self.read1 = HoldSingle(stats)
+        self.read2 = HoldSingle(stats)
         self.base_count = 0
         self.read_count = 0
         self.phreq_set = ""
@@ -244,6 +400,101 @@ class HoldPair(object):
             return True
         return False
 
+    def merge(self, other):
+        """Merge hold of following pairs."""
+        self.read1.merge(other.read1)
+        self.read2.merge(other.read2)
+        self.pair_error = other.pair_error
+
+    def state(self):
+        """Get counts as a dict which can be dumped to json."""
+        return {'pair_error': self.pair_error, 'read1': self.read1.state(),
+                'read2': self.read2.state()}
+
+    def load_state(self, state):
+        """Restore counts of state."""
+        self.pair_error = state['pair_error']
+        self.read1.load_state(state['read1'])
+        self.read2.load_state(state['read2'])
+
+
+def check_batch(args):
+    """Check a batch of reads, it is run in worker process.
+
+    Return the hold of the batch, the last read and whether an error is
+    found.
+    """
+    start, records, dofast, stats, matcher = args
+    matcher = NameMatcher() if matcher is None else matcher
+    if batch_fastq is not None:
+        result = check_batch_numpy(start, records, dofast, stats, matcher)
+        if result is not None:
+            return result
+    hold = HoldPair(stats) if len(records[0]) == 2 else HoldSingle(stats)
+    read, found = None, False
+    for i, tmp in enumerate(records, start):
+        read = make_read(i, tmp, matcher)
+        hold.add(read)
+        if (i + 1) % dofast == 0 and hold.check_error(read):
+            found = True
+            break
+    return hold, read, found
+
+
+def check_batch_worker(args):
+    """Run check_batch in worker process, return its result and metrics."""
+    instrument.enable()
+    instrument.reset()
+    with instrument.timer('fastq_validate', mode='parallel'):
+        result = check_batch(args)
+    return result, instrument.snapshot()
+
+
+def check_batch_numpy(start, records, dofast, stats=False, matcher=None):
+    """Check a batch of reads by numpy arrays like check_batch.
+
+    Only the reads which fail the vectorized checks are checked again by
+    SingleRead/PairRead for the error message. Return None if the batch is
+    not supported by batch_fastq.ReadBatch.
+    """
+    pair = len(records[0]) == 2
+    batches = []
+    for k in range(len(records[0])):
+        batch = batch_fastq.ReadBatch([tmp[k] for tmp in records])
+        if not batch.valid:
+            return None
+        batches.append(batch)
+    wrong = batches[0].wrong
+    if pair:
+        matcher = NameMatcher() if matcher is None else matcher
+        wrong = wrong | batches[1].wrong
+        wrong[matcher.mismatches(batches[0].names, batches[1].names)] = True
+    sampled = numpy.arange(start + 1, start + len(records) + 1) % dofast == 0
+    hold = HoldPair(stats) if pair else HoldSingle(stats)
+    end, read, found = len(records), None, False
+    for index in numpy.flatnonzero(sampled & wrong):
+        read = make_read(start + index, records[index], matcher)
+        if hold.check_error(read):
+            end, found = int(index) + 1, True
+            break
+    if not found:
+        read = make_read(start + end - 1, records[end - 1], matcher)
+    holds = [hold.read1, hold.read2] if pair else [hold]
+    for single, batch in zip(holds, batches):
+        single.read_count = end
+        single.base_count = batch.base_count(end)
+        single.phreq_set = batch.phreq_set(end)
+        if stats:
+            batch.update_stats(single.stats, end)
+    return hold, read, found
+
+
+def make_read(number, tmp, matcher=None):
+    """Make SingleRead or PairRead for records of fastq."""
+    if len(tmp) == 2:
+        return PairRead(number, tmp[0], tmp[1], matcher)
+    return SingleRead(number, tmp[0])
+
 
 class CheckFastq(object):
     """Check fastq file."""
@@ -253,35 +504,65 @@ class CheckFastq(object):
         'file1_read_count': 0, 'file1_base_count': 0, 'file1_error': '',
         'file2_read_count': 0, 'file2_base_count': 0, 'file2_error': ''}
 
-    def __init__(self, fastq1, fastq2=None, dofast=10):
-        """Init class."""
+    def __init__(self, fastq1, fastq2=None, dofast=10, processes=1,
+                 batch=10000, stats=False, binary=True, checkpoint=None,
+                 interval=60, opener=None):
+        """Init class.
+
+        If stats is True, GC content, N rate, Q20/Q30, mean quality by
+        position and length histogram are added to check_dict as
+        file1_stats/file2_stats. If binary is True, reads are checked as
+        bytes without decoding, so a not utf-8 line is a wrong line
+        instead of a failed file.
+
+        If checkpoint is a file path, counts and positions of files are
+        saved to it about every interval seconds, a run of the same files
+        and arguments resumes from it and gets the same check_dict. It is
+        removed when the run ends.
+
+        opener(filename, binary=binary) opens files like ReadGgBz2Normal,
+        which is used if it is None.
+        """
         self.fastq1 = fastq1
         self.fastq2 = fastq2
+        self.processes = int(processes)
+        self.batch = int(batch)
+        self.stats = stats
+        self.binary = binary
+        self.checkpoint = checkpoint
+        self.interval = interval
+        self.opener = opener
+        # naming scheme of the files is detected by the first pair
+        self.matcher = NameMatcher()
+        # reads checked before the start, and the last of them
+        self.start = 0
+        self.last_read = None
+        self.reader = None
         self._run_fastq(int(dofast))
 
     def _run_fastq(self, dofast):
         """Run fastq."""
         basename1 = os.path.basename(self.fastq1)
         if self.fastq2 is None:
-            self.hold = HoldSingle()
+            self.hold = HoldSingle(self.stats)
         else:
-            self.hold = HoldPair()
+            self.hold = HoldPair(self.stats)
             basename2 = os.path.basename(self.fastq2)
+        self.params = self._params(dofast)
+        self.resume = self._load_checkpoint()
+        self.saved = time.monotonic()
+        if self.processes > 1:
+            mode = 'parallel'
+        else:
+            mode = 'batch' if batch_fastq is not None else 'serial'
         try:
-            i = 0
-            read = None
-            for tmp in self.readfastq():
-                if len(tmp) == 2:
-                    read = PairRead(i, tmp[0], tmp[1])
+            with instrument.timer('fastq_check', mode=mode):
+                if mode == 'parallel':
+                    self._check_parallel(dofast)
+                elif mode == 'batch':
+                    self._merge_batches(dofast)
                 else:
-                    read = SingleRead(i, tmp[0])
-                self.hold.add(read)
-                i += 1
-                if i == 0 or i % dofast == 0:
-                    if self.hold.check_error(read):
-                        break
-            if i % dofast != 0:
-                self.hold.check_error(read)
+                    self._check_serial(dofast)
         except ValueError as e:
             if str(e).endswith(basename1):
                 if self.fastq2 is None:
@@ -292,18 +573,216 @@ class CheckFastq(object):
                 self.hold.read2.error = errors['FF'].format(basename2)
             else:
                 raise
+        if self.checkpoint and os.path.isfile(self.checkpoint):
+            os.remove(self.checkpoint)
         if self.fastq2 is not None:
             self.hold.cal()
+        instrument.count('fastq_reads', self.hold.read_count, mode=mode)
+
+    def _params(self, dofast):
+        """Get files and arguments which a checkpoint must match."""
+        files = []
+        for fastq in (self.fastq1, self.fastq2):
+            if fastq is not None:
+                stat = os.stat(fastq)
+                files.append([os.path.abspath(fastq), stat.st_size,
+                              int(stat.st_mtime)])
+        # positions are (record, member offset, offset in member)
+        return {'files': files, 'dofast': dofast, 'stats': self.stats,
+                'binary': self.binary, 'positions': 'member'}
+
+    def _load_checkpoint(self):
+        """Restore counts of checkpoint, return it or None."""
+        if not self.checkpoint or not os.path.isfile(self.checkpoint):
+            return None
+        with open(self.checkpoint, 'rt') as rd:
+            state = json.load(rd)
+        if state.get('params') != self.params:
+            _logger.warning('Checkpoint %s is not for this run, ignore it.',
+                            self.checkpoint)
+            return None
+        self.hold.load_state(state['hold'])
+        self.start = state['record']
+        return state
+
+    def _save_checkpoint(self, number):
+        """Save counts of the first number reads if it is time to do it."""
+        now = time.monotonic()
+        if not self.checkpoint or not number or \
+                now - self.saved < self.interval:
+            return
+        # the last read is read again when resuming for the final check
+        positions = [self.reader.position(x, number - 1)
+                     for x in range(len(self.reader.readers))]
+        state = {'params': self.params, 'record': number,
+                 'positions': positions, 'hold': self.hold.state()}
+        tmpfile = '%s.%s.tmp' % (self.checkpoint, os.getpid())
+        with open(tmpfile, 'wt') as wt:
+            json.dump(state, wt)
+        os.replace(tmpfile, self.checkpoint)
+        self.saved = now
+
+    def _check_serial(self, dofast):
+        """Check reads one by one."""
+        i = self.start
+        read = None
+        start = time.perf_counter()
+        # files are closed at once if an error is found
+        with closing(self.readfastq()) as reads:
+            records = instrument.timed(reads, 'fastq_wait', mode='serial')
+            for tmp in records:
+                if len(tmp) == 2:
+                    read = PairRead(i, tmp[0], tmp[1], self.matcher)
+                else:
+                    read = SingleRead(i, tmp[0])
+                self.hold.add(read)
+                i += 1
+                if i == 0 or i % dofast == 0:
+                    if self.hold.check_error(read):
+                        break
+                if i % self.batch == 0:
+                    self._save_checkpoint(i)
+        if instrument.enabled:
+            # reads are checked between waits for them
+            records.record()
+            instrument.add_time(
+                'fastq_validate', time.perf_counter() - start -
+                records.seconds, records.items, mode='serial')
+        if read is None:
+            # no read after checkpoint
+            read = self.last_read
+        if i % dofast != 0:
+            self.hold.check_error(read)
+
+    def _batches(self, dofast):
+        """Split reads to batches for check_batch.
+
+        If a file fails to be read, the reads before the error are yielded
+        as the last batch, then the error is raised like _check_serial.
+        """
+        start, records = self.start, []
+        try:
+            with closing(self.readfastq()) as reads:
+                for tmp in reads:
+                    records.append(tmp)
+                    if len(records) >= self.batch:
+                        yield start, records, dofast, self.stats, \
+                            self.matcher
+                        start += len(records)
+                        records = []
+        except ValueError:
+            if records:
+                yield start, records, dofast, self.stats, self.matcher
+            raise
+        if records:
+            yield start, records, dofast, self.stats, self.matcher
+
+    def _check_parallel(self, dofast):
+        """Check batches of reads by worker processes."""
+        pool = multiprocessing.Pool(self.processes)
+        try:
+            self._merge_batches(dofast, pool)
+        finally:
+            # terminate may hang while a batch is being sent to workers, the
+            # batches in flight are few, so just wait for them
+            pool.close()
+            pool.join()
+
+    @staticmethod
+    def _check_batch(args):
+        """Check a batch in this process."""
+        with instrument.timer('fastq_validate', mode='batch'):
+            return check_batch(args)
+
+    def _submit(self, pool, batches):
+        """Check batches by pool and return results by order."""
+        # metrics of workers are returned with the results
+        metered = instrument.enabled
+        func = check_batch_worker if metered else check_batch
+        # limit the batches in flight, reading is faster than checking
+        jobs = deque()
+        number = self.processes * 2
+        error = None
+        while True:
+            try:
+                for args in itertools.islice(batches, number):
+                    jobs.append(pool.apply_async(func, (args, )))
+            except ValueError as e:
+                # a file fails, the batches submitted are still merged
+                error = e
+                number = 0
+            if not jobs:
+                break
+            with instrument.timer('queue_wait', queue='pool'):
+                result = jobs.popleft().get()
+            if metered:
+                result, metrics = result
+                instrument.merge(metrics)
+            yield result
+            if number:
+                number = 1
+        if error is not None:
+            raise error
+
+    def _merge_batches(self, dofast, pool=None):
+        """Merge results of check_batch by the order of batches.
+
+        The first error and the counts are the same as _check_serial.
+        """
+        with closing(self._batches(dofast)) as reads:
+            batches = instrument.timed(
+                reads, 'fastq_wait', mode='batch' if pool is None else
+                'parallel')
+            if pool is None:
+                results = (self._check_batch(args) for args in batches)
+            else:
+                results = self._submit(pool, batches)
+            i = self.start
+            read = None
+            for hold, read, found in results:
+                self.hold.merge(hold)
+                i = self.hold.read1.read_count if self.fastq2 is not None \
+                    else self.hold.read_count
+                if found:
+                    break
+                self._save_checkpoint(i)
+            else:
+                if read is None:
+                    # no read after checkpoint
+                    read = self.last_read
+                if i % dofast != 0:
+                    self.hold.check_error(read)
 
     def readfastq(self):
-        """Read fastq file."""
-        if self.fastq2 is None:
-            with ReadGgBz2Normal(self.fastq1) as r1:
-                return zip_longest(r1.read_fastq())
-        else:
-            with ReadGgBz2Normal(self.fastq1) as r1, ReadGgBz2Normal(
-                    self.fastq2) as r2:
-                return zip_longest(r1.read_fastq(), r2.read_fastq())
+        """Read records of fastq files in lock-step.
+
+        Every file is read by a thread of PairedReader, the threads and
+        decompressing subprocesses are stopped when it is closed.
+        """
+        fastqs = [self.fastq1]
+        if self.fastq2 is not None:
+            fastqs.append(self.fastq2)
+        starts = None
+        if self.resume is not None:
+            # read the last read of checkpoint again as self.last_read
+            starts = [(x, y, z, self.start - 1 - x)
+                      for x, y, z in self.resume['positions']]
+        kwargs = {'binary': self.binary}
+        if self.opener is not None:
+            kwargs['opener'] = self.opener
+        elif self.checkpoint:
+            # keep positions by member, so resuming inflates one member
+            kwargs['members'] = True
+        # yield inside with block, so files are open while reading
+        with PairedReader(fastqs, starts=starts, track=bool(self.checkpoint),
+                          **kwargs) as reader:
+            self.reader = reader
+            records = iter(reader)
+            if starts is not None:
+                self.last_read = make_read(self.start - 1, next(records),
+                                           self.matcher)
+            for tmp in records:
+                yield tmp
 
     @lazypropery
     def check_dict(self):
@@ -323,21 +802,39 @@ class CheckFastq(object):
                         adict[key] = getattr(self.hold.read2, key1, value)
             else:
                 adict[key] = getattr(self.hold, key, value)
+        if self.stats:
+            if self.fastq2 is None:
+                adict['file1_stats'] = self.hold.stats_dict()
+            else:
+                adict['file1_stats'] = self.hold.read1.stats_dict()
+                adict['file2_stats'] = self.hold.read2.stats_dict()
         return adict
 
 
 if __name__ == '__main__':
     import argparse
-    import json
     parser = argparse.ArgumentParser(__doc__)
     parser.add_argument('fastq1', help='fastq1 path')
     parser.add_argument('-f', '--fastq2', help='fastq2 path')
     parser.add_argument('-r', '--run',
                         help='run by times, default is %(default)s',
                         default=1)
+    parser.add_argument('-p', '--processes',
+                        help='check by processes, default is %(default)s',
+                        type=int, default=1)
+    parser.add_argument('-s', '--stats',
+                        help='add statistics of reads, default is %(default)s',
+                        action='store_true')
+    parser.add_argument('-t', '--text',
+                        help='check reads as decoded text, default is'
+                             ' %(default)s', action='store_true')
+    parser.add_argument('-c', '--checkpoint',
+                        help='save progress to this file and resume from'
+                             ' it, default is %(default)s')
     parser.add_argument('-d', '--debug',
                         help='debug, default is %(default)s',
                         action='store_true')
+    instrument.add_arguments(parser)
     args = parser.parse_args()
     level = logging.DEBUG if args.debug else logging.WARNING
     logging.basicConfig(
@@ -346,7 +843,11 @@ if __name__ == '__main__':
                ' %(message)s')
     logging.info('Start %s.', args.fastq1)
     start = time.time()
-    checkfastq = CheckFastq(args.fastq1, args.fastq2, args.run)
+    with instrument.capture_args(args):
+        checkfastq = CheckFastq(args.fastq1, args.fastq2, args.run,
+                                args.processes, stats=args.stats,
+                                binary=not args.text,
+                                checkpoint=args.checkpoint)
     logging.info('Result: %s', json.dumps(checkfastq.check_dict))
     end = time.time()
     logging.info('Spend time:%s.', end-start)
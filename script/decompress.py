@@ -1,26 +1,128 @@
 """Do decompressing comprressed file."""
 
+import bz2
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+import io
+import lzma
 import os
+import shutil
 import sys
+import tarfile
+import time
+
+import gzip_members
+
+# open function of single compressed stream
+OPENERS = {'.gz': gzip.open, '.tgz': gzip.open, '.bz2': bz2.open,
+           '.tbz2': bz2.open, '.xz': lzma.open, '.txz': lzma.open}
+TAR_EXTS = ('.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+
+class ProgressReader(io.RawIOBase):
+    """Raw reader which calls callback(bytes, seconds) after every read."""
+
+    def __init__(self, handle, callback=None):
+        """Init class."""
+        self.handle = handle
+        self.callback = callback
+        self.bytes = 0
+        self.start = time.time()
+
+    def readable(self):
+        """Return True."""
+        return True
+
+    def readinto(self, b):
+        """Read data into b."""
+        size = self.handle.readinto(b)
+        self.bytes += size
+        if self.callback is not None:
+            self.callback(self.bytes, time.time() - self.start)
+        return size
+
+    def close(self):
+        """Close handle."""
+        if not self.closed:
+            self.handle.close()
+        super(ProgressReader, self).close()
+
+
+def print_progress(size, seconds):
+    """Write decompressed size and throughput to stderr."""
+    speed = size / 1e6 / seconds if seconds else 0.0
+    sys.stderr.write('\rdecompressed %.1f MB, %.1f MB/s' % (
+        size / 1e6, speed))
+
+
+def safe_member(member, outdir):
+    """Return member which is extracted inside outdir, or raise error."""
+    if hasattr(tarfile, 'data_filter'):
+        return tarfile.data_filter(member, outdir)
+    outdir = os.path.abspath(outdir)
+    path = os.path.abspath(os.path.join(outdir, member.name))
+    if os.path.commonpath([outdir, path]) != outdir:
+        raise tarfile.TarError('Member %s is outside %s!' % (
+            member.name, outdir))
+    return member
+
+
+def write_at(fd, data, offset):
+    """Write all data to fd at offset."""
+    view = memoryview(data)
+    while view:
+        size = os.pwrite(fd, view, offset)
+        view, offset = view[size:], offset + size
 
 
 class Decompress(object):
     """Decompress compressd file."""
 
-    def __init__(self, infile, outpath):
-        """Init class."""
+    def __init__(self, infile, outpath, threads=1, callback=None):
+        """Init class.
+
+        threads is the number of threads to write members of tar file and
+        to inflate multi-member gzip file, callback(bytes, seconds) is
+        called with decompressed bytes while decompressing.
+        """
         self.infile = infile
         self.outpath = outpath
+        self.threads = threads
+        self.callback = callback
         if not os.path.isfile(infile):
             raise ValueError("Can not find this file %s!", infile)
 
+    def open_stream(self, infile):
+        """Open compressed file as binary decompressed stream."""
+        file_ext = os.path.splitext(infile)[1]
+        if file_ext in ('.gz', '.tgz') and self.threads > 1 and \
+                gzip_members.is_multi_member(infile):
+            handle = gzip_members.ParallelGzipReader(infile, self.threads)
+        else:
+            handle = OPENERS[file_ext](infile, 'rb')
+        return io.BufferedReader(ProgressReader(handle, self.callback),
+                                 buffer_size=1 << 20)
+
+    def un_stream(self, infile, outfile):
+        """Decompress gz, bz2 or xz file to outfile."""
+        if os.path.isdir(outfile):
+            outfile = os.path.join(outfile, os.path.splitext(
+                os.path.basename(infile))[0])
+        with self.open_stream(infile) as reader, open(outfile, 'wb') as wt:
+            shutil.copyfileobj(reader, wt, 1 << 20)
+
     def un_gz(self, infile, outfile):
         """Decompress gzip file."""
-        import subprocess
-        try:
-            subprocess.check_call('gunzip -c %s > %s', shell=True)
-        except subprocess.CalledProcessError as e:
-            raise
+        self.un_stream(infile, outfile)
+
+    def un_bz2(self, infile, outfile):
+        """Decompress bzip2 file."""
+        self.un_stream(infile, outfile)
+
+    def un_xz(self, infile, outfile):
+        """Decompress xz file."""
+        self.un_stream(infile, outfile)
 
     @staticmethod
     def makedirs(dire):
@@ -38,6 +140,58 @@ class Decompress(object):
             tar.extract(name, outdir)
         tar.close()
 
+    def un_tar_stream(self, fileobj, outdir, size=1 << 22, max_open=64):
+        """Untar stream of tar file without seeking.
+
+        Data of members is read in order and written by a thread pool, at
+        most threads * 4 chunks and max_open files are pending.
+        """
+        self.makedirs(outdir)
+        kwargs = {'filter': 'data'} if hasattr(tarfile, 'data_filter') \
+            else {}
+        # chunk writes and files which are not closed
+        chunks, files = deque(), deque()
+        with tarfile.open(fileobj=fileobj, mode='r|') as tar, \
+                ThreadPoolExecutor(self.threads) as pool:
+            try:
+                for member in tar:
+                    member = safe_member(member, outdir)
+                    if not member.isfile():
+                        tar.extract(member, outdir, **kwargs)
+                        continue
+                    path = os.path.join(outdir, member.name)
+                    self.makedirs(os.path.dirname(path))
+                    fd = os.open(path, os.O_WRONLY | os.O_CREAT |
+                                 os.O_TRUNC, 0o644)
+                    files.append((fd, path, member, []))
+                    handle = tar.extractfile(member)
+                    offset = 0
+                    for data in iter(lambda: handle.read(size), b''):
+                        job = pool.submit(write_at, fd, data, offset)
+                        files[-1][3].append(job)
+                        chunks.append(job)
+                        offset += len(data)
+                        while len(chunks) > self.threads * 4:
+                            chunks.popleft().result()
+                    self._close_files(files, len(files) - max_open)
+            finally:
+                self._close_files(files, len(files))
+
+    @staticmethod
+    def _close_files(files, wait=0):
+        """Close files whose chunks are written, wait for the oldest."""
+        while files and (wait > 0 or all(x.done() for x in files[0][3])):
+            fd, path, member, jobs = files.popleft()
+            try:
+                for job in jobs:
+                    job.result()
+            finally:
+                os.close(fd)
+            if member.mode is not None:
+                os.chmod(path, member.mode)
+            os.utime(path, (member.mtime, member.mtime))
+            wait -= 1
+
     def un_zip(self, file_name, outdir):
         """Unzip zip file."""
         import zipfile
@@ -62,18 +216,12 @@ class Decompress(object):
 
     def decompress(self):
         """Decompress."""
-        func = {'.gz': 'un_gz', '.tar': 'un_tar', '.zip': 'un_zip',
-                '.rar': 'un_rar'}
+        func = {'.gz': 'un_gz', '.bz2': 'un_bz2', '.xz': 'un_xz',
+                '.tar': 'un_tar', '.zip': 'un_zip', '.rar': 'un_rar'}
         file_ext = os.path.splitext(self.infile)[1]
-        if self.infile.endswith('.tar.gz'):
-            import uuid
-            tempfile = os.path.join(self.outpath, '%s.tmp.tar' % (
-                uuid.uuid1()))
-            self.un_gz(self.infile, tempfile)
-            try:
-                self.un_tar(tempfile, self.outpath)
-            finally:
-                os.remove(tempfile)
+        if self.infile.endswith(TAR_EXTS):
+            with self.open_stream(self.infile) as reader:
+                self.un_tar_stream(reader, self.outpath)
         elif file_ext in func:
             getattr(self, func[file_ext])(self.infile, self.outpath)
         else:
@@ -83,6 +231,9 @@ class Decompress(object):
 
 if __name__ == '__main__':
     if len(sys.argv) < 3:
-        print('Usage: python {0} infile outpath\n'.format(sys.argv[0]))
+        print('Usage: python {0} infile outpath [threads]\n'.format(
+            sys.argv[0]))
         sys.exit(0)
-    Decompress(*sys.argv[1:3]).decompress()
+    Decompress(*sys.argv[1:3], threads=int(sys.argv[3]) if len(
+        sys.argv) > 3 else 1, callback=print_progress).decompress()
+    sys.stderr.write('\n')
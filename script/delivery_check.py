@@ -0,0 +1,437 @@
+"""Check files of a delivery by reading every file once.
+
+The data read from a file is hashed (md5 by default), verified by the
+decompressor of check_compress and, for fastq files, parsed and checked by
+CheckFastq at the same time, instead of running file_md5, check_compress
+and deal_fastq one after another. Files are checked concurrently by a
+process (or thread) pool under an asyncio front end, the result is one
+json report of the delivery:
+
+>>> report = check_delivery('delivery_dir', 'report.json', processes=4)
+
+A scheduler with an event loop can await check_delivery_async, several
+deliveries can share one pool.
+"""
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+
+import check_compress
+from deal_fastq import CheckFastq
+from file_md5 import read_md5file
+import instrument
+from read_gzbzfile import ReadGgBz2Normal
+
+_logger = logging.getLogger(__name__)
+FASTQ_SUFFIXES = ('.fq', '.fastq')
+# compressed formats of fastq which are read by TeeReader
+FASTQ_FORMATS = ('.gz', '.bz2', '.xz')
+# read 1 and read 2 of a pair only differ in the number after _R, _ or .
+MATE = re.compile(r'^(.*[._-]R?)([12])([._-][^/]*)$')
+MD5_NAMES = ('md5.txt', 'md5sum.txt')
+
+
+class HashedFile(object):
+    """Binary file whose read data is hashed."""
+
+    def __init__(self, filename, algorithms=('md5', )):
+        """Init class."""
+        self.handle = open(filename, 'rb')
+        self.hashes = OrderedDict((x, hashlib.new(x)) for x in algorithms)
+
+    def __enter__(self):
+        """Return self."""
+        return self
+
+    def __exit__(self, atype, value, trace):
+        """Close file."""
+        self.close()
+
+    def read(self, size=-1):
+        """Read data and hash it."""
+        data = self.handle.read(size)
+        for hash_obj in self.hashes.values():
+            hash_obj.update(data)
+        return data
+
+    def drain(self, size=1 << 20):
+        """Hash the rest of file."""
+        while self.read(size):
+            pass
+
+    def digests(self):
+        """Get {algorithm: hex digest} of the data read."""
+        return dict((x, y.hexdigest()) for x, y in self.hashes.items())
+
+    def close(self):
+        """Close file."""
+        self.handle.close()
+
+
+class TeeReader(ReadGgBz2Normal):
+    """Read fastq file once for digests, integrity and records.
+
+    The raw data is hashed and verified by the decompressor of
+    check_compress, the decompressed data is parsed like ReadGgBz2Normal.
+    If it is closed before the end (e.g. an error of reads is found), the
+    rest of file is still hashed and verified without parsing.
+    """
+
+    def __init__(self, filename, binary=True, algorithms=('md5', ),
+                 size=1 << 20):
+        """Init class, size is bytes of a raw read."""
+        self.filename = filename
+        self.binary = binary
+        self.start = (0, 0)
+        self.block_start = (0, 0, 0)
+        # it is read by HashedFile, not by member
+        self.members = None
+        self.error = 'Failed to read %s' % os.path.basename(filename)
+        self.backend = 'tee'
+        self.size = size
+        fmt = check_compress.file_format(filename)
+        self.result = check_compress.VerifyResult(filename, fmt)
+        self.verifier = check_compress.VERIFIERS.get(
+            fmt, check_compress.PlainVerifier)()
+        self.handle = HashedFile(filename, algorithms)
+        self.failed = False
+        self.done = False
+        self.started = time.time()
+
+    def close(self):
+        """Hash and verify the rest of file, then close it."""
+        if not self.done:
+            for data in iter(lambda: self.handle.read(self.size), b''):
+                self._verify(data)
+            self._end()
+        self.handle.close()
+
+    def read_chunks(self, size=1 << 22):
+        """Read decompressed chunks, size is not used."""
+        return instrument.timed(self._chunks(), 'read_decompress', len,
+                                backend=self.backend)
+
+    def _chunks(self):
+        """Hash and verify raw data, yield decompressed data."""
+        for data in iter(lambda: self.handle.read(self.size), b''):
+            data = self._verify(data)
+            if self.failed:
+                raise ValueError(self.result.message)
+            if data:
+                yield data
+        self._end()
+        if self.failed:
+            raise ValueError(self.result.message)
+
+    def _verify(self, data):
+        """Feed raw data to verifier, or check the end if data is None.
+
+        Return decompressed data, it is b'' after a failure.
+        """
+        if self.failed:
+            return b''
+        try:
+            if data is None:
+                self.verifier.close()
+                return b''
+            return self.verifier.feed(data)
+        except check_compress.VERIFY_ERRORS as e:
+            self.failed = True
+            self.result.status = 'failed'
+            self.result.message = str(e)
+            self.result.offset = self.verifier.member_offset
+            return b''
+
+    def _end(self):
+        """Check the end of file and fill self.result."""
+        self._verify(None)
+        self.done = True
+        result = self.result
+        if self.verifier.garbage:
+            result.message = result.message or \
+                'decompression OK, trailing garbage ignored'
+        result.bytes_in = self.verifier.offset
+        result.bytes_out = self.verifier.bytes_out
+        result.members = self.verifier.members
+        result.seconds = time.time() - self.started
+
+
+def is_fastq(path):
+    """Check whether file is a fastq file which TeeReader can read."""
+    name, ext = os.path.splitext(path.lower())
+    if ext in FASTQ_FORMATS:
+        ext = os.path.splitext(name)[1]
+    return ext in FASTQ_SUFFIXES
+
+
+def is_md5file(path):
+    """Check whether file is a list of md5 by its name."""
+    name = os.path.basename(path).lower()
+    return name.endswith('.md5') or name in MD5_NAMES
+
+
+def file_report(path, digests=None, result=None, message=''):
+    """Get report dict of a file.
+
+    result is the VerifyResult of check_compress, it is not reported for
+    uncompressed file.
+    """
+    report = {'path': path, 'size': os.path.getsize(path),
+              'digests': digests or {}, 'integrity': None,
+              'status': 'failed' if message else 'ok', 'message': message}
+    if result is not None and result.format is not None:
+        report['integrity'] = result.to_dict()
+        if not result.ok:
+            report['status'] = 'failed'
+            report['message'] = result.message
+    return report
+
+
+def check_file(path, algorithms=('md5', )):
+    """Hash and verify a file which is not fastq by one read."""
+    with HashedFile(path, algorithms) as handle:
+        result = None
+        if check_compress.file_format(path) is not None:
+            result = check_compress.verify_file(path, handle)
+        handle.drain()
+    return file_report(path, handle.digests(), result)
+
+
+def check_files(paths, algorithms=('md5', ), dofast=10, stats=False):
+    """Check a file, a fastq file or a pair of fastq files by one read.
+
+    It runs in a worker of the pool. Return (reports of files, report of
+    fastq or None).
+    """
+    if not is_fastq(paths[0]):
+        return [check_file(paths[0], algorithms)], None
+    readers = OrderedDict()
+
+    def opener(filename, **kwargs):
+        """Open fastq by TeeReader and keep it."""
+        readers[filename] = TeeReader(filename, algorithms=algorithms,
+                                      **kwargs)
+        return readers[filename]
+
+    start = time.time()
+    fastq2 = paths[1] if len(paths) > 1 else None
+    fastq = {'fastq1': paths[0], 'fastq2': fastq2, 'check': None,
+             'status': 'ok', 'message': ''}
+    try:
+        check = CheckFastq(paths[0], fastq2, dofast, stats=stats,
+                           opener=opener)
+        fastq['check'] = check.check_dict
+        for key in ('file1_error', 'file2_error', 'pair_error'):
+            if check.check_dict[key]:
+                fastq['status'] = 'failed'
+                fastq['message'] = check.check_dict[key]
+                break
+    except Exception as e:
+        _logger.exception(e)
+        fastq['status'] = 'failed'
+        fastq['message'] = str(e)
+    fastq['seconds'] = time.time() - start
+    files = []
+    for path in paths:
+        if path in readers:
+            reader = readers[path]
+            files.append(file_report(path, reader.handle.digests(),
+                                     reader.result))
+        else:
+            files.append(file_report(path, message=fastq['message']))
+    return files, fastq
+
+
+def check_files_worker(*args):
+    """Run check_files in worker process, return its result and metrics."""
+    instrument.enable()
+    instrument.reset()
+    return check_files(*args), instrument.snapshot()
+
+
+def collect_files(paths, exclude=()):
+    """Get sorted files of paths, the directories are walked."""
+    files = set()
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, _, filenames in os.walk(path):
+                files.update(os.path.join(dirpath, x) for x in filenames)
+        else:
+            files.add(path)
+    exclude = set(os.path.abspath(x) for x in exclude)
+    return sorted(x for x in files if os.path.abspath(x) not in exclude)
+
+
+def delivery_jobs(files):
+    """Group files to jobs of check_files, read 1 and 2 are one job."""
+    fastqs = set(x for x in files if is_fastq(x))
+    jobs = []
+    paired = set()
+    for path in files:
+        if path in paired:
+            continue
+        match = MATE.match(path) if path in fastqs else None
+        if match and match.group(2) == '1':
+            mate = match.group(1) + '2' + match.group(3)
+            if mate in fastqs:
+                paired.add(mate)
+                jobs.append((path, mate))
+                continue
+        jobs.append((path, ))
+    return jobs
+
+
+def expected_md5(md5files):
+    """Get {absolute path: md5} of md5 files and errors of bad files.
+
+    Names in a md5 file are relative to its directory.
+    """
+    md5s = {}
+    errors = []
+    for md5file in md5files:
+        dirname = os.path.dirname(os.path.abspath(md5file))
+        try:
+            checks = read_md5file(md5file)
+        except (ValueError, UnicodeDecodeError) as e:
+            errors.append('Failed to read md5 file %s: %s' % (md5file, e))
+            continue
+        for filename, md5 in checks:
+            md5s[os.path.normpath(os.path.join(dirname, filename))] = md5
+    return md5s, errors
+
+
+async def check_delivery_async(paths, processes=4, pool=None,
+                               algorithms=('md5', ), dofast=10, stats=False,
+                               md5files=None, callback=None, exclude=()):
+    """Check files of paths (files or directories), return report dict.
+
+    Jobs run in pool (an Executor), a ProcessPoolExecutor of processes is
+    made if it is None. md5 of files are compared with md5files, the md5
+    files found in paths are used if it is None. callback(files, fastq)
+    is called with the result of check_files once a job is done.
+    """
+    start = time.time()
+    if isinstance(paths, str):
+        paths = [paths]
+    files = collect_files(paths, exclude)
+    if md5files is None:
+        md5files = [x for x in files if is_md5file(x)]
+    md5s, errors = expected_md5(md5files)
+    if md5s and 'md5' not in algorithms:
+        algorithms = ('md5', ) + tuple(algorithms)
+    jobs = delivery_jobs(files)
+    own = pool is None
+    if own:
+        pool = ProcessPoolExecutor(processes)
+    loop = asyncio.get_running_loop()
+    # metrics of worker processes are returned with the results
+    metered = instrument.enabled and isinstance(pool, ProcessPoolExecutor)
+    func = check_files_worker if metered else check_files
+    try:
+        # the largest jobs are started first, so the pool ends together
+        order = sorted(jobs, key=lambda x: -sum(
+            os.path.getsize(y) for y in x))
+        futures = dict((x, loop.run_in_executor(
+            pool, func, x, algorithms, dofast, stats)) for x in order)
+        for future in asyncio.as_completed(list(futures.values())):
+            result = await future
+            if metered:
+                result, metrics = result
+                instrument.merge(metrics)
+            if callback is not None:
+                callback(*result)
+        results = [futures[x].result() for x in jobs]
+        if metered:
+            results = [x[0] for x in results]
+    except BaseException:
+        if own:
+            # e.g. it is cancelled, drop the waiting jobs and do not block
+            pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    if own:
+        # all jobs are done, so the workers are joined at once
+        pool.shutdown(wait=True)
+    report = {'paths': list(paths), 'status': 'ok', 'errors': errors,
+              'files': [], 'fastq': []}
+    for reports, fastq in results:
+        report['files'].extend(reports)
+        if fastq is not None:
+            report['fastq'].append(fastq)
+    for item in report['files']:
+        md5 = md5s.get(os.path.abspath(item['path']))
+        item['md5_expected'] = md5
+        if md5 is not None and item['digests'].get('md5') != md5:
+            item['status'] = 'failed'
+            item['message'] = item['message'] or 'md5 is not matched'
+    if errors or any(x['status'] != 'ok'
+                     for x in report['files'] + report['fastq']):
+        report['status'] = 'failed'
+    report['seconds'] = time.time() - start
+    return report
+
+
+def check_delivery(paths, report=None, threads=False, **kwargs):
+    """Check files of paths and write json report if report is a file.
+
+    Jobs run by a ThreadPoolExecutor if threads is True, kwargs are
+    passed to check_delivery_async. Return report dict.
+    """
+    if report is not None:
+        kwargs['exclude'] = tuple(kwargs.get('exclude', ())) + (report, )
+    if threads:
+        with ThreadPoolExecutor(kwargs.pop('processes', 4)) as pool:
+            adict = asyncio.run(check_delivery_async(paths, pool=pool,
+                                                     **kwargs))
+    else:
+        adict = asyncio.run(check_delivery_async(paths, **kwargs))
+    if report is not None:
+        with open(report, 'wt') as wt:
+            json.dump(adict, wt, indent=2)
+    return adict
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(__doc__)
+    parser.add_argument('paths', nargs='+', help='files or directories')
+    parser.add_argument('-o', '--output', help='json report path')
+    parser.add_argument('-p', '--processes',
+                        help='check by processes, default is %(default)s',
+                        type=int, default=4)
+    parser.add_argument('-t', '--threads',
+                        help='check by threads instead of processes,'
+                             ' default is %(default)s', action='store_true')
+    parser.add_argument('-a', '--algorithms',
+                        help='digests of files, default is %(default)s',
+                        default='md5')
+    parser.add_argument('-m', '--md5files', nargs='+',
+                        help='md5 files to compare, default is the md5'
+                             ' files found in paths')
+    parser.add_argument('-r', '--run',
+                        help='check every run reads, default is %(default)s',
+                        type=int, default=10)
+    parser.add_argument('-s', '--stats',
+                        help='add statistics of reads, default is %(default)s',
+                        action='store_true')
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s-%(filename)s[line:%(lineno)d]-%(levelname)s:'
+               ' %(message)s')
+    with instrument.capture_args(args):
+        adict = check_delivery(
+            args.paths, args.output, threads=args.threads,
+            processes=args.processes, algorithms=tuple(
+                args.algorithms.split(',')), dofast=args.run,
+            stats=args.stats, md5files=args.md5files)
+    if args.output is None:
+        print(json.dumps(adict, indent=2))
+    logging.info('Status: %s, spend time: %.2fs.', adict['status'],
+                 adict['seconds'])
@@ -0,0 +1,319 @@
+"""Build and use record index of fastq, fastq.gz or fastq.bz2 file.
+
+The index is a sidecar text file (<fastq>.fqi) of checkpoints:
+record number, compressed offset and uncompressed offset. For gz and bz2
+file, the compressed offset is the start of the member (stream) which has
+the record, and the uncompressed offset is counted from that member, so a
+checkpoint of BGZF or multi-member file only inflates part of one member.
+
+zlib of python can not start inflating at a bit offset inside a member
+(there is no inflatePrime), so zran-like windows can not be restored. For
+single-member file the prefix of the member is still inflated, but not
+parsed, when seeking. recompress writes a copy whose members start at
+the checkpoints, seeking it inflates at most step records:
+
+python fastq_index.py in.fq.gz 100000 out.fq.gz
+"""
+import bz2
+from collections import deque
+import gzip
+import io
+import os
+import sys
+import zlib
+
+INDEX_HEAD = '#fastq_index'
+
+
+def index_path(filename):
+    """Get default index path of file."""
+    return filename + '.fqi'
+
+
+def new_decompressor(filename):
+    """Get decompressor for members of compressed file or None."""
+    if filename.endswith('.gz'):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif filename.endswith('.bz2'):
+        return bz2.BZ2Decompressor()
+    return None
+
+
+def iter_members(filename, size=1 << 20):
+    """Yield (compressed offset, uncompressed data) of file.
+
+    Compressed offset is the start of member which has the data, it is 0
+    for plain file.
+    """
+    decompressor = new_decompressor(filename)
+    offset, fed = 0, 0
+    with open(filename, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(size), b''):
+            if decompressor is None:
+                yield 0, chunk
+                continue
+            fed += len(chunk)
+            while chunk:
+                yield offset, decompressor.decompress(chunk)
+                if not decompressor.eof:
+                    break
+                chunk = decompressor.unused_data
+                offset = fed - len(chunk)
+                decompressor = new_decompressor(filename)
+                if not (b'\x1f\x8b'.startswith(chunk[:2]) or
+                        b'BZh'.startswith(chunk[:3])):
+                    # trailing garbage
+                    return
+
+
+def nth_line_end(data, number):
+    """Get the position after the number-th newline of data."""
+    return len(b'\n'.join(data.split(b'\n', number)[:number])) + 1
+
+
+def build_index(filename, step=100000, indexfile=None):
+    """Write index of file with a checkpoint every step records."""
+    indexfile = indexfile or index_path(filename)
+    stat = os.stat(filename)
+    lines = 0
+    # uncompressed offset of current member and data
+    member, member_start, data_start = 0, 0, 0
+    # the line which starts the next checkpoint
+    target = step * 4
+    with open(indexfile, 'wt') as wt:
+        wt.write('%s\t%s\t%s\t%s\n' % (INDEX_HEAD, step, stat.st_size,
+                                       int(stat.st_mtime)))
+        wt.write('0\t0\t0\n')
+        for offset, data in iter_members(filename):
+            if offset != member:
+                member, member_start = offset, data_start
+            count = data.count(b'\n')
+            # a checkpoint at the end of data is put at the start of the
+            # next data, which may be a new member
+            while lines <= target < lines + count:
+                pos = nth_line_end(data, target - lines) if target > lines \
+                    else 0
+                wt.write('%s\t%s\t%s\n' % (
+                    target // 4, member, data_start + pos - member_start))
+                target += step * 4
+            lines += count
+            data_start += len(data)
+
+
+def load_index(filename, indexfile=None):
+    """Load checkpoints of index, raise ValueError if it is out of date."""
+    indexfile = indexfile or index_path(filename)
+    stat = os.stat(filename)
+    with open(indexfile, 'rt') as rd:
+        head = rd.readline().rstrip('\n').split('\t')
+        if head[0] != INDEX_HEAD or head[2:] != [
+                str(stat.st_size), str(int(stat.st_mtime))]:
+            raise ValueError('Index %s is out of date for %s!' % (
+                indexfile, filename))
+        return [tuple(int(x) for x in line.split('\t')) for line in rd]
+
+
+class MemberFile(io.RawIOBase):
+    """Raw reader of file from the uncompressed offset of a member.
+
+    Members are inflated one by one, so the compressed offsets of the
+    members read are known by position. Like gzip, trailing garbage of gz
+    file raises gzip.BadGzipFile after the data before it, and it is
+    ignored for bz2 file.
+    """
+
+    def __init__(self, filename, offset=0, skip=0, size=1 << 20):
+        """Init class, data before skip is inflated but not parsed."""
+        self.filename = filename
+        self.size = size
+        self._fp = open(filename, 'rb')
+        self._fp.seek(offset)
+        self._magic = b'\x1f\x8b' if filename.endswith('.gz') else b'BZh'
+        self._plain = new_decompressor(filename) is None
+        self._decompressor = None
+        # compressed offset after the data read, the data not fed yet
+        self._read = offset
+        self._pending = b''
+        # whether the current member is not ended and the members started
+        self._inside = False
+        self._started = 0
+        self._ended = False
+        # uncompressed bytes inflated, counted from offset
+        self._inflated = 0
+        # (compressed offset, uncompressed offset) of members read
+        self._members = deque([(offset, 0)])
+        self._buffer = b''
+        self._pos = 0
+        if self._plain:
+            # plain file is seeked without reading
+            self._fp.seek(offset + skip)
+            self._read += skip
+            skip = 0
+        while skip > 0:
+            # inflate without parsing, it is part of a member for BGZF
+            data = self.read(min(skip, self.size))
+            if not data:
+                break
+            skip -= len(data)
+
+    def readable(self):
+        """Return True."""
+        return True
+
+    def readinto(self, b):
+        """Read data of one inflating step into b."""
+        # read one step, so data before trailing garbage is not lost
+        if self._pos >= len(self._buffer):
+            self._buffer = self._inflate()
+            self._pos = 0
+        size = min(len(b), len(self._buffer) - self._pos)
+        b[:size] = memoryview(self._buffer)[self._pos:self._pos + size]
+        self._pos += size
+        return size
+
+    def position(self, offset):
+        """Get (compressed offset of member, offset in member).
+
+        offset is an uncompressed offset of the data read, counted from
+        the start of reading. The members before it are forgotten, so
+        offset must not decrease.
+        """
+        members = self._members
+        if self._plain:
+            return members[0][0] + offset, 0
+        while len(members) > 1 and members[1][1] <= offset:
+            members.popleft()
+        return members[0][0], offset - members[0][1]
+
+    def _inflate(self):
+        """Inflate the next data, return b'' at the end."""
+        while not self._ended:
+            data = self._pending or self._fp.read(self.size)
+            if not self._pending:
+                self._read += len(data)
+            self._pending = b''
+            if self._plain:
+                return data
+            if not data:
+                if self._inside:
+                    raise EOFError('Compressed file ended before the '
+                                   'end-of-stream marker was reached')
+                break
+            if not self._inside:
+                data = self._start_member(data)
+                if not data:
+                    continue
+            out = self._decompressor.decompress(data)
+            if self._decompressor.eof:
+                self._inside = False
+                self._pending = self._decompressor.unused_data
+            self._inflated += len(out)
+            if out:
+                return out
+        self._ended = True
+        return b''
+
+    def _start_member(self, data):
+        """Start a new member at data, return data to inflate."""
+        while len(data) < len(self._magic):
+            more = self._fp.read(self.size)
+            if not more:
+                break
+            self._read += len(more)
+            data += more
+        if self._magic == b'\x1f\x8b':
+            # like gzip, zeros after a member are padding
+            data = data.lstrip(b'\x00')
+            if not data:
+                return data
+        if not data.startswith(self._magic):
+            if self._magic == b'\x1f\x8b':
+                raise gzip.BadGzipFile('Not a gzipped file (%r)' % data[:2])
+            elif self._started:
+                # like BZ2File, trailing garbage of bz2 is ignored
+                self._ended = True
+                return b''
+        offset = self._read - len(data)
+        if offset != self._members[-1][0]:
+            self._members.append((offset, self._inflated))
+        self._decompressor = new_decompressor(self.filename)
+        self._inside = True
+        self._started += 1
+        return data
+
+    def close(self):
+        """Close file."""
+        if not self.closed:
+            self._fp.close()
+        super(MemberFile, self).close()
+
+
+def locate(filename, number, indexfile=None):
+    """Open file at record number.
+
+    Return binary handle of MemberFile, compressed offset of the member
+    and uncompressed offset in the member.
+    """
+    record, offset, skip = 0, 0, 0
+    for checkpoint in load_index(filename, indexfile):
+        if checkpoint[0] > number:
+            break
+        record, offset, skip = checkpoint
+    handle = io.BufferedReader(MemberFile(filename, offset, skip))
+    for _ in range((number - record) * 4):
+        skip += len(handle.readline())
+    return handle, offset, skip
+
+
+def open_at(filename, number, indexfile=None):
+    """Open file as binary handle which starts at record number."""
+    return locate(filename, number, indexfile)[0]
+
+
+def new_compressor(filename, level=6):
+    """Get compressor of a member of gz or bz2 file."""
+    if filename.endswith('.gz'):
+        return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    elif filename.endswith('.bz2'):
+        return bz2.BZ2Compressor(level)
+    raise ValueError('Can not compress %s, it is not gz or bz2!' % filename)
+
+
+def recompress(filename, outfile, step=100000, level=6):
+    """Write gz or bz2 file whose members start at every step records.
+
+    The data of outfile is the same as filename, build_index of it with
+    the same step gives checkpoints at member starts.
+    """
+    target = step * 4
+    # lines and bytes of the current member
+    lines, size = 0, 0
+    compressor = new_compressor(outfile, level)
+    with open(outfile, 'wb') as wb:
+        for _, data in iter_members(filename):
+            count = data.count(b'\n')
+            while lines + count >= target:
+                pos = nth_line_end(data, target - lines)
+                wb.write(compressor.compress(data[:pos]))
+                wb.write(compressor.flush())
+                compressor = new_compressor(outfile, level)
+                data = data[pos:]
+                count -= target - lines
+                lines, size = 0, 0
+            wb.write(compressor.compress(data))
+            lines += count
+            size += len(data)
+        if size:
+            wb.write(compressor.flush())
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        sys.stdout.write('Usage:python {0} fastq [step [outfile]]\n'.format(
+            sys.argv[0]))
+        sys.exit(1)
+    if len(sys.argv) > 3:
+        recompress(sys.argv[1], sys.argv[3], int(sys.argv[2]))
+        build_index(sys.argv[3], int(sys.argv[2]))
+    else:
+        build_index(sys.argv[1], *[int(x) for x in sys.argv[2:3]])
@@ -0,0 +1,132 @@
+"""Accumulate statistics of fastq reads in one pass.
+
+All statistics are kept in histograms indexed by ascii code, position or
+length, so the memory only depends on the read length, not the file size.
+"""
+try:
+    import numpy
+    from batch_fastq import join_lines, line_lengths
+except ImportError:
+    numpy = None
+
+
+def add_list(target, values):
+    """Add values to target by position, extend target if needed."""
+    if len(values) > len(target):
+        target.extend([0] * (len(values) - len(target)))
+    for i, value in enumerate(values):
+        if value:
+            target[i] += value
+
+
+def ratio(part, total, ndigits=6):
+    """Get ratio of part in total."""
+    return round(float(part) / total, ndigits) if total else 0.0
+
+
+class FastqStats(object):
+    """Statistics of bases, qualities and lengths of reads."""
+
+    def __init__(self):
+        """Init class."""
+        # base and quality count by ascii code
+        self.base_hist = [0] * 256
+        self.qual_hist = [0] * 256
+        # read count by the length of 2nd and 4th line
+        self.len_hist = []
+        self.qual_len_hist = []
+        # sum of quality ascii code by position
+        self.pos_qual = []
+
+    def add(self, seq, qual):
+        """Add a read."""
+        self.update_python([seq], [qual])
+
+    def update(self, seqs, quals):
+        """Add a batch of reads."""
+        if not seqs:
+            return
+        if numpy is not None:
+            try:
+                seq, qual = join_lines(seqs), join_lines(quals)
+            except UnicodeEncodeError:
+                pass
+            else:
+                self.update_arrays(seq, line_lengths(seqs), qual,
+                                   line_lengths(quals))
+                return
+        self.update_python(seqs, quals)
+
+    def update_python(self, seqs, quals):
+        """Add a batch of reads without numpy."""
+        for lines, hist in ((seqs, self.base_hist), (quals, self.qual_hist)):
+            data = lines[0][:0].join(lines)
+            for char in set(data):
+                code = char if isinstance(char, int) else ord(char)
+                if code < 256:
+                    hist[code] += data.count(char)
+        for seq, qual in zip(seqs, quals):
+            for hist, length in ((self.len_hist, len(seq)),
+                                 (self.qual_len_hist, len(qual))):
+                if length >= len(hist):
+                    hist.extend([0] * (length + 1 - len(hist)))
+                hist[length] += 1
+            if not isinstance(qual, bytes):
+                qual = [ord(x) for x in qual]
+            add_list(self.pos_qual, qual)
+
+    def update_arrays(self, seq, seq_len, qual, qual_len):
+        """Add a batch of reads by numpy arrays of joined lines."""
+        add_list(self.base_hist, numpy.bincount(seq, minlength=256).tolist())
+        add_list(self.qual_hist, numpy.bincount(qual, minlength=256).tolist())
+        add_list(self.len_hist, numpy.bincount(seq_len).tolist())
+        add_list(self.qual_len_hist, numpy.bincount(qual_len).tolist())
+        if len(qual):
+            starts = numpy.cumsum(qual_len) - qual_len
+            pos = numpy.arange(len(qual)) - numpy.repeat(starts, qual_len)
+            add_list(self.pos_qual, numpy.bincount(pos, weights=qual).astype(
+                numpy.int64).tolist())
+
+    names = ('base_hist', 'qual_hist', 'len_hist', 'qual_len_hist',
+             'pos_qual')
+
+    def merge(self, other):
+        """Merge statistics of other reads."""
+        for name in self.names:
+            add_list(getattr(self, name), getattr(other, name))
+
+    def state(self):
+        """Get histograms as a dict which can be dumped to json."""
+        return dict((x, list(getattr(self, x))) for x in self.names)
+
+    def load_state(self, state):
+        """Restore histograms of state."""
+        for name in self.names:
+            setattr(self, name, list(state[name]))
+
+    def to_dict(self, phred=33):
+        """Get statistics dict, phred is the offset of quality."""
+        bases = sum(self.base_hist)
+        quals = sum(self.qual_hist)
+        gc_count = sum(self.base_hist[ord(x)] for x in 'GCgc')
+        n_count = sum(self.base_hist[ord(x)] for x in 'Nn')
+        q20_count = sum(self.qual_hist[phred + 20:])
+        q30_count = sum(self.qual_hist[phred + 30:])
+        # read count which have quality at position
+        pos_count, count = [], 0
+        for number in reversed(self.qual_len_hist[1:]):
+            count += number
+            pos_count.append(count)
+        pos_count.reverse()
+        return {
+            'gc_content': ratio(gc_count, bases),
+            'n_rate': ratio(n_count, bases),
+            'q20_base_count': q20_count,
+            'q30_base_count': q30_count,
+            'q20_rate': ratio(q20_count, quals),
+            'q30_rate': ratio(q30_count, quals),
+            'position_mean_quality': [
+                round(float(x) / y - phred, 2)
+                for x, y in zip(self.pos_qual, pos_count)],
+            'length_histogram': dict(
+                (length, x) for length, x in enumerate(self.len_hist) if x)}
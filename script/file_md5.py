@@ -1,6 +1,10 @@
 """Check md5 of file or generate md5."""
+from concurrent.futures import ThreadPoolExecutor
 import hashlib
 import os
+import sqlite3
+
+import instrument
 
 
 class FileMD5(object):
@@ -12,15 +16,33 @@ class FileMD5(object):
         if not os.path.isfile(filepath):
             raise ValueError("Can not find file %s!" % filepath)
         self.filepath = filepath
+        self._digests = {}
 
     @property
     def md5(self):
         """Get md5 of file."""
-        hash_md5 = hashlib.md5()
-        with open(self.filepath, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_md5.update(chunk)
-        return hash_md5.hexdigest()
+        return self.digests(('md5', ))['md5']
+
+    def digests(self, algorithms=('md5', ), size=1 << 24):
+        """Get digests of file for algorithms by one read pass."""
+        todo = [x for x in algorithms if x not in self._digests]
+        if todo:
+            hashes = [hashlib.new(x) for x in todo]
+            # read into one buffer, hashlib releases the GIL for large data
+            buf = bytearray(size)
+            view = memoryview(buf)
+            total = 0
+            with open(self.filepath, "rb", buffering=0) as f, \
+                    instrument.timer('digest', algorithms=','.join(todo)):
+                for length in iter(lambda: f.readinto(buf), 0):
+                    total += length
+                    for hash_obj in hashes:
+                        hash_obj.update(view[:length])
+            instrument.count('digest_bytes', total,
+                             algorithms=','.join(todo))
+            for name, hash_obj in zip(todo, hashes):
+                self._digests[name] = hash_obj.hexdigest()
+        return dict((x, self._digests[x]) for x in algorithms)
 
     def write_md5(self, outfile):
         """Write md5 of file to outfile."""
@@ -35,18 +57,122 @@ class FileMD5(object):
             return True
 
 
-def md5sum(md5file):
-    """Md5sum -c file."""
+class DigestCache(object):
+    """Cache digests of files on disk.
+
+    A digest is used again only if the path, size, mtime and inode of the
+    file are not changed.
+    """
+
+    def __init__(self, dbfile):
+        """Init class."""
+        self.dbfile = dbfile
+        self.conn = sqlite3.connect(dbfile)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS digest (path TEXT, algorithm TEXT,'
+            ' size INTEGER, mtime INTEGER, inode INTEGER, digest TEXT,'
+            ' PRIMARY KEY (path, algorithm))')
+
+    def __enter__(self):
+        """Return self."""
+        return self
+
+    def __exit__(self, atype, value, trace):
+        """Close database."""
+        self.close()
+
+    @staticmethod
+    def file_key(filepath):
+        """Get size, mtime and inode of file."""
+        stat = os.stat(filepath)
+        return stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+    def get(self, filepath, algorithms, key=None):
+        """Get cached digests of file, return {} if file is changed.
+
+        key is file_key of file, it is got now if it is None.
+        """
+        key = key or self.file_key(filepath)
+        rows = self.conn.execute(
+            'SELECT algorithm, digest FROM digest WHERE path = ? AND'
+            ' size = ? AND mtime = ? AND inode = ?', (filepath, ) + key)
+        digests = dict(rows)
+        return dict((x, digests[x]) for x in algorithms if x in digests)
+
+    def set(self, filepath, digests, key=None):
+        """Save digests of file, return whether they are saved.
+
+        key is file_key of file before hashing, the digests are not saved
+        if the file is changed since then, e.g. it is being written.
+        """
+        if key is None:
+            key = self.file_key(filepath)
+        elif key != self.file_key(filepath):
+            return False
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO digest VALUES (?, ?, ?, ?, ?, ?)',
+            [(filepath, name) + key + (digest, )
+             for name, digest in digests.items()])
+        self.conn.commit()
+        return True
+
+    def close(self):
+        """Close database."""
+        self.conn.close()
+
+
+def hash_files(filepaths, algorithms=('md5', ), threads=4, cache=None):
+    """Get digests of many files by threads.
+
+    Return {filepath: {algorithm: digest}}, cache is a DigestCache or None.
+    """
+    result = {}
+    todo = []
+    for filepath in filepaths:
+        filemd5 = FileMD5(filepath)
+        key = None
+        if cache is not None:
+            # the key before hashing, digests of a changing file are wrong
+            key = cache.file_key(filemd5.filepath)
+            filemd5._digests.update(cache.get(filemd5.filepath, algorithms,
+                                              key))
+        if all(x in filemd5._digests for x in algorithms):
+            result[filepath] = filemd5.digests(algorithms)
+        else:
+            todo.append((filepath, filemd5, key))
+    with ThreadPoolExecutor(threads) as pool:
+        jobs = [(filepath, filemd5, key, pool.submit(filemd5.digests,
+                                                     algorithms))
+                for filepath, filemd5, key in todo]
+        # write cache in this thread, sqlite connection is not shared
+        for filepath, filemd5, key, job in jobs:
+            result[filepath] = job.result()
+            if cache is not None:
+                cache.set(filemd5.filepath, result[filepath], key)
+    return result
+
+
+def read_md5file(md5file):
+    """Get [(filename, md5)] of md5sum or openssl md5 output file."""
     md5, filename = ('',) * 2
+    checks = []
     with open(md5file) as wt:
         for line in wt:
+            if not line.strip():
+                continue
             if line.startswith("MD5"):
                 filename, md5 = line.split('=')
                 filename = filename.replace('MD5(', '').replace(')', '')
             else:
                 md5, filename = line.split('  ')[:2]
-            md5 = md5.strip()
-            filename = filename.strip()
-            filemd5 = FileMD5(filename)
-            infor = 'succeed' if filemd5.md5check(md5) else 'fail'
-            print('{} md5 check: {}'.format(filename, infor))
+            checks.append((filename.strip(), md5.strip()))
+    return checks
+
+
+def md5sum(md5file, threads=1, cache=None):
+    """Md5sum -c file."""
+    checks = read_md5file(md5file)
+    digests = hash_files([x[0] for x in checks], threads=threads, cache=cache)
+    for filename, md5 in checks:
+        infor = 'succeed' if digests[filename]['md5'] == md5 else 'fail'
+        print('{} md5 check: {}'.format(filename, infor))
@@ -0,0 +1,223 @@
+"""Decompress multi-member gzip (e.g. BGZF) file by threads.
+
+Members start with the gzip magic, so the file is split at the magic before
+decompressing. zlib releases the GIL, so the members can be inflated by a
+thread pool and joined by order. A split at magic bytes inside deflate data
+is found because the member before it does not end there, then the member is
+continued serially.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+import io
+import mmap
+import zlib
+
+GZIP_MAGIC = b'\x1f\x8b\x08'
+# wbits for zlib to read gzip header and check CRC32/ISIZE
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def is_member_head(data, offset):
+    """Check whether data at offset looks like a gzip header."""
+    head = data[offset:offset + 10]
+    return len(head) == 10 and head[:3] == GZIP_MAGIC and \
+        not head[3] & 0xe0 and head[8] in (0, 2, 4)
+
+
+def member_offsets(data, start=0):
+    """Yield offsets of possible gzip members in data."""
+    offset = data.find(GZIP_MAGIC, start)
+    while offset != -1:
+        if is_member_head(data, offset):
+            yield offset
+        offset = data.find(GZIP_MAGIC, offset + 1)
+
+
+def member_header(data, offset=0):
+    """Parse gzip header at offset, return (size, extra field) or None."""
+    if not is_member_head(data, offset):
+        return None
+    flags = data[offset + 3]
+    pos = offset + 10
+    extra = b''
+    if flags & 4:
+        size = int.from_bytes(data[pos:pos + 2], 'little')
+        extra = data[pos + 2:pos + 2 + size]
+        pos += 2 + size
+    for flag in (8, 16):
+        # zero-terminated file name and comment
+        if flags & flag:
+            pos = data.find(b'\x00', pos, pos + 65536) + 1
+            if not pos:
+                return None
+    if flags & 2:
+        pos += 2
+    if pos > len(data):
+        return None
+    return pos - offset, bytes(extra)
+
+
+def is_bgzf(extra):
+    """Check whether extra field of gzip header has the BC subfield."""
+    pos = 0
+    while pos + 4 <= len(extra):
+        size = int.from_bytes(extra[pos + 2:pos + 4], 'little')
+        if extra[pos:pos + 2] == b'BC':
+            return True
+        pos += 4 + size
+    return False
+
+
+def is_multi_member(filename, size=1 << 20):
+    """Check whether gzip file has more than one member.
+
+    BGZF file is known by its first header. Otherwise the first member is
+    inflated in the first size bytes, it must end there and be followed by
+    a valid header, so a larger first member is taken as single-member.
+    """
+    with open(filename, 'rb') as fp:
+        data = fp.read(size)
+    head = member_header(data)
+    if head is None:
+        return False
+    if is_bgzf(head[1]):
+        return True
+    decompressor = zlib.decompressobj(GZIP_WBITS)
+    try:
+        while not decompressor.eof:
+            # output is bounded, the member may be highly compressed
+            out = decompressor.decompress(data, 1 << 20)
+            data = decompressor.unconsumed_tail
+            if not out and not data:
+                break
+    except zlib.error:
+        return False
+    return decompressor.eof and \
+        member_header(decompressor.unused_data) is not None
+
+
+def split_ranges(data, size):
+    """Split data to ranges of about size bytes at member offsets."""
+    start = 0
+    for offset in member_offsets(data, 1):
+        if offset - start >= size:
+            yield start, offset
+            start = offset
+    yield start, len(data)
+
+
+def inflate(data, decompressor=None):
+    """Inflate members in data.
+
+    Return output, the decompressor of the last member and the bytes after
+    the last member which are not gzip data.
+    """
+    out = []
+    decompressor = decompressor or zlib.decompressobj(GZIP_WBITS)
+    while data:
+        out.append(decompressor.decompress(data))
+        if not decompressor.eof:
+            break
+        data = decompressor.unused_data
+        if data[:3] != GZIP_MAGIC:
+            return b''.join(out), decompressor, data
+        decompressor = zlib.decompressobj(GZIP_WBITS)
+    return b''.join(out), decompressor, b''
+
+
+def inflate_range(data, start, end):
+    """Inflate data[start:end], it is run in thread."""
+    try:
+        return inflate(data[start:end])
+    except zlib.error as e:
+        # start may be a wrong member offset, raise it only if used
+        return e
+
+
+class ParallelGzipReader(io.RawIOBase):
+    """Raw reader of multi-member gzip file which inflates by threads."""
+
+    def __init__(self, filename, threads=4, size=1 << 22):
+        """Init class."""
+        self.filename = filename
+        self.threads = threads
+        self.size = size
+        self._fp = open(filename, 'rb')
+        self._data = mmap.mmap(self._fp.fileno(), 0, access=mmap.ACCESS_READ)
+        self._pool = ThreadPoolExecutor(threads)
+        self._outputs = self.iter_outputs()
+        self._buffer = b''
+        self._pos = 0
+        # decompressor of the last inflated member
+        self._last = None
+
+    def readable(self):
+        """Return True."""
+        return True
+
+    def iter_outputs(self):
+        """Yield decompressed data by the order of file."""
+        ranges = split_ranges(self._data, self.size)
+        jobs = deque()
+        for start, end in ranges:
+            jobs.append((start, end, self._pool.submit(
+                inflate_range, self._data, start, end)))
+            if len(jobs) < self.threads * 2:
+                continue
+            for out in self._join(jobs):
+                yield out
+        for out in self._join(jobs, True):
+            yield out
+
+    def _join(self, jobs, finish=False):
+        """Get the outputs of finished jobs by order."""
+        while jobs and (finish or len(jobs) >= self.threads * 2):
+            start, end, job = jobs.popleft()
+            if self._last is not None and not self._last.eof:
+                # start is not a member offset, continue the last member
+                result = inflate(self._data[start:end], self._last)
+            else:
+                result = job.result()
+                if isinstance(result, Exception):
+                    raise result
+            out, self._last, garbage = result
+            if out:
+                yield out
+            if garbage:
+                # like gzip, report it after the data before it
+                raise gzip.BadGzipFile(
+                    'Not a gzipped file (%r)' % garbage[:2])
+        if finish and self._last is not None and not self._last.eof:
+            raise EOFError('Compressed file ended before the end-of-stream'
+                           ' marker was reached')
+
+    def readinto(self, b):
+        """Read decompressed data into b."""
+        while self._pos >= len(self._buffer):
+            self._buffer = next(self._outputs, b'')
+            self._pos = 0
+            if not self._buffer:
+                return 0
+        size = min(len(b), len(self._buffer) - self._pos)
+        b[:size] = memoryview(self._buffer)[self._pos:self._pos + size]
+        self._pos += size
+        return size
+
+    def close(self):
+        """Close file and threads."""
+        if not self.closed:
+            self._outputs.close()
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._data.close()
+            self._fp.close()
+        super(ParallelGzipReader, self).close()
+
+
+def open_parallel(filename, mode='rb', threads=4):
+    """Open multi-member gzip file which is inflated by threads."""
+    raw = ParallelGzipReader(filename, threads)
+    handle = io.BufferedReader(raw, buffer_size=1 << 20)
+    if 't' in mode:
+        handle = io.TextIOWrapper(handle)
+    return handle
@@ -1,8 +1,69 @@
 """Parse html to table."""
-from bs4 import BeautifulSoup
+import hashlib
+import multiprocessing
 import os
 import pandas
 
+from file_md5 import FileMD5
+
+
+def parse_attribute(name):
+    """Split attribute 'key: value' of table."""
+    key, value = name.split(': ')
+    return key, value
+
+
+def match_table(attrib, key, value):
+    """Check attributes of table like BeautifulSoup.find."""
+    attr = attrib.get(key)
+    if attr is None:
+        return False
+    return attr == value or key == 'class' and value in attr.split()
+
+
+class TableRows(object):
+    """Collect rows of a table to column lists."""
+
+    def __init__(self, name, htmlfile):
+        """Init class."""
+        self.name = name
+        self.htmlfile = htmlfile
+        self.cols = []
+        self.columns = None
+        self.index = []
+        self.i = -1
+
+    def add_header(self, cols):
+        """Add header row, it starts a new table."""
+        if not cols:
+            raise ValueError(
+                "Can not find columns for table %s in file %s!",
+                self.name, self.htmlfile)
+        self.cols = cols
+        self.columns = [[] for _ in cols]
+        self.index = []
+
+    def add_values(self, values):
+        """Add values row."""
+        self.i += 1
+        if len(values) != len(self.cols):
+            raise ValueError(
+                "Values length %s is not same with columns length"
+                " at [%s] line for table %s in file %s!",
+                len(values), self.i, self.name, self.htmlfile)
+        for column, value in zip(self.columns, values):
+            column.append(value)
+        self.index.append(self.i)
+
+    def to_dataframe(self):
+        """Build dataframe once, return None if no header is found."""
+        if self.columns is None:
+            return None
+        df = pandas.DataFrame(dict(enumerate(self.columns)), index=self.index,
+                              columns=range(len(self.cols)))
+        df.columns = self.cols
+        return df
+
 
 class Html2Table(object):
     """Find table by tag from html and output dataframe."""
@@ -13,13 +74,21 @@ class Html2Table(object):
             raise ValueError("Can not find html %s!", htmlfile)
         self.htmlfile = htmlfile
 
-    def parse(self, attributes):
-        """Parse html and find table."""
+    def parse(self, attributes, stream=False):
+        """Parse html and find table.
+
+        stream mode finds all tables by one pass of lxml iterparse without
+        building the whole tree.
+        """
+        if stream:
+            self.df_dict = self.parse_stream(attributes)
+            return
+        from bs4 import BeautifulSoup
         self.df_dict = {}
         with open(self.htmlfile, 'rt', encoding='utf-8') as hl:
             bsobj = BeautifulSoup(hl, 'lxml')
             for name in attributes:
-                key, value = name.split(': ')
+                key, value = parse_attribute(name)
                 if key == 'class':
                     key = 'class_'
                 table = bsobj.find('table', **{key: value})
@@ -28,6 +97,59 @@ class Html2Table(object):
                     df = self.parser_table(table, name)
                 self.df_dict.setdefault(name, df)
 
+    def parse_stream(self, attributes):
+        """Find the first table of every attribute by one pass."""
+        from lxml import etree
+        pending = dict((x, parse_attribute(x)) for x in attributes)
+        df_dict = dict((x, None) for x in attributes)
+        # rows of tables being parsed, by depth of table
+        tables = {}
+        depth = 0
+        with open(self.htmlfile, 'rb') as hl:
+            for event, elem in etree.iterparse(
+                    hl, events=('start', 'end'), html=True,
+                    encoding='utf-8'):
+                if event == 'start':
+                    if elem.tag == 'table':
+                        depth += 1
+                        names = [x for x, (key, value) in pending.items()
+                                 if match_table(elem.attrib, key, value)]
+                        if names:
+                            tables[depth] = [TableRows(x, self.htmlfile)
+                                             for x in names]
+                            for name in names:
+                                del pending[name]
+                    continue
+                if elem.tag == 'tr' and depth in tables:
+                    self._add_row(tables[depth], elem)
+                    elem.clear()
+                elif elem.tag == 'table':
+                    for rows in tables.pop(depth, []):
+                        df_dict[rows.name] = rows.to_dataframe()
+                    depth -= 1
+                    if not pending and not tables:
+                        break
+                if not tables:
+                    # free parsed elements out of tables
+                    elem.clear()
+                    while elem.getprevious() is not None:
+                        del elem.getparent()[0]
+        return df_dict
+
+    @staticmethod
+    def _add_row(tables, node):
+        """Add tr node of lxml to TableRows."""
+        cols = [''.join(x.itertext()).rstrip(os.linesep).strip()
+                for x in node.findall('th')]
+        if cols:
+            for rows in tables:
+                rows.add_header(cols)
+        else:
+            values = [''.join(x.itertext()).rstrip(os.linesep).strip()
+                      for x in node.findall('td')]
+            for rows in tables:
+                rows.add_values(values)
+
     @staticmethod
     def get_list(node, tag):
         """Get list for pointed child name."""
@@ -36,29 +158,133 @@ class Html2Table(object):
 
     def parser_table(self, node, name):
         """Parse BeautifulSoup node to pandas dataframe."""
-        df = None
-        i = -1
-        cols = []
+        rows = TableRows(name, self.htmlfile)
         for child in node.find_all('tr'):
             if child.find('th') is not None:
-                cols = self.get_list(child, 'th')
-                if cols:
-                    df = pandas.DataFrame(columns=cols)
-                else:
-                    raise ValueError(
-                        "Can not find columns for table %s in file %s!",
-                        name, self.htmlfile)
+                rows.add_header(self.get_list(child, 'th'))
             else:
-                values = self.get_list(child, 'td')
-                i += 1
-                if len(values) == len(cols):
-                    df.loc[i] = values
-                else:
-                    raise ValueError(
-                        "Values length %s is not same with columns length"
-                        " at [%s] line for table %s in file %s!",
-                        len(values), i, name, self.htmlfile)
-        return df
+                rows.add_values(self.get_list(child, 'td'))
+        return rows.to_dataframe()
+
+
+def _parse_file(args):
+    """Parse tables of a html file."""
+    htmlfile, attributes, stream = args
+    html = Html2Table(htmlfile)
+    html.parse(attributes, stream)
+    return htmlfile, html.df_dict
+
+
+def parse_dir(dirname, attributes, processes=4, stream=True):
+    """Parse tables of all html files in directory by processes.
+
+    Return {htmlfile: {attribute: dataframe}}.
+    """
+    htmlfiles = sorted(
+        os.path.join(dirname, x) for x in os.listdir(dirname)
+        if x.endswith(('.html', '.htm')))
+    jobs = [(x, attributes, stream) for x in htmlfiles]
+    pool = multiprocessing.Pool(processes)
+    try:
+        return dict(pool.imap_unordered(_parse_file, jobs))
+    finally:
+        pool.close()
+        pool.join()
+
+
+class TableCache(object):
+    """Cache tables of html file keyed by content hash and attribute.
+
+    fmt is pickle, parquet or feather, parquet and feather need pyarrow.
+    A table which is not found is cached as an empty .none file.
+    """
+
+    suffixes = {'pickle': '.pkl', 'parquet': '.parquet',
+                'feather': '.feather'}
+
+    def __init__(self, cachedir, fmt='pickle'):
+        """Init class."""
+        if fmt not in self.suffixes:
+            raise ValueError("Can not cache table as %s!" % fmt)
+        self.cachedir = cachedir
+        self.fmt = fmt
+        if not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+
+    def path(self, digest, name):
+        """Get cache path prefix of table."""
+        key = hashlib.md5(('%s\t%s' % (digest, name)).encode(
+            'utf-8')).hexdigest()
+        return os.path.join(self.cachedir, key)
+
+    def get(self, digest, name):
+        """Return (found, dataframe) of cached table."""
+        path = self.path(digest, name)
+        if os.path.isfile(path + '.none'):
+            return True, None
+        path += self.suffixes[self.fmt]
+        if not os.path.isfile(path):
+            return False, None
+        if self.fmt == 'pickle':
+            return True, pandas.read_pickle(path)
+        elif self.fmt == 'parquet':
+            return True, pandas.read_parquet(path)
+        df = pandas.read_feather(path).set_index('index')
+        return True, df.rename_axis(None)
+
+    def set(self, digest, name, df):
+        """Save table, it is written to a temp file and then renamed."""
+        path = self.path(digest, name)
+        if df is None:
+            path += '.none'
+            open(path, 'w').close()
+            return
+        path += self.suffixes[self.fmt]
+        tmpfile = '%s.%s.tmp' % (path, os.getpid())
+        if self.fmt == 'pickle':
+            df.to_pickle(tmpfile)
+        elif self.fmt == 'parquet':
+            df.to_parquet(tmpfile)
+        else:
+            df.reset_index().to_feather(tmpfile)
+        os.replace(tmpfile, path)
+
+
+def extract_tables(htmlfiles, attributes, cachedir, fmt='pickle',
+                   processes=1, stream=True):
+    """Get tables of many html files by cache.
+
+    Only tables which are not cached are parsed, by processes if
+    processes > 1. Return {htmlfile: {attribute: dataframe}}.
+    """
+    cache = TableCache(cachedir, fmt)
+    result, digests, jobs = {}, {}, []
+    for htmlfile in htmlfiles:
+        digests[htmlfile] = FileMD5(htmlfile).md5
+        result[htmlfile] = {}
+        missing = []
+        for name in attributes:
+            found, df = cache.get(digests[htmlfile], name)
+            if found:
+                result[htmlfile][name] = df
+            else:
+                missing.append(name)
+        if missing:
+            jobs.append((htmlfile, missing, stream))
+    if processes > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(processes)
+        try:
+            outputs = list(pool.imap_unordered(_parse_file, jobs))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        outputs = [_parse_file(x) for x in jobs]
+    for htmlfile, df_dict in outputs:
+        for name, df in df_dict.items():
+            cache.set(digests[htmlfile], name, df)
+            result[htmlfile][name] = df
+    return result
 
 
 def test():
@@ -67,4 +293,6 @@ def test():
     html.parse(['class: zebra run-metatable'])
     print(html.df_dict['class: zebra run-metatable'])
 
-test()
+
+if __name__ == '__main__':
+    test()
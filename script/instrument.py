@@ -0,0 +1,303 @@
+"""Counters and timers of the readers and checkers.
+
+Instrumentation is off by default, then count, add_time and timer return
+at once and timed returns the iterable itself, so the hooks cost a call
+per block of data at most. When it is enabled:
+
+>>> instrument.enable()
+>>> CheckFastq('test_1.fq.gz', 'test_2.fq.gz')
+>>> instrument.write('metrics.prom')     # or metrics.json
+
+Metrics are kept per process with labels, e.g. read_decompress_bytes
+{backend="zlib"}. Timers keep seconds and count. Metrics of pool
+workers are returned by the callers which support it and merged.
+"""
+import contextlib
+import json
+import logging
+import threading
+import time
+
+_logger = logging.getLogger(__name__)
+_lock = threading.Lock()
+enabled = False
+# {(name, labels): value} and {(name, labels): [seconds, count]}, labels
+# is a sorted tuple of (key, value)
+_counters = {}
+_timers = {}
+
+
+def enable(flag=True):
+    """Turn instrumentation on or off."""
+    global enabled
+    enabled = flag
+
+
+def reset():
+    """Drop all metrics."""
+    with _lock:
+        _counters.clear()
+        _timers.clear()
+
+
+def _key(name, labels):
+    """Get key of metric."""
+    return name, tuple(sorted((x, str(y)) for x, y in labels.items()))
+
+
+def count(name, value=1, **labels):
+    """Add value to counter name."""
+    if not enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def add_time(name, seconds, number=1, **labels):
+    """Add seconds of number events to timer name."""
+    if not enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        timer = _timers.setdefault(key, [0.0, 0])
+        timer[0] += seconds
+        timer[1] += number
+
+
+class Timer(object):
+    """Context which adds its seconds to a timer."""
+
+    def __init__(self, name, labels):
+        """Init class."""
+        self.name = name
+        self.labels = labels
+        self.start = None
+
+    def __enter__(self):
+        """Start timer."""
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, atype, value, trace):
+        """Add seconds."""
+        add_time(self.name, time.perf_counter() - self.start, **self.labels)
+
+
+# timer when instrumentation is off
+_null = contextlib.nullcontext()
+
+
+def timer(name, **labels):
+    """Get a context which times its block."""
+    if not enabled:
+        return _null
+    return Timer(name, labels)
+
+
+class Timed(object):
+    """Iterator which times next of iterable.
+
+    Seconds and items are added to timer name when the iterable ends or
+    it is closed, the sizes of items are added to counter name_bytes if
+    size (e.g. len) is given.
+    """
+
+    def __init__(self, iterable, name, size=None, **labels):
+        """Init class."""
+        self.iterator = iter(iterable)
+        self.name = name
+        self.size = size
+        self.labels = labels
+        self.seconds = 0.0
+        self.items = 0
+        self.bytes = 0
+        self.recorded = False
+
+    def __iter__(self):
+        """Return self."""
+        return self
+
+    def __next__(self):
+        """Get next item of iterable."""
+        start = time.perf_counter()
+        try:
+            item = next(self.iterator)
+        except StopIteration:
+            self.seconds += time.perf_counter() - start
+            self.record()
+            raise
+        self.seconds += time.perf_counter() - start
+        self.items += 1
+        if self.size is not None:
+            self.bytes += self.size(item)
+        return item
+
+    def record(self):
+        """Add seconds, items and bytes once."""
+        if self.recorded:
+            return
+        self.recorded = True
+        add_time(self.name, self.seconds, self.items, **self.labels)
+        if self.size is not None:
+            count(self.name + '_bytes', self.bytes, **self.labels)
+
+    def close(self):
+        """Record and close iterable."""
+        self.record()
+        if hasattr(self.iterator, 'close'):
+            self.iterator.close()
+
+    def __del__(self):
+        """Record when the iterable is dropped before its end."""
+        self.record()
+
+
+def timed(iterable, name, size=None, **labels):
+    """Time next of iterable by Timed, return iterable if it is off."""
+    if not enabled:
+        return iterable
+    return Timed(iterable, name, size, **labels)
+
+
+def snapshot():
+    """Get metrics as a dict which can be dumped to json and merged."""
+    with _lock:
+        counters = [{'name': x[0], 'labels': dict(x[1]), 'value': y}
+                    for x, y in sorted(_counters.items())]
+        timers = [{'name': x[0], 'labels': dict(x[1]), 'seconds': y[0],
+                   'count': y[1]} for x, y in sorted(_timers.items())]
+    return {'counters': counters, 'timers': timers}
+
+
+def merge(metrics):
+    """Add metrics of snapshot, e.g. of a worker process."""
+    if not enabled:
+        return
+    for item in metrics['counters']:
+        count(item['name'], item['value'], **item['labels'])
+    for item in metrics['timers']:
+        add_time(item['name'], item['seconds'], item['count'],
+                 **item['labels'])
+
+
+def _labels(labels):
+    """Get labels of prometheus text format."""
+    if not labels:
+        return ''
+    items = []
+    for key, value in sorted(labels.items()):
+        value = value.replace('\\', '\\\\').replace('"', '\\"').replace(
+            '\n', '\\n')
+        items.append('%s="%s"' % (key, value))
+    return '{%s}' % ','.join(items)
+
+
+def to_prometheus(prefix='tools_'):
+    """Get metrics in prometheus text format.
+
+    A counter is name_total, a timer is a summary of name_seconds.
+    """
+    metrics = snapshot()
+    lines = []
+    typed = set()
+    for item in metrics['counters']:
+        name = '%s%s_total' % (prefix, item['name'])
+        if name not in typed:
+            typed.add(name)
+            lines.append('# TYPE %s counter' % name)
+        lines.append('%s%s %s' % (name, _labels(item['labels']),
+                                  item['value']))
+    for item in metrics['timers']:
+        name = '%s%s_seconds' % (prefix, item['name'])
+        if name not in typed:
+            typed.add(name)
+            lines.append('# TYPE %s summary' % name)
+        labels = _labels(item['labels'])
+        lines.append('%s_sum%s %r' % (name, labels, item['seconds']))
+        lines.append('%s_count%s %s' % (name, labels, item['count']))
+    return '\n'.join(lines) + '\n'
+
+
+def to_json():
+    """Get metrics in json."""
+    return json.dumps(snapshot(), indent=2)
+
+
+def write(outfile):
+    """Write metrics to file, .prom and .txt file is prometheus format."""
+    text = to_prometheus() if outfile.endswith(('.prom', '.txt')) else \
+        to_json()
+    with open(outfile, 'wt') as wt:
+        wt.write(text)
+
+
+@contextlib.contextmanager
+def capture(metrics=None, profile=None, trace=0):
+    """Capture metrics, cProfile and tracemalloc of the block.
+
+    Metrics are written to file metrics, cProfile stats are dumped to file
+    profile and the top functions are logged, the top trace allocations
+    and the peak memory are logged if trace > 0.
+    """
+    profiler = None
+    if metrics:
+        enable()
+    if profile:
+        import cProfile
+        profiler = cProfile.Profile()
+    if trace:
+        import tracemalloc
+        tracemalloc.start()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile)
+            _log_profile(profiler)
+        if trace:
+            _log_trace(trace)
+        if metrics:
+            write(metrics)
+
+
+def _log_profile(profiler, top=20):
+    """Log the top functions by cumulative time."""
+    import io
+    import pstats
+    stream = io.StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats(
+        'cumulative').print_stats(top)
+    _logger.info('Profile:\n%s', stream.getvalue())
+
+
+def _log_trace(top):
+    """Log the top allocations and the peak memory, then stop tracing."""
+    import tracemalloc
+    snap = tracemalloc.take_snapshot()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    lines = [str(x) for x in snap.statistics('lineno')[:top]]
+    _logger.info('Memory: current %.1f MB, peak %.1f MB, top allocations:'
+                 '\n%s', current / 1e6, peak / 1e6, '\n'.join(lines))
+
+
+def add_arguments(parser):
+    """Add options of capture to argparse parser."""
+    parser.add_argument('--metrics',
+                        help='write counters and timers to this json file'
+                             ' (.prom or .txt for prometheus text)')
+    parser.add_argument('--profile',
+                        help='dump cProfile stats of main process to this'
+                             ' file and log the top functions')
+    parser.add_argument('--tracemalloc', type=int, default=0,
+                        help='log this number of top allocations and peak'
+                             ' memory, default is %(default)s')
+
+
+def capture_args(args):
+    """Get capture of options added by add_arguments."""
+    return capture(args.metrics, args.profile, args.tracemalloc)
@@ -1,49 +1,175 @@
 """Read bz2 and gz file."""
-import bz2
-from functools import wraps
-import gzip
+import io
+import itertools
 import logging
+from collections import deque
 import os
+import queue
 import sys
+import threading
+
+import backends
+import gzip_members
+import instrument
+from timeout import register_process
 
 _logger = logging.getLogger(__name__)
+# ascii bytes which str.strip removes, they are rare except space
+_WHITESPACE = b' \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f'
+_RARE_SPACES = tuple(bytes([x]) for x in _WHITESPACE if x not in b' \n')
+
+
+def record_cut(data):
+    """Return end position of the last complete fastq record in data."""
+    extra = data.count(b'\n') % 4
+    # bytes after the last newline belong to an unfinished line
+    cut = data.rfind(b'\n') + 1
+    for _ in range(extra):
+        cut = data.rfind(b'\n', 0, cut - 1) + 1
+    return cut
+
+
+def fastq_blocks(chunks, start=0):
+    """Group byte chunks to blocks which only hold complete records.
+
+    The last block may hold an unfinished record if the input is not an
+    integral multiple of 4 lines.
+    """
+    rest = b''
+    number = start
+    for chunk in chunks:
+        data = rest + chunk if rest else chunk
+        cut = record_cut(data)
+        if cut:
+            block = FastqBlock(number, data[:cut])
+            number += block.data.count(b'\n') // 4
+            rest = data[cut:]
+            yield block
+        else:
+            rest = data
+    if rest:
+        yield FastqBlock(number, rest)
+
+
+class FastqBlock(object):
+    """Hold raw bytes of continuous fastq records."""
+
+    def __init__(self, start, data):
+        """Init class."""
+        # start: number of the first record, start from 0
+        self.start = start
+        self.data = data
+        self._lines = None
+
+    def __len__(self):
+        """Return record number."""
+        return (len(self.lines) + 3) // 4
+
+    def __iter__(self):
+        """Return records, each is a list of 4 byte lines."""
+        lines = self.lines
+        for i in range(0, len(lines), 4):
+            yield lines[i:i + 4]
+
+    @property
+    def lines(self):
+        """Get byte lines without line ending.
+
+        Lines are stripped of ascii whitespace like text_records, the
+        stripping is skipped if no line starts or ends with whitespace.
+        """
+        if self._lines is None:
+            lines = self.data.split(b'\n')
+            if not lines[-1]:
+                lines.pop()
+            if self._padded(lines):
+                lines = [x.strip(_WHITESPACE) for x in lines]
+            self._lines = lines
+        return self._lines
+
+    def _padded(self, lines):
+        """Check whether a line may start or end with whitespace."""
+        # single byte search is fast, a 2 bytes search of the whole data
+        # is slow, so only the 1st and 3rd lines are searched for b' \n'
+        if any(x in self.data for x in _RARE_SPACES):
+            return True
+        # whitespace and the empty line sort before b'!'
+        if lines and min(lines) < b'!':
+            return True
+        if b' ' in b''.join(lines[1::2]):
+            return True
+        names = b'\n'.join(lines[0::2])
+        return b' \n' in names or names.endswith(b' ')
+
+    @property
+    def seqs(self):
+        """Get the 2nd line of records."""
+        return self.lines[1::4]
+
+    @property
+    def quals(self):
+        """Get the 4th line of records."""
+        return self.lines[3::4]
+
+    def text_records(self):
+        """Return records as lists of stripped str lines."""
+        text = self.data.decode('utf-8')
+        lines = text.split('\n')
+        if not lines[-1]:
+            lines.pop()
+        lines = [x.strip() for x in lines]
+        for i in range(0, len(lines), 4):
+            yield lines[i:i + 4]
 
 
 class ReadGgBz2Normal(object):
     """Read file if it is gz or bz2 file."""
 
-    def __init__(self, filename, dozcat=True):
-        """Init class."""
+    def __init__(self, filename, dozcat=True, threads=1, backend=None,
+                 binary=False, members=False):
+        """Init class.
+
+        If threads > 1, multi-member gz file (e.g. BGZF) is decompressed by
+        threads, single-member gz file is read as usual. backend is a name
+        of backends.BACKENDS, the fastest one is used if it is None, and
+        only python backends are used if dozcat is False. The name of used
+        backend is self.backend. If binary is True, lines and records are
+        bytes which are not decoded, read_fastq gives records of
+        FastqBlock without line endings. If members is True, files except
+        single-member gz file are read by fastq_index.MemberFile, so
+        positions of blocks are kept by member for seek_offset.
+        """
         self.filename = filename
+        self.binary = binary
+        # (record number, uncompressed offset) of the start of reading
+        self.start = (0, 0)
+        # (record number, member offset, offset in member) of the block
+        # being read by read_record_lists
+        self.block_start = (0, 0, 0)
+        # fastq_index.MemberFile which is read if it is read by member
+        self.members = None
+        # whether reading is stopped before the end by stop
+        self.stopped = False
         self.error = 'Failed to read %s' % os.path.basename(filename)
         if not os.path.isfile(self.filename):
             raise IOError("Can not find file %s" % self.filename)
-        if self.filename.endswith('.gz'):
-            if dozcat and self._check_cmd('zcat'):
-                self.zcat = self.zcat2line()
-                self.handle = self.zcat.stdout
-            else:
-                self.handle = gzip.open(self.filename, 'rt')
-        elif self.filename.endswith('.bz2'):
-            self.handle = bz2.open(self.filename, 'rt')
-        else:
-            self.handle = open(self.filename, 'rt')
-
-    def _check_cmd(self, cmdname):
-        """Check cmd whether in system environ."""
-        check = False
-        for cmdpath in os.environ['PATH'].split(':'):
-            if os.path.isdir(cmdpath) and cmdname in os.listdir(cmdpath):
-                check = True
-                break
-        return check
-
-    def zcat2line(self):
-        """Read gzip file by zcat."""
-        import subprocess
-        zcat = subprocess.Popen(['zcat', self.filename],
-                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        return zcat
+        if members and not (self.filename.endswith('.gz') and
+                            not gzip_members.is_multi_member(self.filename)):
+            self.seek_offset(0, 0, 0)
+            return
+        if threads > 1 and backend is None and \
+                self.filename.endswith('.gz') and \
+                gzip_members.is_multi_member(self.filename):
+            self.backend = 'parallel'
+            self.handle = gzip_members.open_parallel(
+                self.filename, 'rb' if binary else 'rt', threads)
+            return
+        chosen = backends.select(self.filename, backend, dozcat)
+        self.backend = chosen.name
+        self.handle, process = chosen.open(self.filename, not binary)
+        if process is not None:
+            # decompressing subprocess (zcat, pigz...), it gives bytes
+            self.zcat = register_process(process)
 
     def __enter__(self):
         """Return self."""
@@ -51,17 +177,37 @@ class ReadGgBz2Normal(object):
 
     def __exit__(self, atype, value, trace):
         """Exit file hanlde."""
-        if not hasattr(self, 'zcat'):
+        self.close()
+
+    def stop(self):
+        """Kill decompressing subprocess, so reading it ends at once."""
+        if hasattr(self, 'zcat') and self.zcat.poll() is None:
+            self.stopped = True
+            self.zcat.kill()
+
+    def close(self):
+        """Close file, decompressing subprocess is killed and reaped."""
+        if hasattr(self, 'zcat'):
+            self.stop()
+            self.zcat.wait()
+            self.zcat.stdout.close()
+            self.zcat.stderr.close()
+        else:
             self.handle.close()
 
     def __iter__(self):
         """Return file itertion."""
         line = None
+        # stdout of subprocess is binary
+        decode = hasattr(self, 'zcat') and not self.binary
         try:
             for line in self.handle:
-                if hasattr(self, 'zcat'):
+                if decode:
                     line = line.decode('utf-8')
                 yield line
+        except TimeoutError:
+            # deadline of timeout module
+            raise
         except (OSError, IOError) as e:  # IOError is needed for 2.7
             # ignore decompression OK, trailing garbage ignored
             self.check_error(line, e)
@@ -75,34 +221,136 @@ class ReadGgBz2Normal(object):
         """Check read error."""
         if self.filename.endswith('.gz') and line is not None and line and \
                 str(e).startswith('Not a gzipped file'):
-            sys.stdout.write('decompression OK, trailing garbage ignored\n')
+            self.report_garbage()
         else:
             _logger.exception(e)
             raise ValueError(self.error)
 
     def check_zcat_error(self):
-        """Check zcat error."""
+        """Check error of decompressing subprocess.
+
+        It is not checked if it is killed by stop, the data is not read to
+        the end then.
+        """
         self.zcat.wait()
+        if self.stopped:
+            return
         if self.zcat.returncode != 0:
             lines = self.zcat.stderr.readlines()
-            if len(lines) > 1 and not lines[-1].endswith(
-                    b'decompression OK, trailing garbage ignored\n'):
+            if not backends.BACKENDS[self.backend].only_garbage(
+                    lines, self.filename):
                 raise ValueError(self.error)
+            self.report_garbage()
+
+    @staticmethod
+    def report_garbage():
+        """Tell trailing garbage is ignored, it is the same for backends."""
+        sys.stdout.write('decompression OK, trailing garbage ignored\n')
+
+    def seek_record(self, number, indexfile=None):
+        """Move to record number (start from 0) by index of fastq_index."""
+        import fastq_index
+        handle, _, offset = fastq_index.locate(self.filename, number,
+                                               indexfile)
+        self._set_handle(handle, handle.raw)
+        self.backend = 'members'
+        self.start = (number, offset)
+
+    def seek_offset(self, number, member, offset):
+        """Move to record number at offset of member.
+
+        They are from block_start, the data of member before offset is
+        inflated but not parsed.
+        """
+        import fastq_index
+        raw = fastq_index.MemberFile(self.filename, member, offset)
+        self._set_handle(io.BufferedReader(raw), raw)
+        self.backend = 'members'
+        self.start = (number, offset)
+
+    def position(self, offset):
+        """Get (member offset, offset in member) of uncompressed offset.
+
+        offset is counted from the start of reading, it is in the only
+        member if the file is not read by member.
+        """
+        if self.members is not None:
+            return self.members.position(offset)
+        return 0, offset
+
+    def _set_handle(self, handle, members=None):
+        """Replace handle by binary handle, members is its MemberFile."""
+        if hasattr(self, 'handle'):
+            self.close()
+        if hasattr(self, 'zcat'):
+            del self.zcat
+        self.members = members
+        self.handle = handle if self.binary else io.TextIOWrapper(handle)
+
+    def read_fastq_range(self, start, stop=None, indexfile=None):
+        """Read records from start to stop by index of fastq_index."""
+        self.seek_record(start, indexfile)
+        return itertools.islice(
+            self.read_fastq(), None if stop is None else stop - start)
+
+    def read_chunks(self, size=1 << 22):
+        """Read binary chunks of the file."""
+        handle = getattr(self.handle, 'buffer', self.handle)
+        # read1 returns what one decompressing step gives, so data before
+        # trailing garbage is not lost when the error is raised
+        read = handle.read if hasattr(self, 'zcat') else getattr(
+            handle, 'read1', handle.read)
+        return instrument.timed(iter(lambda: read(size), b''),
+                                'read_decompress', len, backend=self.backend)
+
+    def read_fastq_block(self, size=1 << 22):
+        """Read blocks of complete records from file."""
+        tag = None
+        try:
+            for block in fastq_blocks(self.read_chunks(size)):
+                tag = 1
+                yield block
+        except TimeoutError:
+            # deadline of timeout module
+            raise
+        except (OSError, IOError) as e:  # IOError is needed for 2.7
+            # ignore decompression OK, trailing garbage ignored
+            self.check_error(tag, e)
+        except Exception as e:
+            _logger.exception(e)
+            raise ValueError(self.error)
+        if hasattr(self, 'zcat'):
+            self.check_zcat_error()
 
     def read_fastq(self):
-        """Read file by size."""
-        tag, lines = None, []
+        """Read records of 4 stripped lines, they are bytes if binary."""
+        for records in self.read_record_lists():
+            for lines in records:
+                yield lines
+
+    def read_record_lists(self, size=1 << 22):
+        """Read records of read_fastq as a list per block.
+
+        self.block_start is the position of the block being yielded.
+        """
+        tag = None
+        number, offset = self.start
         try:
-            for line in self.handle:
-                if hasattr(self, 'zcat'):
-                    line = line.decode('utf-8')
-                lines.append(line.rstrip(os.linesep).strip())
-                if len(lines) >= 4:
+            for block in fastq_blocks(self.read_chunks(size)):
+                with instrument.timer('read_parse', backend=self.backend):
+                    records = list(block) if self.binary else list(
+                        block.text_records())
+                instrument.count('read_records', len(records),
+                                 backend=self.backend)
+                if records and len(records[0]) == 4:
                     tag = 1
-                    yield lines
-                    lines = []
-            if lines:
-                yield lines
+                self.block_start = (number,) + self.position(offset)
+                yield records
+                number += len(records)
+                offset += len(block.data)
+        except TimeoutError:
+            # deadline of timeout module
+            raise
         except (OSError, IOError) as e:  # IOError is needed for 2.7
             # ignore decompression OK, trailing garbage ignored
             self.check_error(tag, e)
@@ -113,66 +361,127 @@ class ReadGgBz2Normal(object):
             self.check_zcat_error()
 
 
-def runtime(func):
-    """Get running time."""
-    @wraps(func)
-    def wrapper(*args, **kwargs):
-        import time
-        start = time.time()
-        res = func(*args, **kwargs)
-        end = time.time()
-        sys.stdout.write('%s running time:%s\n' % (
-            func.__name__, end-start))
-        return res
-    return wrapper
-
-
-@runtime
-def by_gzip(fastq):
-    import gzip
-    with gzip.open(fastq, 'rt') as rd:
-        for line in rd:
-            pass
-
-
-@runtime
-def by_rg(fastq, dozcat=False):
-    with ReadGgBz2Normal(fastq, dozcat) as rd:
-        for line in rd:
-            pass
-
-
-@runtime
-def by_fastq(fastq1, dozcat=False):
-    with ReadGgBz2Normal(fastq1, dozcat) as r1:
-        for lines in r1.read_fastq():
-            pass
-        sys.stdout.write('lines last:%s\n' % len(lines))
-
-@runtime
-def by_pairfastq(fastq1, fastq2, dozcat=False):
-    from itertools import izip_longest
-    try:
-        with ReadGgBz2Normal(fastq1, dozcat) as r1,\
-                ReadGgBz2Normal(fastq2, dozcat) as r2:
-            for lines in izip_longest(r1.read_fastq(),
-                                      r2.read_fastq()):
-                pass
-    except Exception as e:
-        print(e)
-        raise
-
-
-if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        sys.stdout.write('Usage:python {0} fastq1 [fastq2]\n'.format(
-            sys.argv[0]))
-        sys.exit(1)
-    # by_gzip(sys.argv[1])
-    # by_rg(sys.argv[1])
-    # by_fastq(sys.argv[1])
-    # by_rg(sys.argv[1], True)
-    if len(sys.argv) == 3:
-        by_pairfastq(sys.argv[1], sys.argv[2], False)
-    else:
-        by_fastq(sys.argv[1],  False)
+class PairedReader(object):
+    """Read records of fastq files in lock-step like zip_longest.
+
+    Every file is read by a thread into a queue of at most prefetch
+    blocks, so memory is bounded. When it is closed before the end (e.g.
+    an error is found), decompressing subprocesses are killed and reaped
+    and the threads are joined at once.
+    """
+
+    def __init__(self, filenames, prefetch=2, starts=None, track=False,
+                 opener=ReadGgBz2Normal, **kwargs):
+        """Init class, files are opened by opener(filename, **kwargs).
+
+        starts are (record number, member offset, offset in member,
+        records to skip) of files to start from. If track is True,
+        positions of the blocks being read are kept for position.
+        """
+        self.readers = []
+        try:
+            for filename in filenames:
+                self.readers.append(opener(filename, **kwargs))
+            for reader, start in zip(self.readers, starts or []):
+                reader.seek_offset(*start[:3])
+        except Exception:
+            for reader in self.readers:
+                reader.close()
+            raise
+        self.skips = [x[3] for x in starts] if starts else [
+            0 for _ in self.readers]
+        self.block_starts = [deque() for _ in self.readers] if track \
+            else None
+        self.queues = [queue.Queue(prefetch) for _ in self.readers]
+        self.stopped = threading.Event()
+        self.threads = []
+
+    def __enter__(self):
+        """Return self."""
+        return self
+
+    def __exit__(self, atype, value, trace):
+        """Stop reading."""
+        self.close()
+
+    def __iter__(self):
+        """Return tuples of records, it is None for the ended files."""
+        if self.threads:
+            raise ValueError('Files are being read!')
+        for reader, blocks in zip(self.readers, self.queues):
+            thread = threading.Thread(target=self._read,
+                                      args=(reader, blocks))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+        return itertools.zip_longest(
+            *[self._records(x) for x in range(len(self.readers))])
+
+    def position(self, index, number):
+        """Get (record number, member offset, offset in member) of a block.
+
+        It is the last block read which starts at or before record number,
+        the older blocks are forgotten.
+        """
+        starts = self.block_starts[index]
+        while len(starts) > 1 and starts[1][0] <= number:
+            starts.popleft()
+        return starts[0]
+
+    def _put(self, blocks, item):
+        """Put item to queue, return False if it is stopped."""
+        if self.stopped.is_set():
+            return False
+        with instrument.timer('queue_wait', queue='paired_put'):
+            blocks.put(item)
+        return not self.stopped.is_set()
+
+    def _read(self, reader, blocks):
+        """Read lists of records to queue, it runs in thread."""
+        try:
+            for records in reader.read_record_lists():
+                if not self._put(blocks, (reader.block_start, records)):
+                    return
+        except BaseException as e:
+            # raised in the reading thread
+            self._put(blocks, e)
+            return
+        self._put(blocks, None)
+
+    def _records(self, index):
+        """Yield records of file from queue."""
+        blocks = self.queues[index]
+        skip = self.skips[index]
+        while True:
+            with instrument.timer('queue_wait', queue='paired_get'):
+                item = blocks.get()
+            if item is None:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            start, records = item
+            if self.block_starts is not None:
+                self.block_starts[index].append(start)
+            if skip:
+                drop = min(skip, len(records))
+                skip -= drop
+                records = records[drop:]
+            for lines in records:
+                yield lines
+
+    def close(self):
+        """Stop threads and close files."""
+        self.stopped.set()
+        for reader in self.readers:
+            reader.stop()
+        for thread, blocks in zip(self.threads, self.queues):
+            while thread.is_alive():
+                # wake thread which waits for a free slot
+                try:
+                    while True:
+                        blocks.get_nowait()
+                except queue.Empty:
+                    pass
+                thread.join(0.01)
+        for reader in self.readers:
+            reader.close()
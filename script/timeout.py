@@ -1,28 +1,313 @@
+"""Deadline of operations.
+
+deadline(seconds, name) is a scope which can be nested and used in the main
+thread, worker threads and asyncio tasks. The inner scope never ends later
+than the outer one. When a scope expires, the subprocesses registered to it
+or its inner scopes are killed, then the code in the scope is interrupted:
+
+- main thread: by SIGALRM, so blocking calls like time.sleep are stopped.
+- asyncio task: the task is cancelled.
+- worker thread: the exception is raised at the next python bytecode,
+  a blocking read of a killed subprocess returns at once.
+
+DeadlineExceeded (a TimeoutError) is raised from the scope with the name of
+the operation and how long it has run, it is never swallowed. Scopes are
+kept by contextvars, so a thread started in a scope has no scope.
+"""
+import asyncio
+from contextvars import ContextVar
+import ctypes
+import heapq
+import itertools
 import signal
-from contextlib import contextmanager
-
-@contextmanager
-def timeout(time):
-    # Register a function to raise a TimeoutError on the signal.
-    signal.signal(signal.SIGALRM, raise_timeout)
-    # Schedule the signal to be sent after ``time``.
-    signal.alarm(time)
+import threading
+import time
+
+_current = ContextVar('deadline', default=None)
+_lock = threading.Condition()
+
+
+class DeadlineExceeded(TimeoutError):
+    """Operation runs out of its deadline."""
+
+    def __init__(self, name='', seconds=0.0, elapsed=0.0, scope=None):
+        """Init class."""
+        self.name = name
+        self.seconds = seconds
+        self.elapsed = elapsed
+        self.scope = scope
+        super(DeadlineExceeded, self).__init__(
+            'Operation %s timed out after %.3fs (limit %.3fs)' % (
+                name or '<unnamed>', elapsed, seconds))
+
+
+class Deadline(object):
+    """Nestable deadline scope."""
+
+    def __init__(self, seconds, name='', interrupt=True):
+        """Init class.
+
+        If interrupt is False, only registered subprocesses are killed and
+        DeadlineExceeded is raised when the scope exits or check is called.
+        """
+        self.seconds = seconds
+        self.name = name
+        self.interrupt = interrupt
+        self.parent = None
+        self.start = None
+        self.expires = None
+        self.processes = []
+        self.active = False
+        self.expired = False
+        self._interrupted = False
+        self._target = None
+
+    @property
+    def elapsed(self):
+        """Get seconds since the scope starts."""
+        return time.monotonic() - self.start
+
+    @property
+    def remaining(self):
+        """Get seconds left, it is never negative."""
+        return max(0.0, self.expires - time.monotonic())
+
+    def chain(self):
+        """Yield this scope and outer scopes."""
+        scope = self
+        while scope is not None:
+            yield scope
+            scope = scope.parent
+
+    def exception(self):
+        """Get DeadlineExceeded of the scope."""
+        return DeadlineExceeded(self.name, self.seconds, self.elapsed, self)
+
+    def check(self):
+        """Raise DeadlineExceeded if this or an outer scope expires."""
+        now = time.monotonic()
+        for scope in self.chain():
+            if scope.expired or now >= scope.start + scope.seconds:
+                raise scope.exception()
+
+    def register(self, process):
+        """Kill process (e.g. subprocess.Popen) when the scope expires."""
+        with _lock:
+            for scope in self.chain():
+                scope.processes.append(process)
+            expired = any(x.expired for x in self.chain())
+        if expired:
+            _kill(process)
+        return process
+
+    def __enter__(self):
+        """Start scope."""
+        self.parent = _current.get()
+        self.start = time.monotonic()
+        self.expires = self.start + self.seconds
+        if self.parent is not None:
+            self.expires = min(self.expires, self.parent.expires)
+        self._target = _get_target()
+        self._token = _current.set(self)
+        self.active = True
+        _watcher.add(self)
+        return self
+
+    def __exit__(self, atype, value, trace):
+        """End scope, raise DeadlineExceeded if it expires."""
+        with _lock:
+            self.active = False
+            interrupted = self._interrupted
+            _watcher.active -= 1
+        _current.reset(self._token)
+        if self._target[0] == 'main':
+            _main_exit(self)
+        if interrupted and self._target[0] == 'thread':
+            # drop the exception which is not raised yet
+            _set_async_exc(self._target[1], None)
+        if not self.expired:
+            return False
+        if isinstance(value, DeadlineExceeded):
+            if interrupted and value.scope is None:
+                raise self.exception() from None
+            return False
+        if isinstance(value, asyncio.CancelledError) and interrupted:
+            task = self._target[2]
+            if hasattr(task, 'uncancel') and task.uncancel() > 0:
+                # also cancelled by others
+                return False
+            raise self.exception() from None
+        raise self.exception() from value
+
+    def _fire(self):
+        """Expire scope, it is called by the watcher with _lock held."""
+        self.expired = True
+        for process in self.processes:
+            _kill(process)
+        if not self.interrupt:
+            return
+        for scope in self.chain():
+            if scope._interrupted and scope.active and \
+                    scope._target == self._target:
+                return
+        self._interrupted = True
+        kind = self._target[0]
+        if kind == 'task':
+            try:
+                self._target[1].call_soon_threadsafe(_cancel_task, self)
+            except RuntimeError:
+                # loop is closed
+                pass
+        elif kind == 'main':
+            _main_pending.append(self)
+            signal.pthread_kill(threading.main_thread().ident, signal.SIGALRM)
+        else:
+            _set_async_exc(self._target[1], DeadlineExceeded)
+
+
+def _kill(process):
+    """Kill process, ignore it if it is finished."""
     try:
-        yield
-    except TimeoutError:
+        process.kill()
+    except (OSError, ValueError):
         pass
-    finally:
-        # Unregister the signal so it won't be triggered
-        # if the timeout is not reached.
-        signal.signal(signal.SIGALRM, signal.SIG_IGN)
 
-def raise_timeout(signum, frame):
-    raise TimeoutError
+
+def _set_async_exc(ident, exc):
+    """Raise exc in thread, or clear it if exc is None."""
+    ctypes.pythonapi.PyThreadState_SetAsyncExc(
+        ctypes.c_ulong(ident), ctypes.py_object(exc) if exc else None)
+
+
+def _cancel_task(scope):
+    """Cancel task of scope in its loop."""
+    if scope.active:
+        scope._target[2].cancel()
+
+
+def _get_target():
+    """Get how to interrupt the current code."""
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    if task is not None:
+        return ('task', asyncio.get_running_loop(), task)
+    if threading.current_thread() is threading.main_thread():
+        _main_enter()
+        return ('main', )
+    return ('thread', threading.get_ident())
+
+
+# scopes of main thread, SIGALRM handler is installed while one is active
+_main_scopes = []
+_main_pending = []
+_main_handler = [None]
+
+
+def _main_enter():
+    """Install SIGALRM handler for the first scope of main thread."""
+    if not _main_scopes:
+        _main_handler[0] = signal.signal(signal.SIGALRM, _raise_deadline)
+    _main_scopes.append(None)
+
+
+def _main_exit(scope):
+    """Restore SIGALRM handler after the last scope of main thread."""
+    with _lock:
+        if scope in _main_pending:
+            _main_pending.remove(scope)
+    _main_scopes.pop()
+    if not _main_scopes:
+        signal.signal(signal.SIGALRM, _main_handler[0] or signal.SIG_DFL)
+
+
+def _raise_deadline(signum, frame):
+    """Raise DeadlineExceeded of the expired scope of main thread."""
+    with _lock:
+        scopes = [x for x in _main_pending if x.active]
+        del _main_pending[:]
+    if scopes:
+        raise scopes[0].exception()
+
+
+class _Watcher(object):
+    """Thread which expires scopes in order of deadline."""
+
+    def __init__(self):
+        """Init class."""
+        self.heap = []
+        self.active = 0
+        self.count = itertools.count()
+        self.thread = None
+
+    def add(self, scope):
+        """Watch scope."""
+        with _lock:
+            heapq.heappush(self.heap, (scope.expires, next(self.count), scope))
+            self.active += 1
+            if len(self.heap) > self.active * 2 + 1000:
+                # drop ended scopes
+                self.heap = [x for x in self.heap if x[2].active]
+                heapq.heapify(self.heap)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run,
+                                               name='deadline-watcher')
+                self.thread.daemon = True
+                self.thread.start()
+            _lock.notify()
+
+    def run(self):
+        """Expire scopes."""
+        with _lock:
+            while True:
+                while self.heap and not self.heap[0][2].active:
+                    heapq.heappop(self.heap)
+                if not self.heap:
+                    _lock.wait()
+                    continue
+                delay = self.heap[0][0] - time.monotonic()
+                if delay > 0:
+                    _lock.wait(delay)
+                    continue
+                heapq.heappop(self.heap)[2]._fire()
+
+
+_watcher = _Watcher()
+
+
+def deadline(seconds, name='', interrupt=True):
+    """Get a deadline scope of seconds for operation name."""
+    return Deadline(seconds, name, interrupt)
+
+
+def timeout(seconds, name=''):
+    """Get a deadline scope, it raises DeadlineExceeded when time is out."""
+    return Deadline(seconds, name)
+
+
+def current_deadline():
+    """Get the current scope or None."""
+    return _current.get()
+
+
+def remaining(default=None):
+    """Get seconds left of the current scope, or default without scope."""
+    scope = _current.get()
+    return default if scope is None else scope.remaining
+
+
+def register_process(process):
+    """Kill process when the current scope expires, return process."""
+    scope = _current.get()
+    if scope is not None:
+        scope.register(process)
+    return process
+
 
 def my_func():
     # Add a timeout block.
-    with timeout(1):
+    with deadline(1.5, 'sleep'):
         print('entering block')
-        import time
         time.sleep(10)
         print('This should never get printed because the line before timed out')
@@ -0,0 +1,6 @@
+"""Make modules of script importable by tests."""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'script'))
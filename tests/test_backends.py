@@ -0,0 +1,48 @@
+"""Tests of backends."""
+import gzip
+
+import pytest
+
+import backends
+from read_gzbzfile import ReadGgBz2Normal
+
+MEMBERS = gzip.compress(b'x' * 100000) + gzip.compress(b'y' * 1000)
+
+
+@pytest.mark.parametrize('data, garbage', [
+    (MEMBERS, False),
+    (MEMBERS + b'junk', True),
+    (MEMBERS + b'\x00' * 5, False),
+    (MEMBERS + b'\x00\x00junk', True),
+    (MEMBERS[:-3], False)])
+def test_unknown_warning_falls_back_to_zlib(tmp_path, data, garbage):
+    path = str(tmp_path / 'test.gz')
+    with open(path, 'wb') as wb:
+        wb.write(data)
+    for size in (7, 1 << 20):
+        assert backends.gzip_garbage(path, size) == garbage
+    assert backends.BACKENDS['igzip'].only_garbage(
+        [b'igzip: unknown\n'], path) == garbage
+
+
+def test_tie_prefers_former_backend(tmp_path, monkeypatch):
+    path = str(tmp_path / 'test.gz')
+    with open(path, 'wb') as wb:
+        wb.write(MEMBERS)
+    monkeypatch.setattr(backends, '_fastest', {})
+    monkeypatch.setattr(backends, 'measure', lambda backend, sample: 1.0)
+    candidates = backends.available('.gz')
+    assert backends.fastest('.gz', path).name == candidates[0].name
+
+
+@pytest.mark.parametrize('backend', ['zlib', 'zcat'])
+def test_garbage_reported_by_every_backend(tmp_path, capsys, backend):
+    if not backends.BACKENDS[backend].available():
+        pytest.skip('%s is not available' % backend)
+    path = str(tmp_path / 'test.fq.gz')
+    with open(path, 'wb') as wb:
+        wb.write(gzip.compress(b'@r\nACGT\n+\nIIII\n') + b'junk')
+    with ReadGgBz2Normal(path, backend=backend, binary=True) as reader:
+        assert list(reader.read_fastq()) == [[b'@r', b'ACGT', b'+', b'IIII']]
+    assert capsys.readouterr().out == \
+        'decompression OK, trailing garbage ignored\n'
@@ -0,0 +1,38 @@
+"""Tests of benchmark."""
+import io
+
+import benchmark
+
+
+def test_cases_count_all_reads(tmp_path):
+    log = io.StringIO()
+    cases = ['check_numpy', 'check_pair', 'objects_pair', 'records_zlib',
+             'blocks_zlib', 'lines_zlib_binary']
+    result = benchmark.run_benchmark(str(tmp_path), 200, ('plain', 'mgz'),
+                                     cases, read_len=30, log=log)
+    assert result['meta']['reads'] == 200
+    done = [(x['case'], x['format']) for x in result['results']]
+    # objects_* only run on plain fastq, zlib only reads gz
+    assert done == [
+        ('check_numpy', 'plain'), ('check_numpy', 'mgz'),
+        ('check_pair', 'plain'), ('check_pair', 'mgz'),
+        ('objects_pair', 'plain'), ('records_zlib', 'mgz'),
+        ('blocks_zlib', 'mgz'), ('lines_zlib_binary', 'mgz')]
+    # read_count of CheckFastq counts reads of both files
+    assert [x['reads'] for x in result['results']] == [
+        200, 200, 400, 400, 200, 200, 200, 200]
+    assert all(x['peak_rss_mb'] > 0 for x in result['results'])
+    assert len(log.getvalue().splitlines()) == len(done)
+
+
+def test_compare():
+    def results(speeds):
+        return {'results': [{'case': x, 'format': 'gz', 'mb_per_s': y}
+                            for x, y in speeds.items()]}
+
+    old = results({'a': 100.0, 'b': 100.0, 'c': 100.0})
+    new = results({'a': 95.0, 'b': 80.0, 'd': 1.0})
+    assert benchmark.compare(old, new) == [{
+        'case': 'b', 'format': 'gz', 'ratio': 0.8, 'old_mb_per_s': 100.0,
+        'new_mb_per_s': 80.0}]
+    assert benchmark.compare(old, new, 0.01)[0]['case'] == 'a'
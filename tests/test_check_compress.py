@@ -0,0 +1,63 @@
+"""Tests of check_compress."""
+import bz2
+import gzip
+import io
+import sys
+import tarfile
+
+import pytest
+
+from check_compress import CheckCompress, verify_file
+
+
+def make_tar_gz(path):
+    """Write a .tar.gz of one file."""
+    data = b'hello\n' * 1000
+    with tarfile.open(path, 'w:gz') as tar:
+        info = tarfile.TarInfo('hello.txt')
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+
+
+def test_tar_gz_ok(tmp_path):
+    path = str(tmp_path / 'ok.tar.gz')
+    make_tar_gz(path)
+    result = verify_file(path)
+    assert result.ok
+    assert result.tar_members == 1
+
+
+def test_tar_gz_truncated_trailer(tmp_path):
+    path = str(tmp_path / 'cut.tar.gz')
+    make_tar_gz(path)
+    with open(path, 'rb') as rd:
+        data = rd.read()
+    # drop CRC32 and ISIZE of the gzip member
+    with open(path, 'wb') as wt:
+        wt.write(data[:-8])
+    result = verify_file(path)
+    assert not result.ok
+    assert 'end-of-stream' in result.message
+
+
+def test_command_checks_verify_in_process(tmp_path):
+    path = str(tmp_path / 'test.gz')
+    data = gzip.compress(b'data\n' * 1000)
+    with open(path, 'wb') as wb:
+        wb.write(data + b'garbage')
+    check = CheckCompress(path)
+    assert check.check_gz()
+    assert not check.error
+    with open(path, 'wb') as wb:
+        wb.write(data[:-8])
+    check = CheckCompress(path)
+    assert not check.check_gz()
+    assert 'end-of-stream' in check.error
+    path = str(tmp_path / 'test.bz2')
+    with open(path, 'wb') as wb:
+        wb.write(bz2.compress(b'data\n' * 1000))
+    assert CheckCompress(path).check_bz2()
+    assert CheckCompress.run_cmd([sys.executable, '-c', 'import sys; '
+                                  'sys.stderr.write("bad\\n")']) == 'bad'
+    with pytest.warns(DeprecationWarning):
+        CheckCompress(path, bz2path='/bin/bzip2')
@@ -0,0 +1,135 @@
+"""Tests of deal_bam."""
+import random
+
+import pytest
+
+pysam = pytest.importorskip('pysam')
+import deal_bam  # noqa: E402
+from deal_bam import Support  # noqa: E402
+
+
+class FakeRead(object):
+    """Read with the fields used by deal_bam."""
+
+    def __init__(self, start, cigar, seq, flag=0, mapq=60):
+        self.reference_start = start
+        self.cigartuples = cigar
+        self.query_sequence = seq
+        self.flag = flag
+        self.mapping_quality = mapq
+        self.is_unmapped = bool(flag & 4)
+        span = sum(n for op, n in cigar or () if op in (0, 2, 3, 7, 8))
+        self.reference_end = None if self.is_unmapped or not cigar \
+            else start + span
+
+
+class FakeBam(object):
+    """AlignmentFile yielding the reads overlapping the region."""
+
+    reads = []
+
+    def __init__(self, bamfile):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def fetch(self, chrom, start, end):
+        return iter(self.reads)
+
+
+def test_unmapped_reads_skipped(monkeypatch):
+    monkeypatch.setattr(FakeBam, 'reads', [
+        FakeRead(10, [(0, 10)], 'ACGTACGTAC'),
+        FakeRead(10, [(0, 10)], 'ACGTACGTAC', flag=4),
+        FakeRead(10, None, 'ACGTACGTAC')])
+    monkeypatch.setattr(deal_bam.pysam, 'AlignmentFile', FakeBam)
+    variants = [('chr1', 12, 'C', 'T'), ('chr1', 13, 'A', 'G')]
+    # keep unmapped reads by the filter
+    assert deal_bam.count_support('test.bam', variants, flag_filter=0) == [
+        Support(1, 0, 0), Support(0, 1, 0)]
+
+
+def test_support_by_groups_and_processes(monkeypatch):
+    monkeypatch.setattr(FakeBam, 'reads', [
+        FakeRead(0, [(0, 8)], 'ACGTACGT'),
+        FakeRead(2, [(0, 8)], 'GTATAAAC', mapq=5),
+        FakeRead(4, [(0, 8)], 'ACGTACGT', flag=0x400)])
+    monkeypatch.setattr(deal_bam.pysam, 'AlignmentFile', FakeBam)
+    variants = [('chr2', 6, 'C', 'A'), ('chr1', 1, 'A', 'T'),
+                ('chr1', 7, 'G', 'A'), ('chr1', 20, 'A', 'T')]
+    expected = [Support(1, 0, 1), Support(1, 0, 0), Support(1, 1, 0),
+                Support(0, 0, 0)]
+    for processes in (1, 2):
+        assert deal_bam.count_support('test.bam', variants, processes,
+                                      group_size=1) == expected
+    # mapq and default flag filter
+    assert deal_bam.count_support('test.bam', variants, min_mapq=10) == [
+        Support(1, 0, 0), Support(1, 0, 0), Support(1, 0, 0),
+        Support(0, 0, 0)]
+
+
+def aligned_pairs(cigar):
+    """Get {relative ref loc: query offset} of M/=/X ops one by one."""
+    pairs, rpos, qpos = {}, 0, 0
+    for op, length in cigar:
+        for _ in range(length):
+            if op in (0, 7, 8):
+                pairs[rpos] = qpos
+            if op in (0, 2, 3, 7, 8):
+                rpos += 1
+            if op in (0, 1, 4, 7, 8):
+                qpos += 1
+    return pairs, rpos
+
+
+def test_query_offsets_of_random_cigars():
+    rng = random.Random(1)
+    for _ in range(200):
+        cigar = [(4, rng.randrange(1, 5))] if rng.random() < 0.5 else []
+        for _ in range(rng.randrange(1, 6)):
+            cigar.append((rng.choice((0, 7, 8)), rng.randrange(1, 20)))
+            cigar.append((rng.choice((1, 2, 3)), rng.randrange(1, 5)))
+        cigar.append((0, rng.randrange(1, 20)))
+        if rng.random() < 0.5:
+            cigar.append((rng.choice((4, 5)), rng.randrange(1, 5)))
+        pairs, span = aligned_pairs(cigar)
+        qlen = sum(n for op, n in cigar if op in (0, 1, 4, 7, 8))
+        mapper = deal_bam.CigarMapper(FakeRead(100, cigar, 'A' * qlen))
+        locs = list(range(-3, span + 3))
+        assert mapper.query_offsets(locs) == [pairs.get(x) for x in locs]
+
+
+def test_judge_indels_and_soft_clips():
+    rng = random.Random(2)
+    seq = ''.join(rng.choice('ACGT') for _ in range(32))
+    # query 0-4 clipped, ref 0-9 is query 5-14, 15-16 inserted, ref 10-19
+    # is query 17-26, ref 20-22 deleted, ref 23-27 is query 27-31
+    read = FakeRead(100, [(4, 5), (0, 10), (1, 2), (0, 10), (2, 3),
+                          (0, 5)], seq.lower())
+    judge = deal_bam.get_mapper(read).judge
+    assert judge(0, seq[5], 'N') == deal_bam.REF
+    assert judge(0, 'N', seq[5]) == deal_bam.ALT
+    assert judge(9, seq[14], seq[14:17]) == deal_bam.ALT
+    assert judge(9, seq[14], seq[14:16]) == deal_bam.OTHER
+    assert judge(9, seq[14] + 'AC', seq[14]) == deal_bam.REF
+    assert judge(5, seq[10], seq[10] + 'A') == deal_bam.REF
+    assert judge(19, seq[26] + 'ACG', seq[26]) == deal_bam.ALT
+    assert judge(19, seq[26] + 'AC', seq[26]) == deal_bam.OTHER
+    assert judge(21, 'A', 'C') == deal_bam.OTHER
+    assert judge(8, seq[13:15], 'NN') == deal_bam.REF
+    # mnp over the insertion is not in one block
+    assert judge(9, seq[14] + 'A', 'NN') == deal_bam.OTHER
+    assert deal_bam.read_pattern_judge(read, 9, seq[14].lower(),
+                                       seq[14:17].lower())
+    # insertion at the end of aligned bases is clipped
+    read = FakeRead(100, [(0, 10), (4, 5)], seq[:15])
+    assert deal_bam.get_mapper(read).judge(
+        9, seq[9], seq[9:12]) == deal_bam.OTHER
+    assert deal_bam.get_mapper(read).judge(
+        10, seq[10], 'N') == deal_bam.OTHER
+    with pytest.raises(ValueError):
+        deal_bam.CigarMapper(FakeRead(100, [(9, 10)], seq[:10]))
@@ -0,0 +1,131 @@
+"""Tests of deal_fasta."""
+import random
+import struct
+import zlib
+
+import pytest
+
+import deal_fasta
+from deal_fasta import Fasta
+
+BGZF_EOF = bytes.fromhex(
+    '1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+
+def bgzf_block(data):
+    """Compress data to one bgzip block."""
+    compress = zlib.compressobj(6, zlib.DEFLATED, -15)
+    deflated = compress.compress(data) + compress.flush()
+    head = b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00'
+    return head + struct.pack('<H', len(head) + 2 + len(deflated) + 8 - 1) \
+        + deflated + struct.pack('<II', zlib.crc32(data), len(data))
+
+
+def make_fasta(tmp_path, name, width=60, newline='\n', block=1000):
+    """Write fasta of random sequences, return {chrom: sequence}."""
+    rng = random.Random(width)
+    seqs = dict(('chr%d' % i, ''.join(rng.choice('ACGTNacgt') for _ in range(
+        length))) for i, length in enumerate((0, 1, width, 5000, 1234)))
+    data = ''.join('>%s desc\n' % chrom + ''.join(
+        seq[i:i + width] + newline for i in range(0, len(seq), width))
+        for chrom, seq in seqs.items()).encode()
+    path = str(tmp_path / name)
+    with open(path, 'wb') as wb:
+        if name.endswith('.gz'):
+            for i in range(0, len(data), block):
+                wb.write(bgzf_block(data[i:i + block]))
+            wb.write(BGZF_EOF)
+        else:
+            wb.write(data)
+    return path, seqs
+
+
+@pytest.mark.parametrize('name', ['test.fa', 'test.fa.gz'])
+@pytest.mark.parametrize('width, newline', [(60, '\n'), (7, '\r\n')])
+def test_fetch(tmp_path, name, width, newline):
+    path, seqs = make_fasta(tmp_path, name, width, newline)
+    rng = random.Random(1)
+    with Fasta(path) as fasta:
+        assert fasta.references == list(seqs)
+        assert fasta.lengths == [len(x) for x in seqs.values()]
+        regions = []
+        for chrom, seq in seqs.items():
+            assert fasta.fetch(chrom) == seq
+            for _ in range(20):
+                start = rng.randrange(len(seq) + 1)
+                end = rng.randrange(start, len(seq) + 10)
+                assert fasta.fetch(chrom, start, end) == seq[start:end]
+                regions.append((chrom, start, end))
+        regions.reverse()
+        assert fasta.fetch_many(regions) == [
+            seqs[x][y:z] for x, y, z in regions]
+        with pytest.raises(ValueError):
+            fasta.fetch('chr3', -1, 10)
+
+
+def test_fai_like_samtools(tmp_path):
+    path, _ = make_fasta(tmp_path, 'test.fa', 60)
+    deal_fasta.build_fai(path)
+    with open(path + '.fai') as rd:
+        lines = rd.read().splitlines()
+    assert lines[:3] == ['chr0\t0\t11\t0\t0', 'chr1\t1\t22\t1\t2',
+                         'chr2\t60\t35\t60\t61']
+
+
+def test_gzi_offsets(tmp_path):
+    path, _ = make_fasta(tmp_path, 'test.fa.gz', block=1000)
+    deal_fasta.build_gzi(path)
+    coffsets, uoffsets = deal_fasta.load_gzi(path + '.gzi')
+    blocks = list(deal_fasta.iter_bgzf_blocks(path))
+    # the empty eof block is indexed like bgzip
+    assert coffsets == [x[0] for x in blocks]
+    assert uoffsets[:3] == [0, 1000, 2000]
+
+
+def test_not_bgzf_or_fasta(tmp_path):
+    path = str(tmp_path / 'test.fa')
+    with open(path, 'w') as wt:
+        wt.write('ACGT\n>chr1\nACGT\n')
+    with pytest.raises(ValueError):
+        Fasta(path)
+    with open(path, 'w') as wt:
+        wt.write('>chr1\nACG\nACGT\n')
+    with pytest.raises(ValueError):
+        deal_fasta.build_fai(path)
+
+
+def test_reverse_complement_round_trip():
+    rng = random.Random(2)
+    seqs = [''.join(rng.choice(deal_fasta.IUPAC + deal_fasta.IUPAC.lower() +
+                               '-.*') for _ in range(rng.randrange(50)))
+            for _ in range(100)]
+    assert deal_fasta.reverse_complement('AcGtNrYx-') == '-xRyNaCgT'
+    for seq in seqs:
+        rc = deal_fasta.reverse_complement(seq)
+        assert deal_fasta.reverse_complement(seq.encode()) == rc.encode()
+        # U is complemented to A, which goes back to T
+        assert deal_fasta.reverse_complement(rc) == seq.replace(
+            'U', 'T').replace('u', 't')
+    many = deal_fasta.reverse_complement_many(seqs)
+    assert many == [deal_fasta.reverse_complement(x) for x in seqs]
+    assert deal_fasta.reverse_complement_many(
+        [x.encode() for x in seqs]) == [x.encode() for x in many]
+    assert deal_fasta.reverse_complement_many([]) == []
+
+
+def test_write_reverse_complement(tmp_path):
+    path, seqs = make_fasta(tmp_path, 'test.fa.gz', 60)
+    with Fasta(path) as fasta:
+        chunks = list(deal_fasta.iter_reverse_complement(
+            fasta, 'chr3', 100, 4000, size=333))
+        assert ''.join(chunks) == deal_fasta.reverse_complement(
+            seqs['chr3'][100:4000])
+        path = str(tmp_path / 'rc.fa')
+        with open(path, 'w') as wt:
+            for chrom in seqs:
+                deal_fasta.write_reverse_complement(fasta, chrom, wt, 50,
+                                                    size=120)
+    with Fasta(path) as fasta:
+        assert fasta.index['chr3'].linebases == 50
+        for chrom, seq in seqs.items():
+            assert fasta.fetch(chrom) == deal_fasta.reverse_complement(seq)
@@ -0,0 +1,176 @@
+"""Tests of deal_fastq."""
+import gzip
+import random
+
+import pytest
+
+import deal_fastq
+from deal_fastq import CheckFastq
+
+
+def write_fastq(path, pads, number=50, mate=1):
+    """Write fastq whose lines are padded by pads[line % 4]."""
+    rng = random.Random(number)
+    with open(path, 'wt') as wt:
+        for i in range(number):
+            seq = ''.join(rng.choice('ACGTN') for _ in range(30))
+            lines = ['@r%d/%d' % (i, mate), seq, '+', 'I' * 30]
+            for k, line in enumerate(lines):
+                before, after = pads[k]
+                wt.write(before + line + after + '\n')
+
+
+PADS = [
+    [('', '')] * 4,
+    [(' ', ''), ('', ''), ('', ''), ('', '')],
+    [('', ' '), ('', ''), ('', ''), ('', '')],
+    [('', ''), ('', ''), ('\t', ' '), ('', '')],
+    [('', ''), ('', ' '), ('', ''), ('', '')],
+    [('', ''), ('', ''), ('', ''), (' ', '')],
+    [('\x0c', ''), ('', ''), ('', '\x1f'), ('', '')],
+    [('', '\r'), ('', '\r'), ('', '\r'), ('', '\r')]]
+
+
+@pytest.mark.parametrize('pads', PADS)
+@pytest.mark.parametrize('numpy', [True, False])
+def test_binary_same_as_text(tmp_path, monkeypatch, pads, numpy):
+    if not numpy:
+        monkeypatch.setattr(deal_fastq, 'batch_fastq', None)
+    fastq1 = str(tmp_path / 'test_1.fq')
+    fastq2 = str(tmp_path / 'test_2.fq')
+    write_fastq(fastq1, pads)
+    write_fastq(fastq2, pads, mate=2)
+    for fastqs in ((fastq1, None), (fastq1, fastq2)):
+        binary = CheckFastq(*fastqs, dofast=1).check_dict
+        text = CheckFastq(*fastqs, dofast=1, binary=False).check_dict
+        assert binary == text
+        assert binary['file1_read_count'] == 50
+        assert not binary['file1_error']
+
+
+def write_truncated(path, cut, mate=1, number=3000):
+    """Write gz fastq which is cut to the fraction of its size."""
+    rng = random.Random(number)
+    data = ''.join('@r%d/%d\n%s\n+\n%s\n' % (
+        i, mate, ''.join(rng.choice('ACGT') for _ in range(40)), 'I' * 40)
+        for i in range(number)).encode('ascii')
+    data = gzip.compress(data)
+    with open(path, 'wb') as wb:
+        wb.write(data[:int(len(data) * cut)])
+
+
+def truncated_pair(tmp_path, cut):
+    """Get paths of truncated fastq files."""
+    fastq1 = str(tmp_path / 'test_1.fq.gz')
+    fastq2 = str(tmp_path / 'test_2.fq.gz')
+    write_truncated(fastq1, cut)
+    write_truncated(fastq2, cut * 1.1, 2)
+    return fastq1, fastq2
+
+
+def serial_dict(monkeypatch, *args, **kwargs):
+    """Get check_dict of _check_serial."""
+    with monkeypatch.context() as patch:
+        patch.setattr(deal_fastq, 'batch_fastq', None)
+        return CheckFastq(*args, **kwargs).check_dict
+
+
+@pytest.mark.parametrize('cut', [0.3, 0.5, 0.77])
+@pytest.mark.parametrize('dofast', [1, 3])
+def test_parallel_truncated_same_as_serial(tmp_path, monkeypatch, cut,
+                                           dofast):
+    fastq1, fastq2 = truncated_pair(tmp_path, cut)
+    for fastqs in ((fastq1, None), (fastq1, fastq2)):
+        serial = serial_dict(monkeypatch, *fastqs, dofast=dofast)
+        assert serial['file1_read_count'] > 0
+        parallel = CheckFastq(*fastqs, dofast=dofast, processes=2,
+                              batch=200).check_dict
+        assert parallel == serial
+
+
+@pytest.mark.parametrize('cut', [0.3, 0.5, 0.77])
+@pytest.mark.parametrize('batch', [10000, 300])
+def test_default_truncated_same_as_serial(tmp_path, monkeypatch, cut,
+                                          batch):
+    fastq1, fastq2 = truncated_pair(tmp_path, cut)
+    for fastqs in ((fastq1, None), (fastq1, fastq2)):
+        serial = serial_dict(monkeypatch, *fastqs, dofast=1)
+        assert CheckFastq(*fastqs, dofast=1, batch=batch).check_dict == \
+            serial
+
+
+def write_named(path, names):
+    """Write fastq of reads with names."""
+    with open(path, 'wt') as wt:
+        for name in names:
+            wt.write('@%s\nACGT\n+\nIIII\n' % name)
+
+
+def test_matcher_per_check(tmp_path):
+    paths = [str(tmp_path / ('test_%d.fq' % x)) for x in range(4)]
+    write_named(paths[0], ['r%d/1' % x for x in range(20)])
+    write_named(paths[1], ['r%d/2' % x for x in range(20)])
+    write_named(paths[2], ['r%d.f' % x for x in range(20)])
+    write_named(paths[3], ['r%d.r' % x for x in range(19)] + ['x.r'])
+    check = CheckFastq(paths[0], paths[1], dofast=1)
+    assert check.matcher.scheme == 'slash'
+    assert not check.check_dict['pair_error']
+    for binary in (True, False):
+        check = CheckFastq(paths[2], paths[3], dofast=1, binary=binary)
+        assert check.matcher.scheme == 'sra'
+        assert check.check_dict['pair_error'] == deal_fastq.errors[
+            'RN'].format('@r19.f', '@x.r', 76)
+
+
+def test_bytes_names_match_like_text():
+    names = ['@r1/1', '@r1/2', '@r1.f', '@r1.r', '@r1', '@r2/1',
+             '@A1:1:FC1:1:1:1:1 1:N:0:ACGT', '@A1:1:FC1:1:1:1:1 2:N:0:ACGT']
+    for name1 in names:
+        for name2 in names:
+            text = deal_fastq.NameMatcher().match(name1, name2)
+            binary = deal_fastq.NameMatcher().match(name1.encode(),
+                                                    name2.encode())
+            assert text == binary
+    read = deal_fastq.SingleRead(0, [b'@r1/1 x', b'A', b'+', b'I'])
+    assert read.readname == b'@r1/1'
+
+
+@pytest.mark.parametrize('binary', [True, False])
+def test_slots_and_lazy_values(binary):
+    def lines(*items):
+        return [x.encode() if binary else x for x in items]
+
+    read = deal_fastq.SingleRead(2, lines('@r/1 x', 'ACGTN', '+', 'II#IK'))
+    assert not hasattr(read, '__dict__')
+    with pytest.raises(AttributeError):
+        read.other = 1
+    assert read._error is None and read._phreds is None
+    assert read.error == ''
+    assert read._error == '' and read.phreds == (35, 75)
+    assert (read.base_count, read.phreq_set) == (5, '33')
+    assert read.readname == lines('@r/1')[0]
+    # values are kept, so changed lines are not seen
+    read.lines4[1] = lines('AXGT')[0]
+    assert read.error == ''
+    bad = deal_fastq.SingleRead(2, lines('@r/1', 'ACGT', '-', 'IIII'))
+    assert bad.error.startswith(deal_fastq.errors['NF'][:5])
+    short = deal_fastq.SingleRead(0, lines('@r', 'ACGT'))
+    assert (short.check_len, short.base_count) == (True, 0)
+    assert short.error == deal_fastq.errors['N4']
+    pair = deal_fastq.PairRead(2, lines('@r/1', 'AC', '+', 'II'),
+                               lines('@q/2', 'AC', '+', 'II'))
+    assert not hasattr(pair, '__dict__')
+    assert pair.pair_error == deal_fastq.errors['RN'].format('@r/1', '@q/2',
+                                                             8)
+    assert pair._pair_error == pair.pair_error
+    assert deal_fastq.PairRead(0, None, lines('@q/2', 'A', '+', 'I')
+                               ).pair_error == deal_fastq.errors['NE'].format(0)
+
+
+def test_lazy_value_of_dict_class(tmp_path):
+    path = str(tmp_path / 'test.fq')
+    write_fastq(path, PADS[0])
+    check = CheckFastq(path, dofast=1)
+    assert 'check_dict' not in check.__dict__
+    assert check.check_dict is check.check_dict
+    assert 'check_dict' in check.__dict__
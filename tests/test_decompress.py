@@ -0,0 +1,76 @@
+"""Tests of decompress."""
+import gzip
+import io
+import os
+import tarfile
+
+import pytest
+
+from decompress import Decompress
+
+
+def write_tar(path, files, mode):
+    """Write files {name: data} to tar file, mtime is the data length."""
+    with tarfile.open(path, mode) as tar:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+
+FILES = dict(('dir%d/file%d.txt' % (i % 3, i), os.urandom(i * 997))
+             for i in range(40))
+
+
+@pytest.mark.parametrize('ext, mode', [('.tar.gz', 'w:gz'),
+                                       ('.tgz', 'w:gz'),
+                                       ('.tar.bz2', 'w:bz2'),
+                                       ('.tar.xz', 'w:xz')])
+@pytest.mark.parametrize('threads', [1, 3])
+def test_tar_stream(tmp_path, ext, mode, threads):
+    infile = str(tmp_path / ('test' + ext))
+    write_tar(infile, FILES, mode)
+    outdir = str(tmp_path / 'out')
+    Decompress(infile, outdir, threads).decompress()
+    for name, data in FILES.items():
+        path = os.path.join(outdir, name)
+        with open(path, 'rb') as rb:
+            assert rb.read() == data
+        assert os.path.getmtime(path) == len(data)
+
+
+def test_tar_stream_small_chunks(tmp_path):
+    infile = str(tmp_path / 'test.tar')
+    write_tar(infile, FILES, 'w')
+    outdir = str(tmp_path / 'out')
+    decompress = Decompress(infile, outdir, threads=2)
+    with open(infile, 'rb') as rb:
+        decompress.un_tar_stream(rb, outdir, size=100, max_open=2)
+    for name, data in FILES.items():
+        with open(os.path.join(outdir, name), 'rb') as rb:
+            assert rb.read() == data
+
+
+def test_tar_stream_outside_member(tmp_path):
+    infile = str(tmp_path / 'test.tar.gz')
+    write_tar(infile, {'../evil.txt': b'evil'}, 'w:gz')
+    with pytest.raises(tarfile.TarError):
+        Decompress(infile, str(tmp_path / 'out')).decompress()
+    assert not os.path.exists(str(tmp_path / 'evil.txt'))
+
+
+@pytest.mark.parametrize('threads', [1, 2])
+def test_multi_member_gz(tmp_path, threads):
+    infile = str(tmp_path / 'test.txt.gz')
+    data = [os.urandom(100000), b'y' * 1000, os.urandom(10)]
+    with open(infile, 'wb') as wb:
+        for part in data:
+            wb.write(gzip.compress(part))
+    sizes = []
+    decompress = Decompress(infile, str(tmp_path), threads,
+                            callback=lambda size, _: sizes.append(size))
+    decompress.decompress()
+    with open(str(tmp_path / 'test.txt'), 'rb') as rb:
+        assert rb.read() == b''.join(data)
+    assert sizes[-1] == sum(len(x) for x in data)
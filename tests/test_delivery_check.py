@@ -0,0 +1,50 @@
+"""Tests of delivery_check."""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+
+import pytest
+
+import delivery_check
+
+
+class RecordedPool(ThreadPoolExecutor):
+    """Thread pool which records arguments of shutdown."""
+
+    shutdowns = []
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        """Record and shutdown."""
+        self.shutdowns.append((wait, cancel_futures))
+        super(RecordedPool, self).shutdown(wait, cancel_futures=cancel_futures)
+
+
+def write_files(path):
+    """Write gz files to directory path."""
+    for i in range(3):
+        with gzip.open(str(path / ('test%d.txt.gz' % i)), 'wb') as wb:
+            wb.write(b'data %d\n' % i)
+
+
+def test_own_pool_waits(tmp_path, monkeypatch):
+    write_files(tmp_path)
+    monkeypatch.setattr(delivery_check, 'ProcessPoolExecutor', RecordedPool)
+    monkeypatch.setattr(RecordedPool, 'shutdowns', [])
+    report = asyncio.run(delivery_check.check_delivery_async(
+        str(tmp_path), processes=2))
+    assert report['status'] == 'ok'
+    assert RecordedPool.shutdowns == [(True, False)]
+
+
+def test_own_pool_cancelled_on_error(tmp_path, monkeypatch):
+    write_files(tmp_path)
+    monkeypatch.setattr(delivery_check, 'ProcessPoolExecutor', RecordedPool)
+    monkeypatch.setattr(RecordedPool, 'shutdowns', [])
+
+    def callback(files, fastq):
+        raise RuntimeError('stop')
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(delivery_check.check_delivery_async(
+            str(tmp_path), processes=1, callback=callback))
+    assert RecordedPool.shutdowns[0] == (False, True)
@@ -0,0 +1,57 @@
+"""Tests of fastq_index."""
+import gzip
+
+import pytest
+
+import fastq_index
+from read_gzbzfile import ReadGgBz2Normal
+
+
+def write_fastq(path, number=2000):
+    """Write single-member gz or plain fastq, return the records."""
+    records = [[b'@r%d' % i, b'ACGT' * (i % 7 + 1), b'+', b'I' * 4 * (
+        i % 7 + 1)] for i in range(number)]
+    data = b''.join(b'\n'.join(x) + b'\n' for x in records)
+    with open(path, 'wb') as wb:
+        wb.write(gzip.compress(data) if path.endswith('.gz') else data)
+    return records
+
+
+@pytest.mark.parametrize('name', ['test.fq', 'test.fq.gz'])
+def test_open_at(tmp_path, name):
+    path = str(tmp_path / name)
+    records = write_fastq(path)
+    fastq_index.build_index(path, 300)
+    for number in (0, 299, 300, 301, 1234, 1999):
+        line = fastq_index.open_at(path, number).readline()
+        assert line.rstrip(b'\n') == records[number][0]
+
+
+@pytest.mark.parametrize('ext', ['.gz', '.bz2'])
+def test_recompress_checkpoints_at_members(tmp_path, ext):
+    path = str(tmp_path / 'test.fq.gz')
+    records = write_fastq(path)
+    outfile = str(tmp_path / ('out.fq' + ext))
+    fastq_index.recompress(path, outfile, 300)
+    fastq_index.build_index(outfile, 300)
+    checkpoints = fastq_index.load_index(outfile)
+    assert len(checkpoints) == 7
+    assert all(x[1] > 0 and x[2] == 0 for x in checkpoints[1:])
+    for number in (0, 300, 301, 1999):
+        line = fastq_index.open_at(outfile, number).readline()
+        assert line.rstrip(b'\n') == records[number][0]
+
+
+def test_seek_record_position(tmp_path):
+    path = str(tmp_path / 'test.fq.gz')
+    records = write_fastq(path)
+    fastq_index.build_index(path, 300)
+    with ReadGgBz2Normal(path, binary=True) as reader:
+        reader.seek_record(650)
+        blocks = reader.read_record_lists(size=1 << 10)
+        assert next(blocks)[0] == records[650]
+        block = next(blocks)
+        start = reader.block_start
+    with ReadGgBz2Normal(path, binary=True) as reader:
+        reader.seek_offset(*start)
+        assert next(reader.read_fastq()) == block[0]
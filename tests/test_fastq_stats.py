@@ -0,0 +1,91 @@
+"""Tests of fastq_stats."""
+import random
+
+import pytest
+
+import deal_fastq
+import fastq_stats
+from deal_fastq import CheckFastq
+from fastq_stats import FastqStats
+
+
+def random_reads(number=200, seed=1):
+    """Get (seq, qual) of reads with random lengths."""
+    rng = random.Random(seed)
+    reads = []
+    for _ in range(number):
+        length = rng.randrange(1, 40)
+        reads.append((''.join(rng.choice('ACGTN') for _ in range(length)),
+                      ''.join(chr(rng.randrange(35, 75))
+                              for _ in range(length))))
+    return reads
+
+
+def expected_dict(reads, phred=33):
+    """Compute statistics of reads directly."""
+    bases = ''.join(x[0] for x in reads)
+    quals = [ord(y) - phred for x in reads for y in x[1]]
+    maxlen = max(len(x[1]) for x in reads)
+    position = []
+    for i in range(maxlen):
+        values = [ord(x[1][i]) - phred for x in reads if len(x[1]) > i]
+        position.append(round(float(sum(values)) / len(values), 2))
+    lengths = {}
+    for seq, _ in reads:
+        lengths[len(seq)] = lengths.get(len(seq), 0) + 1
+    q20 = sum(x >= 20 for x in quals)
+    q30 = sum(x >= 30 for x in quals)
+    return {
+        'gc_content': round(float(sum(bases.count(x) for x in 'GC')) /
+                            len(bases), 6),
+        'n_rate': round(float(bases.count('N')) / len(bases), 6),
+        'q20_base_count': q20, 'q30_base_count': q30,
+        'q20_rate': round(float(q20) / len(quals), 6),
+        'q30_rate': round(float(q30) / len(quals), 6),
+        'position_mean_quality': position, 'length_histogram': lengths}
+
+
+@pytest.mark.parametrize('numpy', [True, False])
+@pytest.mark.parametrize('binary', [True, False])
+def test_stats_by_batches(monkeypatch, numpy, binary):
+    if not numpy:
+        monkeypatch.setattr(fastq_stats, 'numpy', None)
+    reads = random_reads()
+    if binary:
+        lines = [(x.encode(), y.encode()) for x, y in reads]
+    else:
+        lines = reads
+    stats = FastqStats()
+    stats.update([x[0] for x in lines[:50]], [x[1] for x in lines[:50]])
+    for seq, qual in lines[50:80]:
+        stats.add(seq, qual)
+    other = FastqStats()
+    other.update([x[0] for x in lines[80:]], [x[1] for x in lines[80:]])
+    stats.merge(other)
+    assert stats.to_dict() == expected_dict(reads)
+    restored = FastqStats()
+    restored.load_state(stats.state())
+    assert restored.to_dict() == stats.to_dict()
+
+
+def write_reads(path, reads, mate):
+    """Write reads to fastq."""
+    with open(path, 'wt') as wt:
+        for i, (seq, qual) in enumerate(reads):
+            wt.write('@r%d/%d\n%s\n+\n%s\n' % (i, mate, seq, qual))
+
+
+@pytest.mark.parametrize('mode', ['serial', 'batch', 'parallel'])
+def test_check_fastq_stats(tmp_path, monkeypatch, mode):
+    if mode == 'serial':
+        monkeypatch.setattr(deal_fastq, 'batch_fastq', None)
+    reads1, reads2 = random_reads(seed=1), random_reads(seed=2)
+    fastq1 = str(tmp_path / 'test_1.fq')
+    fastq2 = str(tmp_path / 'test_2.fq')
+    write_reads(fastq1, reads1, 1)
+    write_reads(fastq2, reads2, 2)
+    check = CheckFastq(fastq1, fastq2, dofast=1, stats=True, batch=64,
+                       processes=2 if mode == 'parallel' else 1).check_dict
+    assert not check['pair_error']
+    assert check['file1_stats'] == expected_dict(reads1)
+    assert check['file2_stats'] == expected_dict(reads2)
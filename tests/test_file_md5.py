@@ -0,0 +1,47 @@
+"""Tests of file_md5."""
+import hashlib
+import os
+
+import file_md5
+from file_md5 import DigestCache, FileMD5, hash_files
+
+
+def write(path, data, mtime=None):
+    """Write data to path and set its mtime."""
+    with open(path, 'wb') as wb:
+        wb.write(data)
+    if mtime is not None:
+        os.utime(path, ns=(mtime, mtime))
+
+
+def test_cache_invalidated_by_mtime(tmp_path):
+    path = str(tmp_path / 'test.txt')
+    write(path, b'first', 10 ** 18)
+    with DigestCache(str(tmp_path / 'cache.db')) as cache:
+        digests = hash_files([path], ('md5', 'sha256'), cache=cache)
+        assert digests[path]['sha256'] == hashlib.sha256(b'first').hexdigest()
+        assert cache.get(os.path.abspath(path), ('md5', ))
+        # same size, so only mtime tells it is changed
+        write(path, b'other', 2 * 10 ** 18)
+        assert not cache.get(os.path.abspath(path), ('md5', ))
+        digests = hash_files([path], cache=cache)
+        assert digests[path]['md5'] == hashlib.md5(b'other').hexdigest()
+
+
+def test_file_changed_while_hashing_not_cached(tmp_path, monkeypatch):
+    path = str(tmp_path / 'test.txt')
+    write(path, b'first', 10 ** 18)
+    digests = FileMD5.digests
+
+    def changing(self, algorithms=('md5', ), size=1 << 24):
+        result = digests(self, algorithms, size)
+        write(path, b'second', 2 * 10 ** 18)
+        return result
+
+    with DigestCache(str(tmp_path / 'cache.db')) as cache:
+        monkeypatch.setattr(file_md5.FileMD5, 'digests', changing)
+        hash_files([path], cache=cache)
+        monkeypatch.setattr(file_md5.FileMD5, 'digests', digests)
+        assert not cache.get(os.path.abspath(path), ('md5', ))
+        result = hash_files([path], cache=cache)
+        assert result[path]['md5'] == hashlib.md5(b'second').hexdigest()
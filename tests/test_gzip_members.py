@@ -0,0 +1,26 @@
+"""Tests of gzip_members."""
+import gzip
+import random
+
+import pytest
+
+import gzip_members
+
+
+def magic_payload():
+    """Get data with gzip magic bytes, they are kept by level 0."""
+    rng = random.Random(1)
+    return b''.join(b'\x1f\x8b\x08\x00' + bytes(
+        rng.randrange(256) for _ in range(60)) for _ in range(500))
+
+
+@pytest.mark.parametrize('data, multi', [
+    (gzip.compress(magic_payload(), 0), False),
+    (gzip.compress(b'x' * 1000) + gzip.compress(b'y'), True),
+    (gzip.compress(b'x' * 1000) + b'\x1f\x8b\x08garbage', False),
+    (b'\x1f\x8b', False)])
+def test_is_multi_member(tmp_path, data, multi):
+    path = str(tmp_path / 'test.gz')
+    with open(path, 'wb') as wb:
+        wb.write(data)
+    assert gzip_members.is_multi_member(path) == multi
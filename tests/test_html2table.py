@@ -0,0 +1,121 @@
+"""Tests of html2table."""
+import pytest
+
+import html2table
+from html2table import Html2Table, extract_tables, parse_dir
+
+NESTED = """<html><body>
+<table class="outer zebra">
+<tr><th>key</th><th>value</th></tr>
+<tr><td>a</td><td>1</td></tr>
+<tr><td>b</td><td><table><tr><th>x</th></tr><tr><td>y</td></tr></table></td></tr>
+</table>
+</body></html>
+"""
+
+
+def test_nested_table_cells_not_merged(tmp_path):
+    path = str(tmp_path / 'test.html')
+    with open(path, 'w') as wt:
+        wt.write(NESTED)
+    html = Html2Table(path)
+    html.parse(['class: zebra'], stream=True)
+    df = html.df_dict['class: zebra']
+    assert list(df.columns) == ['key', 'value']
+    assert list(df['key']) == ['a', 'b']
+    assert df['value'][0] == '1'
+
+TABLES = """<html><body>
+<p>before</p>
+<table class="zebra run-metatable"><thead>
+<tr><th>Run</th><th>Reads</th></tr></thead><tbody>
+<tr><td>ERR1 </td><td><b>10</b></td></tr>
+<tr><td>ERR2</td><td>20</td></tr></tbody>
+</table>
+<table id="second"><tr><th>a</th><th>b</th><th>c</th></tr>
+<tr><td>1</td><td>2</td><td>3</td></tr></table>
+<table id="second"><tr><th>other</th></tr></table>
+<table id="empty"><tr><th>x</th></tr></table>
+<table id="bad"><tr><td>1</td></tr></table>
+</body></html>
+"""
+ATTRIBUTES = ['class: run-metatable', 'class: zebra run-metatable',
+              'id: second', 'id: empty', 'id: missing']
+
+
+def test_stream_same_as_tree(tmp_path):
+    path = str(tmp_path / 'test.html')
+    with open(path, 'w') as wt:
+        wt.write(TABLES)
+    html = Html2Table(path)
+    html.parse(ATTRIBUTES)
+    tree = html.df_dict
+    html.parse(ATTRIBUTES, stream=True)
+    assert list(html.df_dict) == ATTRIBUTES
+    for name in ATTRIBUTES:
+        if tree[name] is None:
+            assert html.df_dict[name] is None
+        else:
+            assert tree[name].equals(html.df_dict[name])
+    df = html.df_dict['class: run-metatable']
+    assert df.to_dict('list') == {'Run': ['ERR1', 'ERR2'],
+                                  'Reads': ['10', '20']}
+    assert list(html.df_dict['id: second'].columns) == ['a', 'b', 'c']
+    assert html.df_dict['id: empty'].to_dict('list') == {'x': []}
+    assert html.df_dict['id: missing'] is None
+    # values without header
+    for stream in (False, True):
+        with pytest.raises(ValueError):
+            html.parse(['id: bad'], stream)
+
+
+def test_parse_dir(tmp_path):
+    for name in ('a.html', 'b.htm', 'c.txt'):
+        with open(str(tmp_path / name), 'w') as wt:
+            wt.write(TABLES)
+    result = parse_dir(str(tmp_path), ['id: second'], processes=2)
+    assert sorted(result) == [str(tmp_path / x) for x in ('a.html',
+                                                           'b.htm')]
+    for df_dict in result.values():
+        assert df_dict['id: second'].to_dict('list') == {
+            'a': ['1'], 'b': ['2'], 'c': ['3']}
+
+
+@pytest.mark.parametrize('fmt', ['pickle', 'parquet', 'feather'])
+def test_extract_tables_cache(tmp_path, monkeypatch, fmt):
+    if fmt != 'pickle':
+        pytest.importorskip('pyarrow')
+    paths = [str(tmp_path / ('%s.html' % x)) for x in 'ab']
+    for path in paths:
+        with open(path, 'w') as wt:
+            wt.write(TABLES)
+    parsed = []
+    parse_file = html2table._parse_file
+
+    def counting(args):
+        parsed.append((args[0], list(args[1])))
+        return parse_file(args)
+
+    monkeypatch.setattr(html2table, '_parse_file', counting)
+    cachedir = str(tmp_path / 'cache')
+    names = ['id: second', 'id: missing']
+    first = extract_tables(paths, names, cachedir, fmt)
+    assert len(parsed) == 2
+    # cached tables, also the missing one
+    second = extract_tables(paths, names, cachedir, fmt)
+    assert len(parsed) == 2
+    for path in paths:
+        assert first[path]['id: second'].equals(second[path]['id: second'])
+        assert second[path]['id: missing'] is None
+    # only the new selector is parsed
+    extract_tables(paths[:1], names + ['class: zebra'], cachedir, fmt)
+    assert parsed[2:] == [(paths[0], ['class: zebra'])]
+    # same content is not parsed again, new content is
+    with open(paths[1], 'w') as wt:
+        wt.write(TABLES)
+    with open(paths[0], 'w') as wt:
+        wt.write(TABLES.replace('<td>1</td>', '<td>9</td>'))
+    result = extract_tables(paths, names, cachedir, fmt)
+    assert parsed[3:] == [(paths[0], names)]
+    assert list(result[paths[0]]['id: second']['a']) == ['9']
+    assert list(result[paths[1]]['id: second']['a']) == ['1']
@@ -0,0 +1,111 @@
+"""Tests of instrument."""
+import json
+
+import pytest
+
+import instrument
+from deal_fastq import CheckFastq
+
+
+@pytest.fixture
+def metrics():
+    """Enable instrumentation for a test, drop its metrics after it."""
+    instrument.reset()
+    instrument.enable()
+    yield instrument
+    instrument.enable(False)
+    instrument.reset()
+
+
+def values(name):
+    """Get {labels: value or (seconds, count)} of metric name."""
+    snapshot = instrument.snapshot()
+    result = dict((tuple(sorted(x['labels'].items())), x['value'])
+                  for x in snapshot['counters'] if x['name'] == name)
+    result.update((tuple(sorted(x['labels'].items())), (
+        x['seconds'], x['count'])) for x in snapshot['timers']
+        if x['name'] == name)
+    return result
+
+
+def test_disabled_is_noop():
+    items = [b'ab']
+    assert instrument.timed(items, 'read', len) is items
+    with instrument.timer('parse'):
+        instrument.count('reads', 3)
+        instrument.add_time('parse', 1.0)
+    assert instrument.snapshot() == {'counters': [], 'timers': []}
+
+
+def test_counters_and_timers(metrics):
+    metrics.count('reads', 3, backend='zlib')
+    metrics.count('reads', 2, backend='zlib')
+    metrics.count('reads', backend='zcat')
+    with metrics.timer('parse', mode=1):
+        pass
+    metrics.add_time('parse', 2.0, 3, mode=1)
+    timed = metrics.timed(iter([b'ab', b'cde']), 'read', len, backend='x')
+    assert list(timed) == [b'ab', b'cde']
+    # recorded once
+    timed.close()
+    assert values('reads') == {(('backend', 'zcat'), ): 1,
+                               (('backend', 'zlib'), ): 5}
+    seconds, number = values('parse')[(('mode', '1'), )]
+    assert seconds >= 2.0 and number == 4
+    assert values('read')[(('backend', 'x'), )][1] == 2
+    assert values('read_bytes') == {(('backend', 'x'), ): 5}
+    snapshot = metrics.snapshot()
+    metrics.merge(snapshot)
+    assert values('reads')[(('backend', 'zlib'), )] == 10
+    assert values('parse')[(('mode', '1'), )][1] == 8
+
+
+def test_closed_early(metrics):
+    timed = metrics.timed(iter(range(10)), 'numbers')
+    next(timed)
+    del timed
+    assert values('numbers')[()][1] == 1
+
+
+def test_prometheus(metrics, tmp_path):
+    metrics.count('reads', 5, file='a"b\\c\nd')
+    metrics.count('reads', 1)
+    metrics.add_time('parse', 0.5, 2, mode='batch')
+    assert metrics.to_prometheus() == (
+        '# TYPE tools_reads_total counter\n'
+        'tools_reads_total 1\n'
+        'tools_reads_total{file="a\\"b\\\\c\\nd"} 5\n'
+        '# TYPE tools_parse_seconds summary\n'
+        'tools_parse_seconds_sum{mode="batch"} 0.5\n'
+        'tools_parse_seconds_count{mode="batch"} 2\n')
+    path = str(tmp_path / 'metrics.prom')
+    metrics.write(path)
+    with open(path) as rd:
+        assert rd.read() == metrics.to_prometheus()
+    path = str(tmp_path / 'metrics.json')
+    metrics.write(path)
+    with open(path) as rd:
+        assert json.load(rd) == metrics.snapshot()
+
+
+def test_capture(tmp_path):
+    path = str(tmp_path / 'metrics.json')
+    profile = str(tmp_path / 'check.prof')
+    fastq = str(tmp_path / 'test.fq')
+    with open(fastq, 'w') as wt:
+        for i in range(1000):
+            wt.write('@r%d\nACGT\n+\nIIII\n' % i)
+    try:
+        with instrument.capture(path, profile, trace=5):
+            CheckFastq(fastq, dofast=1, processes=2, batch=100)
+    finally:
+        instrument.enable(False)
+    with open(path) as rd:
+        result = json.load(rd)
+    instrument.reset()
+    counters = dict((x['name'], x['value']) for x in result['counters'])
+    assert counters['fastq_reads'] == 1000
+    timers = dict((x['name'], x['count']) for x in result['timers'])
+    # timers of pool workers are merged
+    assert timers['fastq_validate'] == 10
+    assert tmp_path.joinpath('check.prof').stat().st_size > 0
@@ -0,0 +1,85 @@
+"""Tests of read_gzbzfile."""
+import bz2
+import gzip
+
+import pytest
+
+import backends
+from read_gzbzfile import PairedReader, ReadGgBz2Normal, fastq_blocks
+
+
+def write_members(path, number=3000, size=500):
+    """Write fastq of members of size records, return the records."""
+    records = [[b'@r%d' % i, b'ACGT' * 5, b'+', b'I' * 20]
+               for i in range(number)]
+    compress = gzip.compress if path.endswith('.gz') else bz2.compress
+    with open(path, 'wb') as wb:
+        for i in range(0, number, size):
+            wb.write(compress(b''.join(
+                b'\n'.join(x) + b'\n' for x in records[i:i + size])))
+    return records
+
+
+@pytest.mark.parametrize('ext', ['.fq.gz', '.fq.bz2'])
+def test_resume_from_member(tmp_path, ext):
+    path = str(tmp_path / ('test' + ext))
+    records = write_members(path)
+    starts = []
+    with ReadGgBz2Normal(path, binary=True, members=True) as reader:
+        for _ in reader.read_record_lists(size=1 << 14):
+            starts.append(reader.block_start)
+    assert any(x[1] > 0 for x in starts)
+    for number, member, offset in starts:
+        with ReadGgBz2Normal(path, binary=True) as reader:
+            reader.seek_offset(number, member, offset)
+            assert list(reader.read_fastq()) == records[number:]
+
+
+def test_stopped_zcat_not_checked(tmp_path, monkeypatch):
+    path = str(tmp_path / 'test.fq.gz')
+    write_members(path, number=200000, size=200000)
+    checked = []
+    monkeypatch.setattr(backends, 'gzip_garbage',
+                        lambda *args: checked.append(args))
+    with ReadGgBz2Normal(path, backend='zcat', binary=True) as reader:
+        blocks = reader.read_record_lists(size=1 << 16)
+        assert next(blocks)[0][0] == b'@r0'
+        reader.stop()
+        for _ in blocks:
+            pass
+    assert not checked
+    with PairedReader([path, path], backend='zcat', binary=True) as reader:
+        assert next(iter(reader))[0][0] == b'@r0'
+    assert not checked
+
+
+def line_records(path):
+    """Get records of stripped lines by the line reader."""
+    with ReadGgBz2Normal(path) as reader:
+        lines = [x.strip() for x in reader]
+    return [lines[i:i + 4] for i in range(0, len(lines), 4)]
+
+
+@pytest.mark.parametrize('size', [1, 7, 64, 1 << 20])
+def test_blocks_same_as_line_reader(tmp_path, size):
+    path = str(tmp_path / 'test.fq.gz')
+    data = b''.join(b'@r%d 1:N\nACGT%s\n+\n%s\n' % (
+        i, b'N' * (i % 5), b'I' * (4 + i % 5)) for i in range(300))
+    # padded and crlf lines, then an unfinished record
+    data += b' @pad \r\nAC \n+\r\nII\n@last\nAC\n'
+    with open(path, 'wb') as wb:
+        wb.write(gzip.compress(data))
+    expected = line_records(path)
+    chunks = (data[i:i + size] for i in range(0, len(data), size))
+    blocks = list(fastq_blocks(chunks))
+    assert [x.start for x in blocks] == [
+        sum(len(y) for y in blocks[:i]) for i in range(len(blocks))]
+    assert [list(x.text_records()) for x in blocks] == [
+        [[y.decode() for y in z] for z in x] for x in blocks]
+    assert [y.decode() for x in blocks for z in x for y in z] == [
+        y for x in expected for y in x]
+    with ReadGgBz2Normal(path) as reader:
+        assert list(reader.read_fastq()) == expected
+    with ReadGgBz2Normal(path, binary=True) as reader:
+        assert [[y.decode() for y in x] for x in reader.read_fastq()] == \
+            expected
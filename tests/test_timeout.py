@@ -0,0 +1,80 @@
+"""Tests of timeout."""
+import asyncio
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from timeout import DeadlineExceeded, deadline, register_process, remaining
+
+
+def test_inner_expires_first():
+    with deadline(5, 'outer') as outer:
+        with pytest.raises(DeadlineExceeded) as error:
+            with deadline(0.1, 'inner'):
+                time.sleep(5)
+        assert error.value.name == 'inner'
+        assert 0.1 <= error.value.elapsed < 1
+        assert not outer.expired
+        assert remaining() > 4
+    assert remaining() is None
+
+
+def test_outer_expires_in_inner():
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceeded) as error:
+        with deadline(0.2, 'outer'):
+            with deadline(5, 'inner') as inner:
+                assert inner.remaining <= 0.2
+                time.sleep(5)
+    assert error.value.name == 'outer'
+    assert time.monotonic() - start < 1
+
+
+def test_not_swallowed():
+    with pytest.raises(DeadlineExceeded):
+        with deadline(0.1, 'swallow'):
+            try:
+                time.sleep(5)
+            except DeadlineExceeded:
+                pass
+            time.sleep(0.1)
+
+
+def test_no_interrupt_kills_process():
+    with pytest.raises(DeadlineExceeded):
+        with deadline(0.2, 'process', interrupt=False):
+            process = register_process(subprocess.Popen(
+                [sys.executable, '-c', 'import time; time.sleep(30)']))
+            assert process.wait(10) != 0
+
+
+def test_worker_thread():
+    errors = []
+
+    def work():
+        try:
+            with deadline(0.1, 'thread'):
+                while True:
+                    time.sleep(0.01)
+        except DeadlineExceeded as e:
+            errors.append(e.name)
+
+    thread = threading.Thread(target=work)
+    thread.start()
+    thread.join(5)
+    assert errors == ['thread']
+
+
+def test_asyncio_task():
+    async def work():
+        with deadline(5, 'outer'):
+            with pytest.raises(DeadlineExceeded) as error:
+                with deadline(0.1, 'task'):
+                    await asyncio.sleep(5)
+            await asyncio.sleep(0.01)
+        return error.value.name
+
+    assert asyncio.run(work()) == 'task'